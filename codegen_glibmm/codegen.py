@@ -20,6 +20,7 @@
 # Author: David Zeuthen   <davidz@redhat.com>
 #  (2014) Jonatan Palsson <jonatan.palsson@pelagicore.com>
 
+import re
 import sys
 
 from textwrap import dedent
@@ -32,9 +33,15 @@ from . import dbustypes
 
 SIGNAL_MAX_PARAM = 10
 
+def indent(text, level):
+    """ Indent all non-empty lines of text by level spaces """
+    lines = text.split("\n")
+    return "\n".join([(" " * level + l) if l.strip() else l for l in lines])
+
 class CodeGenerator:
-    def __init__(self, ifaces, namespace, interface_prefix, node_xmls, proxy_h, proxy_cpp, stub_cpp, stub_h, common_cpp, common_h):
+    def __init__(self, ifaces, namespace, interface_prefix, node_xmls, proxy_h, proxy_cpp, stub_cpp, stub_h, common_cpp, common_h, coroutines = False):
         self.ifaces = ifaces
+        self.coroutines = coroutines
         self.proxy_h = proxy_h
         self.proxy_cpp = proxy_cpp
         self.stub_h = stub_h
@@ -94,6 +101,327 @@ class CodeGenerator:
         """
         self.emit(self.common_cpp, text, newline)
 
+    def variant_base (self, gvariant):
+        """ Wrap a GVariant expression created by Arg.gvariant_new in a
+            Glib::VariantBase. Floating references are sunk, borrowed
+            references get a new reference owned by the wrapper.
+            @param gvariant C++ expression evaluating to a GVariant pointer
+        """
+        return "Glib::wrap(g_variant_ref_sink(%s))" % gvariant
+
+    def tuple_lines (self, name, values):
+        """ Generate the lines declaring the array of children of a tuple,
+            to be passed to g_variant_new_tuple() together with its length.
+            Floating children are consumed by the tuple, borrowed ones get a
+            new reference.
+            @param name name of the C array
+            @param values C++ expressions evaluating to GVariant pointers
+        """
+        lines = ["GVariant *%s[] = {" % name]
+        for v in values[:-1]:
+            lines.append("    %s," % v)
+        lines.append("    %s" % values[-1])
+        lines.append("};")
+        return lines
+
+    def fixed_array_view (self, i, element):
+        """ Type of the non-owning view of a fixed-size array
+            @param element C++ type of the array elements
+        """
+        return "%sTypeWrap::FixedArrayView<%s>" % (i.cpp_class_name, element)
+
+    def param_lines (self, head, params, tail, indent = "    "):
+        """ Generate the lines of a function declaration or call with one
+            parameter per line
+            @param head the text up to the opening parenthesis
+            @param params list of parameters
+            @param tail the text following the closing parenthesis
+            @param indent indentation of the parameters relative to head
+        """
+        if len(params) == 0:
+            return [head + ")" + tail]
+        lines = [head]
+        for p in params[:-1]:
+            lines.append("%s%s," % (indent, p))
+        lines.append("%s%s)%s" % (indent, params[-1], tail))
+        return lines
+
+    def call_params_proxy (self, m, params, callback):
+        """ Append the callback, cancellable, timeout and flags to the
+            parameters of the call of method m, one-way calls have none
+        """
+        if m.no_reply:
+            return params
+        return params + [callback,
+                         "const Glib::RefPtr<Gio::Cancellable> &cancellable",
+                         "int timeoutMsec",
+                         "Gio::DBus::CallFlags flags"]
+
+    def call_defaults_proxy (self, m, params, names, callback):
+        """ Generate the overload of the call of method m using the default
+            timeout and flags of the proxy, and no cancellable
+            @param params list of in-argument declarations
+            @param names list of in-argument names
+            @param callback name of the callback parameter
+            @return (declaration lines, body line)
+        """
+        decl = params + ["const Gio::SlotAsyncReady &%s" % callback]
+        args = ", ".join(names + [callback, "Glib::RefPtr<Gio::Cancellable>()", "-1", "m_defaultCallFlags"])
+        return (decl, "%s(%s);" % (m.name, args))
+
+    def finish_variants_proxy (self, m):
+        """ The _finish overloads to generate for method m. The second
+            overload, returning views of fixed-size arrays, is only generated
+            if the method has such out-arguments. One-way calls have none.
+        """
+        if m.no_reply:
+            return []
+        for a in m.out_args:
+            if a.fixed_array_element:
+                return [False, True]
+        return [False]
+
+    def finish_type_proxy (self, i, a, view):
+        """ Type of out-argument a in a _finish overload """
+        if view and a.fixed_array_element:
+            return self.fixed_array_view(i, a.fixed_array_element)
+        return a.cpptype_out
+
+    def method_params_proxy (self, i, m, prefix):
+        """ Generate the lines building the parameter tuple "base" of a
+            method call from the in-arguments of method m
+            @param prefix string prepended to the argument names
+        """
+        lines = ["Glib::VariantContainerBase base;"]
+        if m.unix_fds:
+            lines.append("Glib::RefPtr<Gio::UnixFDList> fdList = Gio::UnixFDList::create();")
+        if len(m.in_args) == 0:
+            return lines
+
+        values = []
+        for a in m.in_args:
+            if "v" in a.signature:
+                # Variant arguments are templated, glibmm creates the contents
+                values.append("g_variant_new_variant(Glib::Variant<T>::create(%s%s).gobj())" % (prefix, a.name))
+            else:
+                values.append(a.gvariant_new(prefix + a.name, i.cpp_class_name))
+        lines += self.tuple_lines("params", values)
+        lines.append("base = Glib::VariantContainerBase(g_variant_ref_sink(g_variant_new_tuple(params, %d)), false);" % len(values))
+        return lines
+
+    def method_reply_proxy (self, i, m, view):
+        """ Generate the lines taking the out-arguments of method m from the
+            reply "wrapped", in a single pass
+            @param view boolean indicating whether fixed-size arrays are
+                        returned as views
+        """
+        lines = []
+        if len(m.out_args) > 0:
+            lines.append("GVariantIter iter;")
+            lines.append("g_variant_iter_init(&iter, wrapped.gobj());")
+            lines.append("")
+
+        for a in m.out_args:
+            varname = a.name + "_variant"
+            lines.append("GVariant *%s = g_variant_iter_next_value(&iter);" % (varname))
+            if view and a.fixed_array_element:
+                # The view keeps the reply alive, no elements are copied
+                lines.append("out_%s = %s(Glib::VariantBase(%s, false));" % (a.name, self.finish_type_proxy(i, a, view), varname))
+            else:
+                lines.append("out_%s = %s;" % (a.name, a.gvariant_get(varname, i.cpp_class_name)))
+                lines.append("g_variant_unref(%s);" % (varname))
+            lines.append("")
+        return lines
+
+    def sync_in_params_proxy (self, m, prefix):
+        """ Declarations of the in-arguments of the blocking and pending
+            calls of method m
+        """
+        params = []
+        for a in m.in_args:
+            if "v" in a.signature:
+                params.append("const T &%s%s" % (prefix, a.name))
+            else:
+                params.append("%s %s%s" % (a.cpptype_in, prefix, a.name))
+        return params
+
+    def shared_args_proxy (self, m):
+        """ The trailing arguments of the calls of method m through the
+            reply cache and the single flights of the proxy, the time to live
+            of its replies and whether identical calls are shared. None if
+            the method uses neither.
+        """
+        if m.cacheable == None and not m.single_flight:
+            return None
+        ttl = m.cacheable if m.cacheable != None else -1
+        return "%d, %s" % (ttl, "true" if m.single_flight else "false")
+
+    def sync_proxy (self, i, m, prefix, default = ""):
+        """ Generate the blocking call of method m, which waits for the reply
+            without running the main loop
+            @param prefix string prepended to the in-argument names
+            @param default default value of the timeout in declarations
+            @return (parameter declarations, body lines)
+        """
+        params = self.sync_in_params_proxy(m, prefix)
+        for a in m.out_args:
+            params.append("%s& out_%s" % (a.cpptype_out, a.name))
+        params.append("int timeoutMsec" + default)
+
+        lines = self.method_params_proxy(i, m, prefix)
+        lines.append("")
+        lines.append("Glib::VariantContainerBase wrapped;")
+        if m.unix_fds:
+            lines += ["Glib::RefPtr<Gio::UnixFDList> outFdList;",
+                      "wrapped = m_proxy->call_sync(",
+                      "    \"%s\"," % m.name,
+                      "    base,",
+                      "    Glib::RefPtr<Gio::Cancellable>(),",
+                      "    fdList,",
+                      "    outFdList,",
+                      "    timeoutMsec,",
+                      "    m_defaultCallFlags);",
+                      "fdList = outFdList;"]
+        else:
+            shared = self.shared_args_proxy(m)
+            if shared:
+                call = ["wrapped = callSharedSync(\"%s\", base, timeoutMsec, %s);" % (m.name, shared)]
+            else:
+                call = ["wrapped = m_proxy->call_sync(",
+                        "    \"%s\"," % m.name,
+                        "    base,",
+                        "    timeoutMsec,",
+                        "    m_defaultCallFlags);"]
+            lines += call
+        lines.append("")
+        lines += self.method_reply_proxy(i, m, False)
+        while lines[-1] == "":
+            lines.pop()
+        return (params, lines)
+
+    def async_proxy (self, i, m, prefix, default = ""):
+        """ Generate the call of method m returning a pending call, which is
+            completed with the result for the _finish function
+            @param prefix string prepended to the in-argument names
+            @param default default value of the timeout in declarations
+            @return (parameter declarations, body lines)
+        """
+        params = self.sync_in_params_proxy(m, prefix)
+        params.append("int timeoutMsec" + default)
+
+        names = [prefix + a.name for a in m.in_args]
+        args = ", ".join(names + ["sigc::bind(sigc::ptr_fun(&%sPendingCall::complete), pending)" % i.cpp_class_name,
+                                  "Glib::RefPtr<Gio::Cancellable>()",
+                                  "timeoutMsec",
+                                  "m_defaultCallFlags"])
+        lines = ["std::shared_ptr<{0}PendingCall> pending(new {0}PendingCall());".format(i.cpp_class_name),
+                 "%s(%s);" % (m.name, args),
+                 "return pending;"]
+        return (params, lines)
+
+    def co_result_type_proxy (self, m):
+        """ Type the awaitable call of method m results in """
+        if len(m.out_args) == 0:
+            return "void"
+        if len(m.out_args) == 1:
+            return m.out_args[0].cpptype_out
+        return "std::tuple<%s>" % ", ".join([a.cpptype_out for a in m.out_args])
+
+    def co_call_proxy (self, i, m, prefix):
+        """ Generate the awaitable call of method m. The parameters are
+            marshalled right away, the call is started when awaited.
+            @param prefix string prepended to the in-argument names
+            @return (parameter declarations, body lines)
+        """
+        result = self.co_result_type_proxy(m)
+        lines = self.method_params_proxy(i, m, prefix)
+        lines.append("")
+        shared = self.shared_args_proxy(m)
+        if shared:
+            # Started through the cache and single flights like the other calls
+            lines += ["return %sAwaitable<%s>(m_proxy, [this, base](const Gio::SlotAsyncReady &slot) {" % (i.cpp_class_name, result),
+                      "    callShared(\"%s\", base, slot, Glib::RefPtr<Gio::Cancellable>(), -1, m_defaultCallFlags, %s);" % (m.name, shared),
+                      "}, &%s_co_finish);" % m.name]
+            return (self.sync_in_params_proxy(m, prefix), lines)
+        args = ["m_proxy", "\"%s\"" % m.name, "base"]
+        if i.unix_fds:
+            if m.unix_fds:
+                args.append("fdList")
+            else:
+                args.append("Glib::RefPtr<Gio::UnixFDList>()")
+        args += ["&%s_co_finish" % m.name, "-1", "m_defaultCallFlags"]
+        lines.append("return %sAwaitable<%s>(%s);" % (i.cpp_class_name, result, ", ".join(args)))
+        return (self.sync_in_params_proxy(m, prefix), lines)
+
+    def co_finish_proxy (self, i, m):
+        """ Generate the body of the static function returning the result
+            of an awaited call of method m
+        """
+        lines = ["Glib::VariantContainerBase wrapped;"]
+        if self.shared_args_proxy(m):
+            lines.append("wrapped = finishShared(result);")
+        elif m.unix_fds:
+            lines.append("Glib::RefPtr<Gio::UnixFDList> fdList;")
+            lines.append("wrapped = proxy->call_finish(result, fdList);")
+        else:
+            lines.append("wrapped = proxy->call_finish(result);")
+        lines.append("")
+
+        for a in m.out_args:
+            lines.append("%s out_%s;" % (a.cpptype_out, a.name))
+        if len(m.out_args) > 0:
+            lines.append("")
+        lines += self.method_reply_proxy(i, m, False)
+
+        if len(m.out_args) == 1:
+            lines.append("return out_%s;" % m.out_args[0].name)
+        elif len(m.out_args) > 1:
+            values = ", ".join(["std::move(out_%s)" % a.name for a in m.out_args])
+            lines.append("return std::make_tuple(%s);" % values)
+        while lines[-1] == "":
+            lines.pop()
+        return lines
+
+    def method_call_proxy (self, m):
+        """ Generate the lines starting the asynchronous call of method m,
+            with the parameters built by method_params_proxy
+        """
+        shared = self.shared_args_proxy(m)
+        if shared:
+            return ["callShared(\"%s\", base, callback, cancellable, timeoutMsec, flags, %s);" % (m.name, shared)]
+        if m.no_reply:
+            # Sent as a plain message, no reply is waited for or tracked.
+            # Proxies on peer-to-peer connections have no name, and their
+            # messages no destination.
+            lines = ["Glib::ustring name = m_proxy->get_name();",
+                     "Glib::RefPtr<Gio::DBus::Message> message = Glib::wrap(g_dbus_message_new_method_call(",
+                     "    name.empty() ? NULL : name.c_str(),",
+                     "    m_proxy->get_object_path().c_str(),",
+                     "    m_proxy->get_interface_name().c_str(),",
+                     "    \"%s\"));" % m.name,
+                     "message->set_body(base);",
+                     "message->set_flags(Gio::DBus::MESSAGE_FLAGS_NO_REPLY_EXPECTED);"]
+            if m.unix_fds:
+                lines.append("message->set_unix_fd_list(fdList);")
+            lines.append("m_proxy->get_connection()->send_message(message);")
+            return lines
+        if m.unix_fds:
+            return ["m_proxy->call(",
+                    "    \"%s\"," % m.name,
+                    "    base,",
+                    "    callback,",
+                    "    cancellable,",
+                    "    fdList,",
+                    "    timeoutMsec,",
+                    "    flags);"]
+        return ["m_proxy->call(",
+                "    \"%s\"," % m.name,
+                "    callback,",
+                "    cancellable,",
+                "    base,",
+                "    timeoutMsec,",
+                "    flags);"]
+
     def generate_intro_proxy(self):
         """ Generate a header for the proxy cpp file """
         self.emit_cpp_p(dedent('''/*
@@ -103,6 +431,9 @@ class CodeGenerator:
                      */
                      ''') %(config.VERSION))
 
+        self.emit_cpp_p('#include <map>')
+        self.emit_cpp_p('#include <mutex>')
+        self.emit_cpp_p('#include <tuple>')
         self.emit_cpp_p('#include "%s"' %(self.proxy_h.name))
 
     def declare_types_proxy(self):
@@ -130,7 +461,67 @@ class CodeGenerator:
                                           const std::string &objectPath,
                                           const Gio::SlotAsyncReady &slot);
 
-                static Glib::RefPtr<{i.cpp_class_name}> createForBusFinish (Glib::RefPtr<Gio::AsyncResult> result);''').format(**locals()))
+                // Creates the proxy in the given main context, which the slot
+                // and the signals are dispatched in. Replies are dispatched in
+                // the thread-default context of the thread making the call.
+                static void createForBus (Gio::DBus::BusType busType,
+                                          Gio::DBus::ProxyFlags proxyFlags,
+                                          const std::string &name,
+                                          const std::string &objectPath,
+                                          const Gio::SlotAsyncReady &slot,
+                                          const Glib::RefPtr<Glib::MainContext> &context);
+
+                static Glib::RefPtr<{i.cpp_class_name}> createForBusFinish (Glib::RefPtr<Gio::AsyncResult> result);
+
+                // Creates the proxy on an existing connection, which may also be
+                // a peer-to-peer connection without a bus. The name is empty in
+                // that case. The messages are checked against the introspection
+                // data of the interface.
+                static void createForConnection (const Glib::RefPtr<Gio::DBus::Connection> &connection,
+                                                 Gio::DBus::ProxyFlags proxyFlags,
+                                                 const std::string &name,
+                                                 const std::string &objectPath,
+                                                 const Gio::SlotAsyncReady &slot);
+
+                static Glib::RefPtr<{i.cpp_class_name}> createForConnectionFinish (Glib::RefPtr<Gio::AsyncResult> result);
+
+                // Returns the proxy shared by all users of the same bus, name
+                // and object path, and creates it if there is none. It is freed
+                // once the last user drops it. A lazy proxy loads no properties
+                // and subscribes to no signals when it is created. Its
+                // properties are then read from the remote object, until
+                // subscribeSignals() is called, after which they are cached.
+                // Creating the proxy blocks until the bus is connected and the
+                // owner of the name is known, getting an existing one does not.
+                // Throws Glib::Error if the proxy cannot be created.
+                static std::shared_ptr<{i.cpp_class_name}> getShared (Gio::DBus::BusType busType,
+                                                         const std::string &name,
+                                                         const std::string &objectPath,
+                                                         bool lazy = false);
+
+                // Subscribes a lazy proxy to its signals and property changes,
+                // does nothing for other proxies
+                void subscribeSignals();
+
+                // Subscribes to property changes and fetches all properties
+                // with one asynchronous GetAll call, so that reading them does
+                // not block afterwards
+                void loadProperties(const Gio::SlotAsyncReady &slot);
+                void loadProperties_finish(const Glib::RefPtr<Gio::AsyncResult> &result);
+
+                // Used by method calls without an explicit timeout and flags.
+                // A timeout of -1 is the default timeout of GDBus.
+                void setDefaultTimeout(int timeoutMsec);
+                void setDefaultCallFlags(Gio::DBus::CallFlags flags);''').format(**locals()))
+
+            if i.cacheable:
+                self.emit_h_p(indent(dedent('''
+
+                    // Replies of cacheable methods are cached for all their
+                    // calls. The cache is cleared when the owner of the name
+                    // changes, or explicitly with invalidateCache().
+                    void invalidateCache();
+                    void setCacheSize(gsize maxReplies);'''), 4))
 
             self.emit_h_p("")
 
@@ -145,79 +536,124 @@ class CodeGenerator:
                 if templated is True:
                     # Template methods needs to be implemented in the header
 
-                    # Begin method signature
-                    self.emit_h_p("    template <typename T>")
-                    self.emit_h_p("    void %s(" % m.name)
+                    params = []
                     for a in m.in_args:
                         # Variants needs special attention
                         if "v" in a.signature:
-                            self.emit_h_p("        T %s," % (a.name))
+                            params.append("const T &%s" % (a.name))
                         else:
-                            self.emit_h_p("        %s %s," % (a.cpptype_in, a.name))
-                    self.emit_h_p("        const Gio::SlotAsyncReady &callback)")
+                            params.append("%s %s" % (a.cpptype_in, a.name))
+
+                    if not m.no_reply:
+                        (decl, body) = self.call_defaults_proxy(m, params, [a.name for a in m.in_args], "callback")
+                        self.emit_h_p("    template <typename T>")
+                        for line in self.param_lines("void %s(" % m.name, decl, ""):
+                            self.emit_h_p("    " + line)
+                        self.emit_h_p("    {")
+                        self.emit_h_p("        " + body)
+                        self.emit_h_p("    }")
+                        self.emit_h_p("")
+
+                    # Begin method signature
+                    self.emit_h_p("    template <typename T>")
+                    params = self.call_params_proxy(m, params, "const Gio::SlotAsyncReady &callback")
+                    for line in self.param_lines("void %s(" % m.name, params, ""):
+                        self.emit_h_p("    " + line)
                     self.emit_h_p("    {")
                     # End method signature
 
-                     #TODO: Seems like the handling of one param could be made the same as for more than one params?
-
                     #Begin method implementation
-                    self.emit_h_p("        Glib::VariantContainerBase base;");
-                    if (len(m.in_args) > 1):
-                        self.emit_h_p("        std::vector<Glib::VariantBase> params;")
-                        for a in m.in_args:
-                            if "v" in a.signature:
-                                self.emit_h_p("        Glib::Variant<Glib::Variant<T> > %s_variantValue;" % (a.name))
-                                self.emit_h_p("        %s_variantValue = Glib::Variant<Glib::Variant<T> >::create(Glib::Variant<T>::create(%s_param));" % (a.name, a.name))
-                                self.emit_h_p("        params.push_back(%s_variantValue);" % (a.name))
-                            else:
-                                self.emit_h_p("        " + a.cpptype_send(a.name + "_param", a.name, i.cpp_class_name) + "")
-                                self.emit_h_p("        params.push_back(%s_param);" % (a.name))
-                    elif (len(m.in_args) == 1):
-                        for a in m.in_args:
-                            if "v" in a.signature:
-                                self.emit_h_p("        Glib::Variant<Glib::Variant<T> > variantValue;")
-                                self.emit_h_p("        variantValue = Glib::Variant<Glib::Variant<T> >::create(Glib::Variant<T>::create(%s));" % (a.name))
-                                self.emit_h_p("        Glib::VariantBase params = variantValue;")
-                            else:
-                                self.emit_h_p("        " + a.cpptype_send("params", a.name, i.cpp_class_name) + "")
-                    if (len(m.in_args) > 0):
-                        self.emit_h_p("        base = Glib::VariantContainerBase::create_tuple(params);")
-
-                    self.emit_h_p(dedent('''
-                            m_proxy->call(
-                                "{m.name}",
-                                callback,
-                                base);
-                        }}''').format(**locals()))
+                    for line in self.method_params_proxy(i, m, ""):
+                        self.emit_h_p("        " + line)
+
+                    self.emit_h_p("")
+                    for line in self.method_call_proxy(m):
+                        self.emit_h_p("        " + line)
+                    self.emit_h_p("    }")
                     # End method implementation
 
                 else:
                     # Async call method, the non template code just have their method definitions in the header
-                    self.emit_h_p("    void %s (" % m.name)
+                    params = []
                     for a in m.in_args:
-                        self.emit_h_p("        %s %s," % (a.cpptype_in, a.name))
-                    self.emit_h_p("        const Gio::SlotAsyncReady &slot);")
+                        params.append("%s %s" % (a.cpptype_in, a.name))
+                    if not m.no_reply:
+                        (decl, body) = self.call_defaults_proxy(m, params, [], "slot")
+                        for line in self.param_lines("void %s (" % m.name, decl, ";"):
+                            self.emit_h_p("    " + line)
+                        self.emit_h_p("")
+                    params = self.call_params_proxy(m, params, "const Gio::SlotAsyncReady &slot")
+                    for line in self.param_lines("void %s (" % m.name, params, ";"):
+                        self.emit_h_p("    " + line)
 
                 self.emit_h_p("")
 
-                # _finish method
-                self.emit_h_p("    void %s_finish (" % m.name)
-                for a in m.out_args:
-                    self.emit_h_p("        %s& %s," % (a.cpptype_out, a.name))
-                self.emit_h_p("        const Glib::RefPtr<Gio::AsyncResult>& res);")
-
-                self.emit_h_p("")
+                # _finish method, with an overload viewing fixed-size arrays
+                for view in self.finish_variants_proxy(m):
+                    self.emit_h_p("    void %s_finish (" % m.name)
+                    for a in m.out_args:
+                        self.emit_h_p("        %s& %s," % (self.finish_type_proxy(i, a, view), a.name))
+                    self.emit_h_p("        const Glib::RefPtr<Gio::AsyncResult>& res);")
+
+                    self.emit_h_p("")
+
+                # Awaitable call, completed from the main context
+                if self.coroutines and not m.no_reply:
+                    (co_params, co_body) = self.co_call_proxy(i, m, "")
+                    co_head = "%sAwaitable<%s> %s (" % (i.cpp_class_name, self.co_result_type_proxy(m), m.name)
+                    if templated:
+                        self.emit_h_p("    template <typename T>")
+                        for line in self.param_lines(co_head, co_params, ""):
+                            self.emit_h_p("    " + line)
+                        self.emit_h_p("    {")
+                        for line in co_body:
+                            self.emit_h_p(("        " + line).rstrip())
+                        self.emit_h_p("    }")
+                    else:
+                        for line in self.param_lines(co_head, co_params, ";"):
+                            self.emit_h_p("    " + line)
+                    self.emit_h_p("")
+
+                # Blocking call, and a call returning a pending call to wait for
+                if not m.no_reply:
+                    (sync_params, sync_body) = self.sync_proxy(i, m, "", " = -1")
+                    (async_params, async_body) = self.async_proxy(i, m, "", " = -1")
+                    sync_head = "void %s_sync (" % m.name
+                    async_head = "std::shared_ptr<%sPendingCall> %s_async (" % (i.cpp_class_name, m.name)
+                    if templated:
+                        for (head, params, body) in [(sync_head, sync_params, sync_body), (async_head, async_params, async_body)]:
+                            self.emit_h_p("    template <typename T>")
+                            for line in self.param_lines(head, params, ""):
+                                self.emit_h_p("    " + line)
+                            self.emit_h_p("    {")
+                            for line in body:
+                                self.emit_h_p(("        " + line).rstrip())
+                            self.emit_h_p("    }")
+                            self.emit_h_p("")
+                    else:
+                        for line in self.param_lines(sync_head, sync_params, ";"):
+                            self.emit_h_p("    " + line)
+                        self.emit_h_p("")
+                        for line in self.param_lines(async_head, async_params, ";"):
+                            self.emit_h_p("    " + line)
+                        self.emit_h_p("")
 
             # Generate all properties for this interface
             for p in i.properties:
                 if p.readable:
+                    if p.emits_changed_signal == 'false':
+                        self.emit_h_p("     // Blocks in a Properties.Get call to the remote object every time")
                     self.emit_h_p("     {p.cpptype_out} {p.name}_get();".format(**locals()))
+                    if p.fixed_array_element:
+                        view_type = self.fixed_array_view(i, p.fixed_array_element)
+                        self.emit_h_p("     {view_type} {p.name}_get_view();".format(**locals()))
                 if p.writable:
                     self.emit_h_p("     void {p.name}_set({p.cpptype_in}, const Gio::SlotAsyncReady &);".format(**locals()))
                     self.emit_h_p("     void {p.name}_set_finish(const Glib::RefPtr<Gio::AsyncResult>&);".format(**locals()))
 
 
             # Generate all signals for this interface
+            subscribed_signals = []
             for s in i.signals:
                 # Sigc does not allow an infinite number of parameters for signals.
                 # The maximum number of signals is specified in SIGNAL_MAX_PARAM. A
@@ -231,20 +667,111 @@ class CodeGenerator:
                     params.append(a.cpptype_out)
                 params = ", ".join(params)
                 self.emit_h_p(dedent('''sigc::signal<void, {params} > {s.name}_signal;''').format(**locals()))
+                subscribed_signals.append(s)
+
+            # Subscriptions to single signals, filtered by the bus daemon
+            for s in subscribed_signals:
+                slot_type = self.signal_slot_type_proxy(s)
+                self.emit_h_p(indent(dedent('''
+                // Calls the slot for {s.name} only, with the signals filtered
+                // by the bus on arg0 unless it is empty. The flags select
+                // matching arg0 as a name or path namespace instead. Only
+                // arg0 can be matched, GDBus subscriptions have no argN.
+                // Returns the id for unsubscribe().
+                guint {s.name}_subscribe (const {slot_type} &slot,
+                                          const std::string &arg0 = "",
+                                          Gio::DBus::SignalFlags flags = Gio::DBus::SIGNAL_FLAGS_NONE);''').format(**locals()), 4))
+            if subscribed_signals:
+                self.emit_h_p("")
+                self.emit_h_p("    void unsubscribe (guint id);")
 
             # Reference handling (needed for creating Glib::RefPtr, signal handler and private constructor
-            self.emit_h_p(dedent('''
+            cache_init = ""
+            if i.cacheable:
+                cache_init = ("\n    this->m_proxy->property_g_name_owner().signal_changed().connect("
+                              "\n        sigc::mem_fun(this, &%s::invalidateCache));" % i.cpp_class_name)
+            self.emit_h_p(indent(dedent('''
+                ~{i.cpp_class_name}();
                 void reference() {{}}
                 void unreference() {{}}
                 void handle_signal (const Glib::ustring& sender_name, const Glib::ustring& signal_name, const Glib::VariantContainerBase& parameters);
 
                 private:
-                {i.cpp_class_name} (Glib::RefPtr<Gio::DBus::Proxy> proxy) : Glib::ObjectBase() {{
+                {i.cpp_class_name} (Glib::RefPtr<Gio::DBus::Proxy> proxy) : Glib::ObjectBase(),
+                    m_defaultCallFlags(Gio::DBus::CALL_FLAGS_NONE),
+                    m_lazy(false),
+                    m_signalsId(0),
+                    m_propertiesId(0) {{
                     this->m_proxy = proxy;
-                    this->m_proxy->signal_signal().connect(sigc::mem_fun(this, &{i.cpp_class_name}::handle_signal));
+                    this->m_proxy->signal_signal().connect(sigc::mem_fun(this, &{i.cpp_class_name}::handle_signal));{cache_init}
                 }}
+                void getRemoteProperty(Glib::VariantBase &property, const Glib::ustring &propertyName, bool updateCache);
+                void updateProperties(GVariant *parameters);
+                void on_subscribed_signal(const Glib::RefPtr<Gio::DBus::Connection>& connection,
+                                          const Glib::ustring& sender_name,
+                                          const Glib::ustring& object_path,
+                                          const Glib::ustring& interface_name,
+                                          const Glib::ustring& signal_name,
+                                          const Glib::VariantContainerBase& parameters);
+                static Glib::RefPtr<Gio::DBus::InterfaceInfo> interfaceInfo();
                 Glib::RefPtr<Gio::DBus::Proxy> m_proxy;
-            }};''').format(**locals()))
+                Gio::DBus::CallFlags m_defaultCallFlags;
+                bool m_lazy;
+                guint m_signalsId;
+                guint m_propertiesId;''').format(**locals()), 4))
+            if i.cacheable:
+                self.emit_h_p("    %sReplyCache m_replyCache;" % i.cpp_class_name)
+            if i.single_flight:
+                self.emit_h_p("    %sSingleFlight m_singleFlight;" % i.cpp_class_name)
+            if i.cacheable or i.single_flight:
+                self.emit_h_p(indent(dedent('''
+                // Calls of cacheable and single-flight methods, answered from
+                // the cache if the reply is known, or with the reply to an
+                // identical call in progress. Replies are cached for ttlMsec,
+                // if it is not negative. The slot gets a result for
+                // finishShared().
+                void callShared(const char *method,
+                                const Glib::VariantContainerBase &parameters,
+                                const Gio::SlotAsyncReady &slot,
+                                const Glib::RefPtr<Gio::Cancellable> &cancellable,
+                                int timeoutMsec,
+                                Gio::DBus::CallFlags flags,
+                                gint ttlMsec,
+                                bool singleFlight);
+                Glib::VariantContainerBase callSharedSync(const char *method,
+                                                          const Glib::VariantContainerBase &parameters,
+                                                          int timeoutMsec,
+                                                          gint ttlMsec,
+                                                          bool singleFlight);
+                void on_shared_reply(const Glib::RefPtr<Gio::AsyncResult> &result,
+                                     std::string key,
+                                     GTask *task,
+                                     gint ttlMsec,
+                                     bool leader);
+                static void on_shared_ready(GObject *source, GAsyncResult *result, gpointer data);
+                static Glib::VariantContainerBase finishShared(const Glib::RefPtr<Gio::AsyncResult> &result);'''), 4).rstrip("\n"))
+
+            if self.coroutines:
+                for m in i.methods:
+                    if not m.no_reply:
+                        result = self.co_result_type_proxy(m)
+                        self.emit_h_p("    static {result} {m.name}_co_finish(const Glib::RefPtr<Gio::DBus::Proxy> &proxy,".format(**locals()))
+                        self.emit_h_p("        const Glib::RefPtr<Gio::AsyncResult> &result);")
+            for s in subscribed_signals:
+                slot_type = self.signal_slot_type_proxy(s)
+                self.emit_h_p(indent(dedent('''
+                static void on_{s.name}_subscribed (const Glib::RefPtr<Gio::DBus::Connection>& connection,
+                                                    const Glib::ustring& sender_name,
+                                                    const Glib::ustring& object_path,
+                                                    const Glib::ustring& interface_name,
+                                                    const Glib::ustring& signal_name,
+                                                    const Glib::VariantContainerBase& parameters,
+                                                    {slot_type} slot);''').format(**locals()), 4).rstrip("\n"))
+            self.emit_h_p("")
+            self.emit_h_p("    friend class %sObjectManagerClient;" % i.cpp_class_name)
+            self.emit_h_p("};")
+
+            self.declare_object_manager_client_proxy(i)
 
             # Close namespaces, in reversed order
             for ns in reversed(i.cpp_namespace_name.split("::")[:-1]):
@@ -267,84 +794,154 @@ class CodeGenerator:
             # Only generate code if this is a non-templated method
             if templated is False:
                 # async begin
-                self.emit_cpp_p('void %s::%s(' % (i.cpp_namespace_name, m.camel_name))
+                params = []
                 for a in m.in_args:
-                    self.emit_cpp_p('        %s arg_%s,'%(a.cpptype_in, a.name))
-                self.emit_cpp_p('        const Gio::SlotAsyncReady &callback)')
+                    params.append("%s arg_%s" % (a.cpptype_in, a.name))
+                if not m.no_reply:
+                    (decl, body) = self.call_defaults_proxy(m, params, ["arg_" + a.name for a in m.in_args], "callback")
+                    for line in self.param_lines("void %s::%s(" % (i.cpp_namespace_name, m.camel_name), decl, "", "        "):
+                        self.emit_cpp_p(line)
+                    self.emit_cpp_p("{")
+                    self.emit_cpp_p("    " + body)
+                    self.emit_cpp_p("}")
+                    self.emit_cpp_p("")
+                params = self.call_params_proxy(m, params, "const Gio::SlotAsyncReady &callback")
+                for line in self.param_lines("void %s::%s(" % (i.cpp_namespace_name, m.camel_name), params, "", "        "):
+                    self.emit_cpp_p(line)
                 self.emit_cpp_p('{')
-                self.emit_cpp_p("    Glib::VariantContainerBase base;");
+                for line in self.method_params_proxy(i, m, "arg_"):
+                    self.emit_cpp_p("    " + line)
 
-                if (len(m.in_args) > 1):
-                    self.emit_cpp_p("std::vector<Glib::VariantBase> params;")
-                    for a in m.in_args:
-                        self.emit_cpp_p("  " + a.cpptype_send(a.name + "_param", a.name, i.cpp_class_name)+ "")
-                        self.emit_cpp_p("  params.push_back(%s_param);" % a.name)
-                elif (len (m.in_args) == 1):
-                    for a in m.in_args:
-                        self.emit_cpp_p("    " + a.cpptype_send("params", a.name, i.cpp_class_name) + "")
+                self.emit_cpp_p("")
+                for line in self.method_call_proxy(m):
+                    self.emit_cpp_p("    " + line)
+                self.emit_cpp_p("}")
 
-                if (len(m.in_args) > 0):
-                    self.emit_cpp_p("    base = Glib::VariantContainerBase::create_tuple(params);")
+                self.emit_cpp_p("")
 
+            # Generate _finish function for above method call, we want this for templated methods as well
+            for view in self.finish_variants_proxy(m):
+                self.emit_cpp_p('void %s::%s_finish(' %(i.cpp_namespace_name, m.camel_name))
+                for a in m.out_args:
+                    self.emit_cpp_p('        %s& out_%s,'%(self.finish_type_proxy(i, a, view), a.name))
                 self.emit_cpp_p(dedent('''
-                    m_proxy->call(
-                        "{m.name}",
-                        callback,
-                        base);
-                }}''').format(**locals()))
+                        const Glib::RefPtr<Gio::AsyncResult>& result)
+                {{
+                    Glib::VariantContainerBase wrapped;''').format(**locals()))
+                if self.shared_args_proxy(m):
+                    self.emit_cpp_p("    wrapped = finishShared(result);")
+                elif m.unix_fds:
+                    self.emit_cpp_p("    Glib::RefPtr<Gio::UnixFDList> fdList;")
+                    self.emit_cpp_p("    wrapped = m_proxy->call_finish(result, fdList);")
+                else:
+                    self.emit_cpp_p("    wrapped = m_proxy->call_finish(result);")
+                self.emit_cpp_p("")
 
+                for line in self.method_reply_proxy(i, m, view):
+                    self.emit_cpp_p(("    " + line).rstrip())
+                self.emit_cpp_p("}")
                 self.emit_cpp_p("")
 
-            # Generate _finish function for above method call, we want this for templated methods as well
-            self.emit_cpp_p('void %s::%s_finish(' %(i.cpp_namespace_name, m.camel_name))
-            for a in m.out_args:
-                self.emit_cpp_p('        %s& out_%s,'%(a.cpptype_out, a.name))
-            self.emit_cpp_p(dedent('''
-                    const Glib::RefPtr<Gio::AsyncResult>& result)
-            {{
-                Glib::VariantContainerBase wrapped;
-                wrapped = m_proxy->call_finish(result);
-            ''').format(**locals()))
+            # Awaitable call
+            if self.coroutines and not m.no_reply:
+                result = self.co_result_type_proxy(m)
+                if templated is False:
+                    (params, body) = self.co_call_proxy(i, m, "arg_")
+                    for line in self.param_lines("%sAwaitable<%s> %s::%s(" % (i.cpp_class_name, result, i.cpp_namespace_name, m.camel_name), params, "", "        "):
+                        self.emit_cpp_p(line)
+                    self.emit_cpp_p("{")
+                    for line in body:
+                        self.emit_cpp_p(("    " + line).rstrip())
+                    self.emit_cpp_p("}")
+                    self.emit_cpp_p("")
+
+                self.emit_cpp_p("%s %s::%s_co_finish(" % (result, i.cpp_namespace_name, m.camel_name))
+                self.emit_cpp_p("        const Glib::RefPtr<Gio::DBus::Proxy> &proxy,")
+                self.emit_cpp_p("        const Glib::RefPtr<Gio::AsyncResult> &result)")
+                self.emit_cpp_p("{")
+                for line in self.co_finish_proxy(i, m):
+                    self.emit_cpp_p(("    " + line).rstrip())
+                self.emit_cpp_p("}")
+                self.emit_cpp_p("")
 
-            for arg_index in range(0, len(m.out_args)):
-                a = m.out_args[arg_index]
-                varname = a.name + "_variant"
-                outvar = "out_" + a.name
-                self.emit_cpp_p("    " + a.cppvalue_get(varname, outvar, str(arg_index), i.cpp_class_name))
+            # Blocking and pending-call variants
+            if templated is False and not m.no_reply:
+                (params, body) = self.sync_proxy(i, m, "arg_")
+                for line in self.param_lines("void %s::%s_sync(" % (i.cpp_namespace_name, m.camel_name), params, "", "        "):
+                    self.emit_cpp_p(line)
+                self.emit_cpp_p("{")
+                for line in body:
+                    self.emit_cpp_p(("    " + line).rstrip())
+                self.emit_cpp_p("}")
+                self.emit_cpp_p("")
+
+                (params, body) = self.async_proxy(i, m, "arg_")
+                for line in self.param_lines("std::shared_ptr<%sPendingCall> %s::%s_async(" % (i.cpp_class_name, i.cpp_namespace_name, m.camel_name), params, "", "        "):
+                    self.emit_cpp_p(line)
+                self.emit_cpp_p("{")
+                for line in body:
+                    self.emit_cpp_p(("    " + line).rstrip())
+                self.emit_cpp_p("}")
                 self.emit_cpp_p("")
-            self.emit_cpp_p("}")
-            self.emit_cpp_p("")
 
     def generate_property_handlers_proxy(self, i):
+            self.emit_cpp_p(dedent('''
+            void {i.cpp_namespace_name}::getRemoteProperty(Glib::VariantBase &property,
+                                                           const Glib::ustring &propertyName,
+                                                           bool updateCache) {{
+                std::vector<Glib::VariantBase> paramsVec;
+                paramsVec.push_back (Glib::Variant<Glib::ustring>::create("{i.name}"));
+                paramsVec.push_back (Glib::Variant<Glib::ustring>::create(propertyName));
+                Glib::VariantContainerBase result = m_proxy->call_sync("org.freedesktop.DBus.Properties.Get",
+                                                                       Glib::VariantContainerBase::create_tuple(paramsVec));
+                GVariant *value = NULL;
+                g_variant_get(result.gobj(), "(v)", &value);
+                property.init(value, false);
+
+                // Lazy proxies only cache what property changes keep up to date
+                if (updateCache && (!m_lazy || m_propertiesId)) {{
+                    m_proxy->set_cached_property(propertyName, property);
+                }}
+            }}''').format(**locals()))
+
             for p in i.properties:
                 if p.readable:
-                    self.emit_cpp_p(dedent('''
-                    {p.cpptype_out} {i.cpp_namespace_name}::{p.name}_get() {{
-                        std::vector<Glib::ustring> props = m_proxy->get_cached_property_names();
-                        Glib::Variant<{p.cpptype_get} > b;
-                        if (std::find(props.begin(), props.end(), "{p.name}") != props.end()) {{
-                            m_proxy->get_cached_property(b, "{p.name}");
-                        }} else {{
-                            g_print ("Todo: lookup value\\n");
+                    getters = [(p.cpptype_out, "_get", p.gvariant_get("b.gobj()", i.cpp_class_name))]
+                    if p.fixed_array_element:
+                        # The view shares the cached variant instead of copying it
+                        view_type = self.fixed_array_view(i, p.fixed_array_element)
+                        getters.append((view_type, "_get_view", "%s(b)" % view_type))
+
+                    for (cpptype, suffix, value_get) in getters:
+                        if p.emits_changed_signal == 'false':
+                            # The cached value is never updated for these
+                            # properties, so always ask the remote object
+                            self.emit_cpp_p(dedent('''
+                            {cpptype} {i.cpp_namespace_name}::{p.name}{suffix}() {{
+                                Glib::VariantBase b;
+                                getRemoteProperty(b, "{p.name}", false);''').format(**locals()))
+                        else:
+                            # Invalidated properties are dropped from the cache by
+                            # Gio::DBus::Proxy, fetch them again on demand
+                            self.emit_cpp_p(dedent('''
+                            {cpptype} {i.cpp_namespace_name}::{p.name}{suffix}() {{
+                                Glib::VariantBase b;
+                                m_proxy->get_cached_property(b, "{p.name}");
+                                if (!b.gobj()) {{
+                                    getRemoteProperty(b, "{p.name}", true);
+                                }}''').format(**locals()))
+                        self.emit_cpp_p(dedent('''
+                            return {value_get};
                         }}''').format(**locals()))
-                    cpptype_cast = p.cpptype_get_cast
-                    # Prepend the class name if this is the generic "TypeWrap" class
-                    if cpptype_cast.startswith("TypeWrap"):
-                        cpptype_cast = i.cpp_class_name + cpptype_cast
-                    self.emit_cpp_p(dedent('''
-                        return {cpptype_cast}(b.get());
-                    }}''').format(**locals()))
-                cpptype_to_dbus = p.cpptype_to_dbus
-                if cpptype_to_dbus.startswith("TypeWrap"):
-                    cpptype_to_dbus = i.cpp_class_name + cpptype_to_dbus
                 if p.writable:
+                    value_new = self.variant_base(p.gvariant_new("value", i.cpp_class_name))
                     self.emit_cpp_p(dedent('''
 
                     void {i.cpp_namespace_name}::{p.name}_set({p.cpptype_in} value, const Gio::SlotAsyncReady &cb) {{
                         std::vector<Glib::VariantBase> paramsVec;
                         paramsVec.push_back (Glib::Variant<Glib::ustring>::create("{i.name}"));
                         paramsVec.push_back (Glib::Variant<Glib::ustring>::create("{p.name}"));
-                        paramsVec.push_back (Glib::Variant<Glib::VariantBase>::create(Glib::Variant<{p.cpptype_get} >::create({cpptype_to_dbus}(value))));
+                        paramsVec.push_back (Glib::Variant<Glib::VariantBase>::create({value_new}));
                         Glib::VariantContainerBase params = Glib::VariantContainerBase::create_tuple(paramsVec);
                         m_proxy->call("org.freedesktop.DBus.Properties.Set",
                                         cb,
@@ -382,23 +979,13 @@ class CodeGenerator:
             self.emit_cpp_p(dedent('''
                 if (signal_name == "{s.name}") {{''').format(**locals()))
 
-            paramsList = []
-
             # Generate marshalling code, converting GVariants to std:: types
-            for ai in range(len(s.args)):
-                a = s.args[ai]
+            for lines in self.signal_args_proxy(i, s):
                 self.emit_cpp_p("        if (parameters.get_n_children() != " + str(len(s.args)) + ") { return; }")
-                self.emit_cpp_p("        Glib::Variant<%s > base_%s;" % (a.cpptype_get, a.name))
-                self.emit_cpp_p("        parameters.get_child(base_%s, %d);" % (a.name, ai))
-                self.emit_cpp_p("        %s p_%s;" % (a.cpptype_get, a.name))
-                self.emit_cpp_p("        p_%s = base_%s.get();" % (a.name, a.name))
-                cpptype_cast = a.cpptype_get_cast
-                # Prepend the class name if this is the generic "TypeWrap" class
-                if cpptype_cast.startswith("TypeWrap"):
-                    cpptype_cast = i.cpp_class_name + cpptype_cast
-                paramsList.append("%s(p_%s)" % (cpptype_cast, a.name))
-
-            paramsList = ', '.join(paramsList)
+                for line in lines:
+                    self.emit_cpp_p("        " + line)
+
+            paramsList = ', '.join(["p_%s" % a.name for a in s.args])
             self.emit_cpp_p('''        {s.name}_signal.emit({paramsList});'''.format(**locals()))
             self.emit_cpp_p("}")
 
@@ -406,6 +993,72 @@ class CodeGenerator:
             }}
         ''').format(**locals()))
 
+    def signal_args_proxy(self, i, s):
+        """ Generate the code converting the arguments of a received signal
+        to std:: types, named p_ and the name of the argument
+        @param i Interface the signal belongs to
+        @param s Signal to convert the arguments of
+        @return list with a list of lines per argument
+        """
+        args = []
+        for ai in range(len(s.args)):
+            a = s.args[ai]
+            args.append([
+                "GVariant *base_%s = g_variant_get_child_value(const_cast<GVariant*>(parameters.gobj()), %d);" % (a.name, ai),
+                "%s p_%s = %s;" % (a.cpptype_out, a.name, a.gvariant_get("base_" + a.name, i.cpp_class_name)),
+                "g_variant_unref(base_%s);" % (a.name)])
+        return args
+
+    def signal_slot_type_proxy(self, s):
+        """ Return the sigc slot type called with the arguments of signal s """
+        return "sigc::slot<%s >" % ", ".join(["void"] + [a.cpptype_out for a in s.args])
+
+    def generate_signal_subscriptions_proxy(self, i):
+        """ Generate the functions subscribing to single signals of Interface
+        i, with the arguments matched by the bus daemon
+        @param i Interface to generate signal subscriptions for
+        """
+        signals = [s for s in i.signals if len(s.args) <= SIGNAL_MAX_PARAM]
+        for s in signals:
+            slot_type = self.signal_slot_type_proxy(s)
+            n_args = len(s.args)
+            self.emit_cpp_p(dedent('''
+            guint {i.cpp_namespace_name}::{s.name}_subscribe (const {slot_type} &slot,
+                                                              const std::string &arg0,
+                                                              Gio::DBus::SignalFlags flags) {{
+                return m_proxy->get_connection()->signal_subscribe(
+                    sigc::bind(sigc::ptr_fun(&{i.cpp_class_name}::on_{s.name}_subscribed), slot),
+                    m_proxy->get_name(),
+                    "{i.name}",
+                    "{s.name}",
+                    m_proxy->get_object_path(),
+                    arg0,
+                    flags);
+            }}
+
+            void {i.cpp_namespace_name}::on_{s.name}_subscribed (const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+                                                                 const Glib::ustring& /* sender_name */,
+                                                                 const Glib::ustring& /* object_path */,
+                                                                 const Glib::ustring& /* interface_name */,
+                                                                 const Glib::ustring& /* signal_name */,
+                                                                 const Glib::VariantContainerBase& parameters,
+                                                                 {slot_type} slot) {{
+                if (parameters.get_n_children() != {n_args}) {{
+                    return;
+                }}''').format(**locals()))
+            for lines in self.signal_args_proxy(i, s):
+                for line in lines:
+                    self.emit_cpp_p("    " + line)
+            paramsList = ', '.join(["p_%s" % a.name for a in s.args])
+            self.emit_cpp_p("    slot({paramsList});".format(**locals()))
+            self.emit_cpp_p("}")
+
+        if signals:
+            self.emit_cpp_p(dedent('''
+            void {i.cpp_namespace_name}::unsubscribe (guint id) {{
+                m_proxy->get_connection()->signal_unsubscribe(id);
+            }}''').format(**locals()))
+
     def generate_proxy_creation(self, i):
         """ Generate the createForBus function for each proxy. This function
         constructs a new instance of the proxy for the specified bus. This is
@@ -428,173 +1081,1639 @@ class CodeGenerator:
               proxyFlags);
         }}
 
+        void {i.cpp_namespace_name}::createForBus (
+            Gio::DBus::BusType busType,
+            Gio::DBus::ProxyFlags proxyFlags,
+            const std::string &name,
+            const std::string &objectPath,
+            const Gio::SlotAsyncReady &slot,
+            const Glib::RefPtr<Glib::MainContext> &context) {{
+          // GDBus uses the thread-default context of the creating thread.
+          // If another thread runs the context, the proxy is created there.
+          if (!g_main_context_acquire(context->gobj())) {{
+              context->invoke([=]() {{
+                  createForBus(busType, proxyFlags, name, objectPath, slot, context);
+                  return false;
+              }});
+              return;
+          }}
+          g_main_context_push_thread_default(context->gobj());
+          createForBus(busType, proxyFlags, name, objectPath, slot);
+          g_main_context_pop_thread_default(context->gobj());
+          g_main_context_release(context->gobj());
+        }}
+
         Glib::RefPtr<{i.cpp_namespace_name}> {i.cpp_namespace_name}::createForBusFinish (Glib::RefPtr<Gio::AsyncResult> result) {{
             Glib::RefPtr<Gio::DBus::Proxy> proxy = Gio::DBus::Proxy::create_for_bus_finish (result);
             {i.cpp_namespace_name} *p = new {i.cpp_namespace_name} (proxy);
             return Glib::RefPtr<{i.cpp_namespace_name}> (p);
-        }}''').format(**locals()))
-
-    def generate_stub_introspection(self):
-        """ Generate introspection XML for all introspection XML files """
-        for i in range(0, len(self.node_xmls)):
-            node_xml = self.node_xmls[i]
-
-            # This will encode the XML introspection data as raw bytes. This is
-            # to avoid any formatting issues when embedding the introspection
-            # data in the stub file.
-            self.emit_cpp_s ("static const char interfaceXml%d[] = R\"XML_DELIMITER(" % i, False)
-            for char in node_xml:
-                self.emit_cpp_s (char, False)
-            self.emit_cpp_s (")XML_DELIMITER\";")
+        }}
 
-    def generate_stub_intro(self):
-        """ Generate introduction for stub cpp file """
-        self.emit_cpp_s ('#include "%s"' % self.stub_h.name)
+        void {i.cpp_namespace_name}::createForConnection (
+            const Glib::RefPtr<Gio::DBus::Connection> &connection,
+            Gio::DBus::ProxyFlags proxyFlags,
+            const std::string &name,
+            const std::string &objectPath,
+            const Gio::SlotAsyncReady &slot) {{
+          Gio::DBus::Proxy::create (connection,
+              name,
+              objectPath,
+              "{i.name}",
+              slot,
+              interfaceInfo(),
+              proxyFlags);
+        }}
 
-    def declare_types_stub(self):
-        """ Generate types and classes for the stub. This will generate the
-        complete class needed for implementing the stub. The code is placed in
-        the header file for the stub.
-        """
-        self.emit_h_s(dedent('''
-        #pragma once
-        #include <string>
-        #include <glibmm.h>
-        #include <giomm.h>
-        #include "{self.common_h.name}"
-        ''').format(**locals()))
+        Glib::RefPtr<{i.cpp_namespace_name}> {i.cpp_namespace_name}::createForConnectionFinish (Glib::RefPtr<Gio::AsyncResult> result) {{
+            Glib::RefPtr<Gio::DBus::Proxy> proxy = Gio::DBus::Proxy::create_finish (result);
+            {i.cpp_namespace_name} *p = new {i.cpp_namespace_name} (proxy);
+            return Glib::RefPtr<{i.cpp_namespace_name}> (p);
+        }}
 
-        # Generate a separate class for each interface
-        for i in self.ifaces:
-            for ns in i.cpp_namespace_name.split("::")[:-1]:
-                self.emit_h_s ("namespace %s {" % ns)
+        Glib::RefPtr<Gio::DBus::InterfaceInfo> {i.cpp_namespace_name}::interfaceInfo() {{
+            // Parsed once, the info is shared by all proxies of the interface
+            static Glib::RefPtr<Gio::DBus::InterfaceInfo> info = lookupInterfaceInfo("{i.name}");
+            return info;
+        }}
 
-            self.emit_h_s(dedent('''
-            class {i.cpp_class_name} {{
-            public:
-                {i.cpp_class_name}();
-                virtual ~{i.cpp_class_name}();
+        std::shared_ptr<{i.cpp_namespace_name}> {i.cpp_namespace_name}::getShared (
+            Gio::DBus::BusType busType,
+            const std::string &name,
+            const std::string &objectPath,
+            bool lazy) {{
+            typedef std::tuple<int, std::string, std::string> Key;
+            static std::map<Key, std::weak_ptr<{i.cpp_namespace_name}> > proxies;
+            static std::mutex proxiesMutex;
 
-                guint register_object(const Glib::RefPtr<Gio::DBus::Connection> &connection,
-                                      const Glib::ustring &object_path);
+            Key key(busType, name, objectPath);
+            {{
+                std::lock_guard<std::mutex> lock(proxiesMutex);
+                std::shared_ptr<{i.cpp_namespace_name}> shared = proxies[key].lock();
+                if (shared) {{
+                    if (!lazy) {{
+                        shared->subscribeSignals();
+                    }}
+                    return shared;
+                }}
+            }}
 
-                // deprecated:
-                void connect(Gio::DBus::BusType, std::string);
-            ''').format(**locals()))
-            for p in i.properties:
-                self.emit_h_s("    bool {p.name}_set({p.cpptype_in} value);".format(**locals()))
+            // Creating a proxy which loads its properties blocks on the bus,
+            // so it is done without the lock, which would hold up the users
+            // of all other proxies
+            Gio::DBus::ProxyFlags proxyFlags = Gio::DBus::PROXY_FLAGS_NONE;
+            if (lazy) {{
+                proxyFlags = Gio::DBus::PROXY_FLAGS_DO_NOT_LOAD_PROPERTIES | Gio::DBus::PROXY_FLAGS_DO_NOT_CONNECT_SIGNALS;
+            }}
+            Glib::RefPtr<Gio::DBus::Proxy> proxy = Gio::DBus::Proxy::create_for_bus_sync (busType,
+                name,
+                objectPath,
+                "{i.name}",
+                interfaceInfo(),
+                proxyFlags);
+            std::shared_ptr<{i.cpp_namespace_name}> created(new {i.cpp_namespace_name} (proxy));
+            created->m_lazy = lazy;
+
+            // Another thread may have created the same proxy meanwhile, the
+            // first one stored is shared
+            std::lock_guard<std::mutex> lock(proxiesMutex);
+            std::shared_ptr<{i.cpp_namespace_name}> shared = proxies[key].lock();
+            if (shared) {{
+                if (!lazy) {{
+                    shared->subscribeSignals();
+                }}
+                return shared;
+            }}
 
-            self.emit_h_s("protected:")
+            // Drop the entries of freed proxies
+            for (std::map<Key, std::weak_ptr<{i.cpp_namespace_name}> >::iterator it = proxies.begin(); it != proxies.end();) {{
+                if (it->second.expired() && it->first != key) {{
+                    proxies.erase(it++);
+                }} else {{
+                    ++it;
+                }}
+            }}
 
-            # Generate all methods in the interface
-            for m in i.methods:
-                # Async call method
-                self.emit_h_s("virtual void %s (" % m.name)
+            proxies[key] = created;
+            return created;
+        }}
 
-                for a in m.in_args:
-                    self.emit_h_s("    %s %s," % (a.cpptype_in, a.name))
+        void {i.cpp_namespace_name}::subscribeSignals() {{
+            if (!m_lazy || m_signalsId) {{
+                return;
+            }}
 
-                self.emit_h_s("    {i.cpp_class_name}MessageHelper msg) = 0;".format(**locals()))
+            Glib::RefPtr<Gio::DBus::Connection> connection = m_proxy->get_connection();
+            m_signalsId = connection->signal_subscribe(
+                sigc::mem_fun(this, &{i.cpp_class_name}::on_subscribed_signal),
+                m_proxy->get_name(),
+                "{i.name}",
+                "",
+                m_proxy->get_object_path());
+            m_propertiesId = connection->signal_subscribe(
+                sigc::mem_fun(this, &{i.cpp_class_name}::on_subscribed_signal),
+                m_proxy->get_name(),
+                "org.freedesktop.DBus.Properties",
+                "PropertiesChanged",
+                m_proxy->get_object_path(),
+                "{i.name}");
+        }}
 
-            # Generate getters and setters for all properties
-            for p in i.properties:
-                self.emit_h_s("virtual {p.cpptype_out} {p.name}_get() = 0;".format(**locals()))
-                self.emit_h_s(dedent('''
-                    /* Handle the setting of a property
-                        * This method will be called as a result of a call to <PropName>_set
-                        * and should implement the actual setting of the property value.
-                        * Should return true on sucess and false otherwise.
-                        */'''))
-                self.emit_h_s("virtual bool {p.name}_setHandler({p.cpptype_in} value) = 0;".format(**locals()))
+        void {i.cpp_namespace_name}::loadProperties(const Gio::SlotAsyncReady &slot) {{
+            // Subscribed first, so that no change is missed before the reply
+            subscribeSignals();
 
-            # Generate all signals
-            for s in i.signals:
-                if (len(s.args) > SIGNAL_MAX_PARAM):
-                    print "WARNING: signal %s has too many parameters, skipping" % s.name
-                    continue
-                args = []
+            std::vector<Glib::VariantBase> paramsVec;
+            paramsVec.push_back (Glib::Variant<Glib::ustring>::create("{i.name}"));
+            m_proxy->call("org.freedesktop.DBus.Properties.GetAll",
+                          slot,
+                          Glib::VariantContainerBase::create_tuple(paramsVec));
+        }}
 
-                for a in s.args:
-                    args.append(a.cpptype_out)
+        void {i.cpp_namespace_name}::loadProperties_finish(const Glib::RefPtr<Gio::AsyncResult> &result) {{
+            Glib::VariantContainerBase reply = m_proxy->call_finish(result);
 
-                argsStr = ", ".join(args)
-                self.emit_h_s(dedent('''
-                void {s.name}_emitter({argsStr});
-                sigc::signal<void, {argsStr} > {s.name}_signal;''').format(**locals()))
+            GVariantIter *properties;
+            const gchar *name;
+            GVariant *value;
+            g_variant_get(reply.gobj(), "(a{{sv}})", &properties);
+            while (g_variant_iter_next(properties, "{{&sv}}", &name, &value)) {{
+                m_proxy->set_cached_property(name, Glib::VariantBase(value, false));
+            }}
+            g_variant_iter_free(properties);
+        }}
 
-            # Generate the rest of the event handlers
-            self.emit_h_s(dedent("""
-            void on_bus_acquired(const Glib::RefPtr<Gio::DBus::Connection>& connection,
-                                 const Glib::ustring& /* name */);
+        void {i.cpp_namespace_name}::on_subscribed_signal(const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+                                                          const Glib::ustring& sender_name,
+                                                          const Glib::ustring& /* object_path */,
+                                                          const Glib::ustring& interface_name,
+                                                          const Glib::ustring& signal_name,
+                                                          const Glib::VariantContainerBase& parameters) {{
+            if (interface_name == "{i.name}") {{
+                handle_signal(sender_name, signal_name, parameters);
+            }} else {{
+                updateProperties(const_cast<GVariant*>(parameters.gobj()));
+            }}
+        }}
 
-            void on_name_acquired(const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
-                                  const Glib::ustring& /* name */);
+        void {i.cpp_namespace_name}::updateProperties(GVariant *parameters) {{
+            if (!g_variant_is_of_type(parameters, G_VARIANT_TYPE("(sa{{sv}}as)"))) {{
+                return;
+            }}
 
-            void on_name_lost(const Glib::RefPtr<Gio::DBus::Connection>& connection,
-                              const Glib::ustring& /* name */);
+            const gchar *interface;
+            GVariantIter *changed;
+            GVariantIter *invalidated;
+            g_variant_get(parameters, "(&sa{{sv}}as)", &interface, &changed, &invalidated);
+            if (g_strcmp0(interface, "{i.name}") == 0) {{
+                const gchar *name;
+                GVariant *value;
+                while (g_variant_iter_next(changed, "{{&sv}}", &name, &value)) {{
+                    m_proxy->set_cached_property(name, Glib::VariantBase(value, false));
+                }}
+                while (g_variant_iter_next(invalidated, "&s", &name)) {{
+                    m_proxy->set_cached_property(name, Glib::VariantBase());
+                }}
+            }}
+            g_variant_iter_free(changed);
+            g_variant_iter_free(invalidated);
+        }}
 
-            void on_method_call(const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
-                               const Glib::ustring& /* sender */,
-                               const Glib::ustring& /* object_path */,
-                               const Glib::ustring& /* interface_name */,
-                               const Glib::ustring& method_name,
-                               const Glib::VariantContainerBase& parameters,
-                               const Glib::RefPtr<Gio::DBus::MethodInvocation>& invocation);
+        {i.cpp_namespace_name}::~{i.cpp_class_name}() {{
+            if (m_signalsId) {{
+                m_proxy->get_connection()->signal_unsubscribe(m_signalsId);
+                m_proxy->get_connection()->signal_unsubscribe(m_propertiesId);
+            }}
+        }}
 
-            void on_interface_get_property(Glib::VariantBase& property,
-                                                   const Glib::RefPtr<Gio::DBus::Connection>& connection,
-                                                   const Glib::ustring& sender,
-                                                   const Glib::ustring& object_path,
-                                                   const Glib::ustring& interface_name,
-                                                   const Glib::ustring& property_name);
+        void {i.cpp_namespace_name}::setDefaultTimeout(int timeoutMsec) {{
+            m_proxy->set_default_timeout(timeoutMsec);
+        }}
 
-            bool on_interface_set_property(
-                   const Glib::RefPtr<Gio::DBus::Connection>& connection,
-                   const Glib::ustring& sender,
-                   const Glib::ustring& object_path,
-                   const Glib::ustring& interface_name,
-                   const Glib::ustring& property_name,
-                   const Glib::VariantBase& value);
+        void {i.cpp_namespace_name}::setDefaultCallFlags(Gio::DBus::CallFlags flags) {{
+            m_defaultCallFlags = flags;
+        }}''').format(**locals()))
 
-            private:
-            bool emitSignal(const std::string& propName, Glib::VariantBase& value);
+        if i.cacheable:
+            self.emit_cpp_p(dedent('''
+            void {i.cpp_namespace_name}::invalidateCache() {{
+                m_replyCache.clear();
+            }}
 
-            guint connectionId, registeredId;
-            Glib::RefPtr<Gio::DBus::NodeInfo> introspection_data;
-            Glib::RefPtr<Gio::DBus::Connection> m_connection;
-            std::string m_objectPath;
-            std::string m_interfaceName;
-            };"""))
+            void {i.cpp_namespace_name}::setCacheSize(gsize maxReplies) {{
+                m_replyCache.setMaxSize(maxReplies);
+            }}''').format(**locals()))
 
-            for ns in reversed(i.cpp_namespace_name.split("::")[:-1]):
-                self.emit_h_s("}// %s" % ns)
+        self.generate_shared_calls_proxy(i)
 
-            self.emit_h_s("")
+    def generate_shared_calls_proxy(self, i):
+        """ Generate the helpers making all calls of the cacheable and
+            single-flight methods of interface i
+        """
+        if not i.cacheable and not i.single_flight:
+            return
+
+        key_class = i.cpp_class_name + ("SingleFlight" if i.single_flight else "ReplyCache")
+        return_task = ["g_task_return_pointer(task, g_variant_ref(reply.gobj()), (GDestroyNotify) g_variant_unref);"]
+
+        # Calls with a callback
+        lines = ["// The reply of the D-Bus call can not be passed on as is, the",
+                 "// slot gets a task completed with it instead. Tasks complete",
+                 "// from the main context of the caller, also for replies that",
+                 "// are known already.",
+                 "GTask *task = g_task_new(m_proxy->gobj(),",
+                 "                         cancellable ? cancellable->gobj() : NULL,",
+                 "                         &%s::on_shared_ready," % i.cpp_namespace_name,
+                 "                         new Gio::SlotAsyncReady(slot));",
+                 "std::string key = %s::key(method, parameters);" % key_class]
+        if i.cacheable:
+            lines += ["Glib::VariantContainerBase reply;",
+                      "if (ttlMsec >= 0 && m_replyCache.lookup(key, reply)) {",
+                      "    " + return_task[0],
+                      "    g_object_unref(task);",
+                      "    return;",
+                      "}"]
+        leader = "false"
+        if i.single_flight:
+            lines += ["",
+                      "// Calls with a cancellable are neither shared nor waited for",
+                      "std::shared_ptr<%sSingleFlight::Call> flight;" % i.cpp_class_name,
+                      "if (singleFlight && !cancellable && !m_singleFlight.joinCall(key, flight)) {",
+                      "    flight->wait(task);",
+                      "    return;",
+                      "}"]
+            leader = "bool(flight)"
+        lines += ["",
+                  "m_proxy->call(method,",
+                  "              sigc::bind(sigc::mem_fun(this, &%s::on_shared_reply), key, task, ttlMsec, %s)," % (i.cpp_namespace_name, leader),
+                  "              cancellable,",
+                  "              parameters,",
+                  "              timeoutMsec,",
+                  "              flags);"]
+        self.emit_cpp_p(dedent('''
+        void {i.cpp_namespace_name}::callShared(const char *method,
+                                                const Glib::VariantContainerBase &parameters,
+                                                const Gio::SlotAsyncReady &slot,
+                                                const Glib::RefPtr<Gio::Cancellable> &cancellable,
+                                                int timeoutMsec,
+                                                Gio::DBus::CallFlags flags,
+                                                gint ttlMsec,
+                                                bool singleFlight) {{''').format(**locals()))
+        for line in lines:
+            self.emit_cpp_p(("    " + line).rstrip())
+        self.emit_cpp_p("}")
+
+        # Blocking calls
+        insert = []
+        if i.cacheable:
+            insert = ["if (ttlMsec >= 0) {",
+                      "    m_replyCache.insert(key, reply, ttlMsec);",
+                      "}"]
+        lines = ["std::string key = %s::key(method, parameters);" % key_class,
+                 "Glib::VariantContainerBase reply;"]
+        if i.cacheable:
+            lines += ["if (ttlMsec >= 0 && m_replyCache.lookup(key, reply)) {",
+                      "    return reply;",
+                      "}"]
+        call = ["reply = m_proxy->call_sync(method, parameters, timeoutMsec, m_defaultCallFlags);"]
+        if i.single_flight:
+            lines += ["",
+                      "// Threads making the same call wait for the first one",
+                      "std::shared_ptr<%sSingleFlight::Call> flight;" % i.cpp_class_name,
+                      "if (singleFlight && !m_singleFlight.joinCall(key, flight)) {",
+                      "    return flight->wait(timeoutMsec < 0 ? m_proxy->get_default_timeout() : timeoutMsec);",
+                      "}",
+                      "",
+                      "try {",
+                      "    " + call[0],
+                      "} catch (const Glib::Error &error) {",
+                      "    if (flight) {",
+                      "        m_singleFlight.leaveCall(key, reply, &error);",
+                      "    }",
+                      "    throw;",
+                      "}"]
+            lines += insert
+            lines += ["if (flight) {",
+                      "    m_singleFlight.leaveCall(key, reply, NULL);",
+                      "}"]
+        else:
+            lines += call + insert
+        lines.append("return reply;")
+        self.emit_cpp_p(dedent('''
+        Glib::VariantContainerBase {i.cpp_namespace_name}::callSharedSync(const char *method,
+                                                                          const Glib::VariantContainerBase &parameters,
+                                                                          int timeoutMsec,
+                                                                          gint ttlMsec,
+                                                                          bool singleFlight) {{''').format(**locals()))
+        for line in lines:
+            self.emit_cpp_p(("    " + line).rstrip())
+        self.emit_cpp_p("}")
+
+        # Replies of the calls with a callback
+        leave = []
+        leave_error = []
+        if i.single_flight:
+            leave = ["if (leader) {",
+                     "    m_singleFlight.leaveCall(key, reply, NULL);",
+                     "}"]
+            leave_error = ["if (leader) {",
+                           "    m_singleFlight.leaveCall(key, Glib::VariantContainerBase(), &error);",
+                           "}"]
+        lines = (["try {",
+                  "    Glib::VariantContainerBase reply = m_proxy->call_finish(result);"] +
+                 ["    " + line for line in insert + leave + return_task] +
+                 ["} catch (const Glib::Error &error) {"] +
+                 ["    " + line for line in leave_error] +
+                 ["    g_task_return_error(task, g_error_copy(error.gobj()));",
+                  "}",
+                  "g_object_unref(task);"])
+        self.emit_cpp_p(dedent('''
+        void {i.cpp_namespace_name}::on_shared_reply(const Glib::RefPtr<Gio::AsyncResult> &result,
+                                                     std::string key,
+                                                     GTask *task,
+                                                     gint ttlMsec,
+                                                     bool leader) {{''').format(**locals()))
+        for line in lines:
+            self.emit_cpp_p(("    " + line).rstrip())
+        self.emit_cpp_p("}")
 
-    def define_types_stub_creation(self, i):
-        # Constructor
-        self.emit_cpp_s(dedent('''
-        {i.cpp_namespace_name}::{i.cpp_class_name} () : connectionId(0), registeredId(0), m_interfaceName("{i.name}") {{
-        ''').format(**locals()))
-        for s in i.signals:
-            # Sigc does not allow an infinite number of parameters for signals.
-            # The maximum number of signals is specified in SIGNAL_MAX_PARAM. A
-            # warning is issued if this is exceeded, and no signal handler uis
-            # generated.
-            if (len(s.args) > SIGNAL_MAX_PARAM):
-                print "WARNING: signal %s has too many parameters, skipping" % s.name
-                continue
-            self.emit_cpp_s("    {s.name}_signal.connect(sigc::mem_fun(this, &{i.cpp_class_name}::{s.name}_emitter));".format(**locals()))
-        #TODO: This code will only fetch introspection data for interfaces
-        # contained in the first interfaceXml variable. We need to check which
-        # interfaceXml variable contains our XML, and use the correct one
-        # instead. This code will break if there are several introspection XML
-        # files specified.
-        self.emit_cpp_s(dedent('''
+        self.emit_cpp_p(dedent('''
+        void {i.cpp_namespace_name}::on_shared_ready(GObject *source, GAsyncResult *result, gpointer data) {{
+            Gio::SlotAsyncReady *slot = static_cast<Gio::SlotAsyncReady*>(data);
+            try {{
+                (*slot)(Glib::wrap(result, true));
+            }} catch (...) {{
+                Glib::exception_handlers_invoke();
+            }}
+            delete slot;
+        }}
+
+        Glib::VariantContainerBase {i.cpp_namespace_name}::finishShared(const Glib::RefPtr<Gio::AsyncResult> &result) {{
+            GError *error = NULL;
+            GVariant *reply = static_cast<GVariant*>(g_task_propagate_pointer(G_TASK(result->gobj()), &error));
+            if (error) {{
+                Glib::Error::throw_exception(error);
+            }}
+            return Glib::VariantContainerBase(reply, false);
+        }}''').format(**locals()))
+
+    def declare_object_manager_client_proxy(self, i):
+        """ Generate the client of a remote org.freedesktop.DBus.ObjectManager,
+        keeping proxies for all objects implementing interface i
+        @param Interface i is the interface to generate the client for
+        """
+        self.emit_h_p(dedent('''
+        // Keeps proxies for all objects implementing {i.name} below
+        // the path of a remote org.freedesktop.DBus.ObjectManager. The objects
+        // and their properties are fetched with a single GetManagedObjects
+        // call, and kept up to date from the signals of the manager and of
+        // the objects, without calls per object. When the owner of the name
+        // changes, the objects are removed and fetched again from the new
+        // owner once they have been loaded.
+        class {i.cpp_class_name}ObjectManagerClient {{
+        public:
+            {i.cpp_class_name}ObjectManagerClient(const Glib::RefPtr<Gio::DBus::Connection> &connection,
+                                    const std::string &name,
+                                    const std::string &objectPath);
+            virtual ~{i.cpp_class_name}ObjectManagerClient();
+
+            // Fetches the objects of the manager, the slot is called once
+            // they are available
+            void load(const Gio::SlotAsyncReady &slot);
+            void load_finish(const Glib::RefPtr<Gio::AsyncResult> &result);
+
+            // Returns an empty pointer if there is no such object
+            Glib::RefPtr<{i.cpp_class_name}> getObject(const std::string &objectPath);
+            std::vector<std::string> getObjectPaths();
+
+            sigc::signal<void, std::string, Glib::RefPtr<{i.cpp_class_name}> > ObjectAdded_signal;
+            sigc::signal<void, std::string> ObjectRemoved_signal;
+
+        private:
+            void on_name_owner(const Glib::RefPtr<Gio::AsyncResult> &result,
+                               const Gio::SlotAsyncReady &slot);
+            void on_signal(const Glib::RefPtr<Gio::DBus::Connection>& connection,
+                           const Glib::ustring& sender_name,
+                           const Glib::ustring& object_path,
+                           const Glib::ustring& interface_name,
+                           const Glib::ustring& signal_name,
+                           const Glib::VariantContainerBase& parameters);
+            void on_name_owner_changed(const Glib::RefPtr<Gio::DBus::Connection>& connection,
+                                       const Glib::ustring& sender_name,
+                                       const Glib::ustring& object_path,
+                                       const Glib::ustring& interface_name,
+                                       const Glib::ustring& signal_name,
+                                       const Glib::VariantContainerBase& parameters);
+            void on_reloaded(const Glib::RefPtr<Gio::AsyncResult> &result,
+                             const std::string &nameOwner);
+            void addObjects(const Glib::VariantContainerBase &reply);
+            void addObject(const std::string &objectPath, GVariant *interfaces);
+            void removeObject(const std::string &objectPath);
+
+            Glib::RefPtr<Gio::DBus::Connection> m_connection;
+            std::string m_name;
+            std::string m_nameOwner;
+            std::string m_objectPath;
+            std::vector<guint> m_subscriptionIds;
+            guint m_ownerSubscriptionId;
+            bool m_loaded;
+            std::map<std::string, Glib::RefPtr<{i.cpp_class_name}> > m_objects;
+        }};''').format(**locals()))
+
+    def define_object_manager_client_proxy(self, i):
+        client = "::".join(i.cpp_namespace_name.split("::")[:-1] + [i.cpp_class_name + "ObjectManagerClient"])
+        self.emit_cpp_p(dedent('''
+        {client}::{i.cpp_class_name}ObjectManagerClient(
+            const Glib::RefPtr<Gio::DBus::Connection> &connection,
+            const std::string &name,
+            const std::string &objectPath) :
+            m_connection(connection),
+            m_name(name),
+            m_objectPath(objectPath),
+            m_ownerSubscriptionId(0),
+            m_loaded(false)
+        {{
+            // The manager signals are only matched on the path of the
+            // manager, the signals of the objects on their interface
+            m_subscriptionIds.push_back(m_connection->signal_subscribe(
+                sigc::mem_fun(this, &{i.cpp_class_name}ObjectManagerClient::on_signal),
+                name,
+                "org.freedesktop.DBus.ObjectManager",
+                "InterfacesAdded",
+                objectPath));
+            m_subscriptionIds.push_back(m_connection->signal_subscribe(
+                sigc::mem_fun(this, &{i.cpp_class_name}ObjectManagerClient::on_signal),
+                name,
+                "org.freedesktop.DBus.ObjectManager",
+                "InterfacesRemoved",
+                objectPath));
+            m_subscriptionIds.push_back(m_connection->signal_subscribe(
+                sigc::mem_fun(this, &{i.cpp_class_name}ObjectManagerClient::on_signal),
+                name,
+                "{i.name}"));
+            m_subscriptionIds.push_back(m_connection->signal_subscribe(
+                sigc::mem_fun(this, &{i.cpp_class_name}ObjectManagerClient::on_signal),
+                name,
+                "org.freedesktop.DBus.Properties",
+                "PropertiesChanged",
+                "",
+                "{i.name}"));
+
+            // The proxies are created for the unique name of the owner, so
+            // they have to be replaced when the service is restarted
+            if (!m_name.empty() && !g_dbus_is_unique_name(m_name.c_str())) {{
+                m_ownerSubscriptionId = m_connection->signal_subscribe(
+                    sigc::mem_fun(this, &{i.cpp_class_name}ObjectManagerClient::on_name_owner_changed),
+                    "org.freedesktop.DBus",
+                    "org.freedesktop.DBus",
+                    "NameOwnerChanged",
+                    "/org/freedesktop/DBus",
+                    m_name);
+            }}
+        }}
+
+        {client}::~{i.cpp_class_name}ObjectManagerClient()
+        {{
+            for (std::vector<guint>::iterator it = m_subscriptionIds.begin(); it != m_subscriptionIds.end(); ++it) {{
+                m_connection->signal_unsubscribe(*it);
+            }}
+            if (m_ownerSubscriptionId != 0) {{
+                m_connection->signal_unsubscribe(m_ownerSubscriptionId);
+            }}
+        }}
+
+        void {client}::load(const Gio::SlotAsyncReady &slot)
+        {{
+            if (g_dbus_is_unique_name(m_name.c_str())) {{
+                m_nameOwner = m_name;
+                m_connection->call(m_objectPath,
+                                   "org.freedesktop.DBus.ObjectManager",
+                                   "GetManagedObjects",
+                                   Glib::VariantContainerBase(g_variant_ref_sink(g_variant_new_tuple(NULL, 0)), false),
+                                   slot,
+                                   m_nameOwner);
+                return;
+            }}
+
+            // The proxies are created for the unique name, so creating them
+            // does not ask the bus for the owner of the name again
+            GVariant *params[] = {{
+                g_variant_new_string(m_name.c_str())
+            }};
+            m_connection->call("/org/freedesktop/DBus",
+                               "org.freedesktop.DBus",
+                               "GetNameOwner",
+                               Glib::VariantContainerBase(g_variant_ref_sink(g_variant_new_tuple(params, 1)), false),
+                               sigc::bind(sigc::mem_fun(this, &{i.cpp_class_name}ObjectManagerClient::on_name_owner), slot),
+                               "org.freedesktop.DBus");
+        }}
+
+        void {client}::on_name_owner(const Glib::RefPtr<Gio::AsyncResult> &result,
+                                     const Gio::SlotAsyncReady &slot)
+        {{
+            try {{
+                Glib::VariantContainerBase reply = m_connection->call_finish(result);
+                GVariant *owner = g_variant_get_child_value(reply.gobj(), 0);
+                m_nameOwner = g_variant_get_string(owner, NULL);
+                g_variant_unref(owner);
+            }} catch (const Glib::Error &ex) {{
+                // Nobody owns the name, GetManagedObjects reports the error
+                m_nameOwner = m_name;
+            }}
+            m_connection->call(m_objectPath,
+                               "org.freedesktop.DBus.ObjectManager",
+                               "GetManagedObjects",
+                               Glib::VariantContainerBase(g_variant_ref_sink(g_variant_new_tuple(NULL, 0)), false),
+                               slot,
+                               m_nameOwner);
+        }}
+
+        void {client}::load_finish(const Glib::RefPtr<Gio::AsyncResult> &result)
+        {{
+            addObjects(m_connection->call_finish(result));
+            m_loaded = true;
+        }}
+
+        Glib::RefPtr<{i.cpp_namespace_name}> {client}::getObject(const std::string &objectPath)
+        {{
+            std::map<std::string, Glib::RefPtr<{i.cpp_class_name}> >::iterator it = m_objects.find(objectPath);
+            if (it == m_objects.end()) {{
+                return Glib::RefPtr<{i.cpp_class_name}>();
+            }}
+            return it->second;
+        }}
+
+        std::vector<std::string> {client}::getObjectPaths()
+        {{
+            std::vector<std::string> paths;
+            for (std::map<std::string, Glib::RefPtr<{i.cpp_class_name}> >::iterator it = m_objects.begin(); it != m_objects.end(); ++it) {{
+                paths.push_back(it->first);
+            }}
+            return paths;
+        }}
+
+        void {client}::on_signal(const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+                                 const Glib::ustring& sender_name,
+                                 const Glib::ustring& object_path,
+                                 const Glib::ustring& interface_name,
+                                 const Glib::ustring& signal_name,
+                                 const Glib::VariantContainerBase& parameters)
+        {{
+            GVariant *variant = const_cast<GVariant*>(parameters.gobj());
+            if (object_path == m_objectPath && interface_name == "org.freedesktop.DBus.ObjectManager") {{
+                if (m_nameOwner.empty()) {{
+                    m_nameOwner = sender_name;
+                }}
+                if (signal_name == "InterfacesAdded" && g_variant_is_of_type(variant, G_VARIANT_TYPE("(oa{{sa{{sv}}}})"))) {{
+                    const gchar *objectPath;
+                    GVariant *interfaces;
+                    g_variant_get(variant, "(&o@a{{sa{{sv}}}})", &objectPath, &interfaces);
+                    addObject(objectPath, interfaces);
+                    g_variant_unref(interfaces);
+                }} else if (signal_name == "InterfacesRemoved" && g_variant_is_of_type(variant, G_VARIANT_TYPE("(oas)"))) {{
+                    const gchar *objectPath;
+                    GVariantIter *interfaces;
+                    const gchar *interface;
+                    g_variant_get(variant, "(&oas)", &objectPath, &interfaces);
+                    while (g_variant_iter_next(interfaces, "&s", &interface)) {{
+                        if (g_strcmp0(interface, "{i.name}") == 0) {{
+                            removeObject(objectPath);
+                        }}
+                    }}
+                    g_variant_iter_free(interfaces);
+                }}
+                return;
+            }}
+
+            std::map<std::string, Glib::RefPtr<{i.cpp_class_name}> >::iterator it = m_objects.find(object_path);
+            if (it == m_objects.end()) {{
+                return;
+            }}
+
+            if (interface_name == "{i.name}") {{
+                it->second->handle_signal(sender_name, signal_name, parameters);
+            }} else if (interface_name == "org.freedesktop.DBus.Properties" &&
+                       signal_name == "PropertiesChanged") {{
+                it->second->updateProperties(variant);
+            }}
+        }}
+
+        void {client}::on_name_owner_changed(const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+                                             const Glib::ustring& /* sender_name */,
+                                             const Glib::ustring& /* object_path */,
+                                             const Glib::ustring& /* interface_name */,
+                                             const Glib::ustring& /* signal_name */,
+                                             const Glib::VariantContainerBase& parameters)
+        {{
+            GVariant *variant = const_cast<GVariant*>(parameters.gobj());
+            if (!g_variant_is_of_type(variant, G_VARIANT_TYPE("(sss)"))) {{
+                return;
+            }}
+            const gchar *newOwner;
+            g_variant_get(variant, "(&s&s&s)", NULL, NULL, &newOwner);
+
+            // The objects of the previous owner are gone, the new owner
+            // announces its objects or they are fetched again below
+            std::vector<std::string> paths = getObjectPaths();
+            m_objects.clear();
+            for (std::vector<std::string>::iterator it = paths.begin(); it != paths.end(); ++it) {{
+                ObjectRemoved_signal.emit(*it);
+            }}
+            m_nameOwner = newOwner;
+            if (m_nameOwner.empty() || !m_loaded) {{
+                return;
+            }}
+
+            m_connection->call(m_objectPath,
+                               "org.freedesktop.DBus.ObjectManager",
+                               "GetManagedObjects",
+                               Glib::VariantContainerBase(g_variant_ref_sink(g_variant_new_tuple(NULL, 0)), false),
+                               sigc::bind(sigc::mem_fun(this, &{i.cpp_class_name}ObjectManagerClient::on_reloaded), m_nameOwner),
+                               m_nameOwner);
+        }}
+
+        void {client}::on_reloaded(const Glib::RefPtr<Gio::AsyncResult> &result,
+                                   const std::string &nameOwner)
+        {{
+            try {{
+                Glib::VariantContainerBase reply = m_connection->call_finish(result);
+                // The name may have changed owner again while loading
+                if (nameOwner == m_nameOwner) {{
+                    addObjects(reply);
+                }}
+            }} catch (const Glib::Error &ex) {{
+                g_warning("Unable to reload the objects of %s: %s", m_objectPath.c_str(), ex.what().c_str());
+            }}
+        }}
+
+        void {client}::addObjects(const Glib::VariantContainerBase &reply)
+        {{
+            GVariant *objects = g_variant_get_child_value(const_cast<GVariant*>(reply.gobj()), 0);
+
+            GVariantIter iter;
+            const gchar *objectPath;
+            GVariant *interfaces;
+            g_variant_iter_init(&iter, objects);
+            while (g_variant_iter_next(&iter, "{{&o@a{{sa{{sv}}}}}}", &objectPath, &interfaces)) {{
+                addObject(objectPath, interfaces);
+                g_variant_unref(interfaces);
+            }}
+            g_variant_unref(objects);
+        }}
+
+        void {client}::addObject(const std::string &objectPath, GVariant *interfaces)
+        {{
+            GVariant *properties = g_variant_lookup_value(interfaces, "{i.name}", G_VARIANT_TYPE("a{{sv}}"));
+            if (!properties || m_objects.count(objectPath) > 0) {{
+                if (properties) {{
+                    g_variant_unref(properties);
+                }}
+                return;
+            }}
+
+            // The properties are known and the signals are dispatched by the
+            // client, so creating the proxy does not send any message
+            Glib::RefPtr<Gio::DBus::Proxy> proxy;
+            try {{
+                proxy = Gio::DBus::Proxy::create_sync(m_connection,
+                    m_nameOwner,
+                    objectPath,
+                    "{i.name}",
+                    {i.cpp_class_name}::interfaceInfo(),
+                    Gio::DBus::PROXY_FLAGS_DO_NOT_LOAD_PROPERTIES |
+                    Gio::DBus::PROXY_FLAGS_DO_NOT_CONNECT_SIGNALS |
+                    Gio::DBus::PROXY_FLAGS_DO_NOT_AUTO_START);
+            }} catch (const Glib::Error &ex) {{
+                g_warning("Unable to create proxy for %s: %s", objectPath.c_str(), ex.what().c_str());
+                g_variant_unref(properties);
+                return;
+            }}
+
+            GVariantIter iter;
+            const gchar *name;
+            GVariant *value;
+            g_variant_iter_init(&iter, properties);
+            while (g_variant_iter_next(&iter, "{{&sv}}", &name, &value)) {{
+                proxy->set_cached_property(name, Glib::VariantBase(value, false));
+            }}
+            g_variant_unref(properties);
+
+            Glib::RefPtr<{i.cpp_class_name}> object(new {i.cpp_class_name}(proxy));
+            m_objects[objectPath] = object;
+            ObjectAdded_signal.emit(objectPath, object);
+        }}
+
+        void {client}::removeObject(const std::string &objectPath)
+        {{
+            if (m_objects.erase(objectPath) > 0) {{
+                ObjectRemoved_signal.emit(objectPath);
+            }}
+        }}''').format(**locals()))
+
+    def generate_introspection(self, emit):
+        """ Generate introspection XML for all introspection XML files
+            @param emit function emitting to the file to generate it in
+        """
+        for i in range(0, len(self.node_xmls)):
+            node_xml = self.introspection_xml(self.node_xmls[i])
+
+            # This will encode the XML introspection data as raw bytes. This is
+            # to avoid any formatting issues when embedding the introspection
+            # data in the stub file.
+            emit ("static const char interfaceXml%d[] = R\"XML_DELIMITER(" % i, False)
+            for char in node_xml:
+                emit (char, False)
+            emit (")XML_DELIMITER\";")
+
+    def introspection_xml(self, node_xml):
+        """ The introspection XML as the generated code sends and expects
+        the messages. Method arguments passed in shared memory are variants
+        on the wire, holding either the bytes or the index of a memfd.
+        """
+        def shared_arg(match):
+            arg = match.group(0)
+            if "org.gdbus.codegen.glibmm.Arg.SharedMemory" not in arg:
+                return arg
+            return re.sub(r'(\btype\s*=\s*)(["\'])ay\2', r'\1\2v\2', arg, count = 1)
+
+        # Only the arguments of methods, the others are passed inline
+        def method(match):
+            return re.sub(r'<arg\b[^>]*(?<!/)>.*?</arg>', shared_arg, match.group(0), flags = re.S)
+
+        return re.sub(r'<method\b.*?</method>', method, node_xml, flags = re.S)
+
+    def generate_interface_lookup(self, emit):
+        """ Generate a function looking up the interface info of an interface
+        in all introspection XML files
+        """
+        xmls = ", ".join(["interfaceXml%d" % i for i in range(0, len(self.node_xmls))])
+        count = len(self.node_xmls)
+        emit(dedent('''
+        static Glib::RefPtr<Gio::DBus::InterfaceInfo> lookupInterfaceInfo(const char *name)
+        {{
+            const char *xmls[] = {{ {xmls} }};
+            for (int i = 0; i < {count}; i++) {{
+                Glib::RefPtr<Gio::DBus::NodeInfo> node = Gio::DBus::NodeInfo::create_for_xml(xmls[i]);
+                Glib::RefPtr<Gio::DBus::InterfaceInfo> info = node->lookup_interface(name);
+                if (info) {{
+                    return info;
+                }}
+            }}
+            return Glib::RefPtr<Gio::DBus::InterfaceInfo>();
+        }}''').format(**locals()))
+
+    def generate_stub_introspection(self):
+        """ Generate introspection XML for all introspection XML files """
+        self.generate_introspection(self.emit_cpp_s)
+
+    def generate_proxy_introspection(self):
+        """ Generate introspection XML for all introspection XML files, and a
+        function looking up the interface info of an interface in them
+        """
+        self.emit_cpp_p("")
+        self.generate_introspection(self.emit_cpp_p)
+        self.generate_interface_lookup(self.emit_cpp_p)
+
+    def generate_stub_intro(self):
+        """ Generate introduction for stub cpp file """
+        self.emit_cpp_s ('#include "%s"' % self.stub_h.name)
+        self.generate_interface_lookup(self.emit_cpp_s)
+
+    def declare_types_stub(self):
+        """ Generate types and classes for the stub. This will generate the
+        complete class needed for implementing the stub. The code is placed in
+        the header file for the stub.
+        """
+        self.emit_h_s(dedent('''
+        #pragma once
+        #include <atomic>
+        #include <string>
+        #include <glibmm.h>
+        #include <giomm.h>
+        #include "{self.common_h.name}"
+        ''').format(**locals()))
+        if any([i.threaded for i in self.ifaces]):
+            self.emit_h_s("#include <functional>")
+            self.emit_h_s("")
+        if any([self.coalesced_signals_stub(i) for i in self.ifaces]):
+            self.emit_h_s("#include <mutex>")
+            self.emit_h_s("")
+
+        # Generate a separate class for each interface
+        for i in self.ifaces:
+            for ns in i.cpp_namespace_name.split("::")[:-1]:
+                self.emit_h_s ("namespace %s {" % ns)
+
+            self.emit_h_s(dedent('''
+            class {i.cpp_class_name} {{
+            public:
+                {i.cpp_class_name}();
+                virtual ~{i.cpp_class_name}();
+
+                guint register_object(const Glib::RefPtr<Gio::DBus::Connection> &connection,
+                                      const Glib::ustring &object_path);
+
+                // Registers the object with method calls and property accesses
+                // dispatched in the given main context
+                guint register_object(const Glib::RefPtr<Gio::DBus::Connection> &connection,
+                                      const Glib::ustring &object_path,
+                                      const Glib::RefPtr<Glib::MainContext> &context);
+
+                // deprecated:
+                void connect(Gio::DBus::BusType, std::string);
+
+                // Owns the name and registers the object from the given main
+                // context
+                void connect(Gio::DBus::BusType busType,
+                             const std::string &name,
+                             const Glib::RefPtr<Glib::MainContext> &context);
+
+                // Sends the signals of the interface only to the given bus
+                // name instead of broadcasting them, if it is not empty
+                void setSignalDestination(const Glib::ustring &destination);
+            ''').format(**locals()))
+            if i.threaded:
+                self.emit_h_s(indent(dedent('''\
+                    // Limits the number of threads handling threaded method calls
+                    void setMaxThreads(int maxThreads);
+
+                    // Waits for the threaded method calls in progress. Later calls
+                    // are handled on the main context. Has to be called from the
+                    // destructor of the implementation, the destructor of this
+                    // class is too late and only logs a critical warning.
+                    void stopThreads();
+                '''), 4))
+            for p in i.properties:
+                self.emit_h_s("    bool {p.name}_set({p.cpptype_in} value);".format(**locals()))
+
+            self.emit_h_s("protected:")
+
+            # Generate all methods in the interface
+            for m in i.methods:
+                # Async call method, one-way methods are not replied to
+                params = []
+                for a in m.in_args:
+                    params.append("%s %s" % (a.cpptype_in, a.name))
+                if not m.no_reply:
+                    params.append("%sMessageHelper msg" % i.cpp_class_name)
+
+                for line in self.param_lines("virtual void %s (" % m.name, params, " = 0;"):
+                    self.emit_h_s(line)
+
+            # Generate getters and setters for all properties
+            for p in i.properties:
+                if p.stored:
+                    # Stored properties are answered from the value kept by
+                    # the stub, so overriding these is optional
+                    self.emit_h_s("virtual {p.cpptype_out} {p.name}_get();".format(**locals()))
+                else:
+                    self.emit_h_s("virtual {p.cpptype_out} {p.name}_get() = 0;".format(**locals()))
+                self.emit_h_s(dedent('''
+                    /* Handle the setting of a property
+                        * This method will be called as a result of a call to <PropName>_set
+                        * and should implement the actual setting of the property value.
+                        * Should return true on sucess and false otherwise.
+                        */'''))
+                if p.stored:
+                    self.emit_h_s("virtual bool {p.name}_setHandler({p.cpptype_in} value);".format(**locals()))
+                else:
+                    self.emit_h_s("virtual bool {p.name}_setHandler({p.cpptype_in} value) = 0;".format(**locals()))
+
+            # Generate all signals
+            for s in i.signals:
+                if (len(s.args) > SIGNAL_MAX_PARAM):
+                    print "WARNING: signal %s has too many parameters, skipping" % s.name
+                    continue
+                args = []
+                emitterArgs = []
+
+                for a in s.args:
+                    args.append(a.cpptype_out)
+                    emitterArgs.append(a.cpptype_in)
+
+                argsStr = ", ".join(args)
+                emitterArgsStr = ", ".join(emitterArgs)
+                emitToArgsStr = ", ".join(["const Glib::ustring &destination"] + emitterArgs)
+                self.emit_h_s(dedent('''
+                void {s.name}_emitter({emitterArgsStr});
+                void {s.name}_emit_to({emitToArgsStr});
+                sigc::signal<void, {argsStr} > {s.name}_signal;''').format(**locals()))
+                if s.coalesce != None:
+                    self.emit_h_s(dedent('''
+                    // Emissions within the interval are coalesced, and only the
+                    // latest one is sent when it ends. 0 sends all emissions.
+                    void {s.name}_setCoalesceInterval(guint msec);
+                    // Number of emissions replaced by a later one
+                    guint {s.name}_droppedCount() const;''').format(**locals()))
+
+            # Generate the rest of the event handlers
+            self.emit_h_s(dedent("""
+            void on_bus_acquired(const Glib::RefPtr<Gio::DBus::Connection>& connection,
+                                 const Glib::ustring& /* name */);
+
+            void on_name_acquired(const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+                                  const Glib::ustring& /* name */);
+
+            void on_name_lost(const Glib::RefPtr<Gio::DBus::Connection>& connection,
+                              const Glib::ustring& /* name */);
+
+            void on_method_call(const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+                               const Glib::ustring& /* sender */,
+                               const Glib::ustring& /* object_path */,
+                               const Glib::ustring& /* interface_name */,
+                               const Glib::ustring& method_name,
+                               const Glib::VariantContainerBase& parameters,
+                               const Glib::RefPtr<Gio::DBus::MethodInvocation>& invocation);
+
+            void on_interface_get_property(Glib::VariantBase& property,
+                                                   const Glib::RefPtr<Gio::DBus::Connection>& connection,
+                                                   const Glib::ustring& sender,
+                                                   const Glib::ustring& object_path,
+                                                   const Glib::ustring& interface_name,
+                                                   const Glib::ustring& property_name);
+
+            bool on_interface_set_property(
+                   const Glib::RefPtr<Gio::DBus::Connection>& connection,
+                   const Glib::ustring& sender,
+                   const Glib::ustring& object_path,
+                   const Glib::ustring& interface_name,
+                   const Glib::ustring& property_name,
+                   const Glib::VariantBase& value);
+
+            private:
+            bool emitSignal(const std::string& propName, Glib::VariantBase& value);
+            bool emitInvalidatedSignal(const std::string& propName);
+            bool emitPropertiesChanged(const std::map<Glib::ustring, Glib::VariantBase>& changedProps,
+                                       const std::vector<Glib::ustring>& changedPropsNoValue);
+            bool sendSignal(const gchar *destination, const gchar *interfaceName, const gchar *signalName, GVariant *parameters);
+
+            guint connectionId, registeredId;
+            Glib::RefPtr<Gio::DBus::Connection> m_connection;
+            Glib::RefPtr<Glib::MainContext> m_context;
+            std::string m_objectPath;
+            std::string m_interfaceName;
+            Glib::ustring m_signalDestination;"""))
+
+            for p in i.properties:
+                if p.stored:
+                    self.emit_h_s("Glib::VariantBase m_{p.name}Value;".format(**locals()))
+
+            if i.threaded:
+                self.emit_h_s("")
+                self.emit_h_s(dedent('''\
+                    struct ThreadedCall {
+                        std::function<void()> run;
+                        Glib::RefPtr<Gio::DBus::MethodInvocation> invocation;
+                    };
+                    static void runMethodCall(gpointer data, gpointer userData);'''))
+                self.emit_h_s("GThreadPool *m_threadPool;")
+
+            if any(m.single_flight for m in i.methods):
+                self.emit_h_s("")
+                self.emit_h_s("%sSingleFlight m_singleFlight;" % i.cpp_class_name)
+
+            coalesced = self.coalesced_signals_stub(i)
+            if coalesced:
+                self.emit_h_s(dedent('''
+
+                // Signals may be emitted from any thread, the timer runs on
+                // the context of the stub
+                struct CoalescedSignal {
+                    guint interval;
+                    guint dropped;
+                    GVariant *pending;
+                    bool scheduled;
+                    sigc::connection timer;
+                    mutable std::mutex mutex;
+                };
+                void emitCoalesced(CoalescedSignal &signal, const gchar *signalName, GVariant *parameters);
+                bool flushCoalesced(CoalescedSignal *signal, const gchar *signalName);'''))
+                for s in coalesced:
+                    self.emit_h_s("CoalescedSignal m_{s.name}Coalesced;".format(**locals()))
+
+            self.emit_h_s("")
+            self.emit_h_s("GVariant *buildProperties();")
+            self.emit_h_s("")
+            self.emit_h_s("friend class %sSubtree;" % i.cpp_class_name)
+            self.emit_h_s("friend class %sObjectManager;" % i.cpp_class_name)
+            self.emit_h_s("};")
+
+            self.declare_subtree_stub(i)
+            self.declare_object_manager_stub(i)
+
+            for ns in reversed(i.cpp_namespace_name.split("::")[:-1]):
+                self.emit_h_s("}// %s" % ns)
+
+            self.emit_h_s("")
+
+    def declare_subtree_stub(self, i):
+        """ Generate the class serving the objects below a path from a single
+        subtree registration. The objects are implementations of the stub,
+        looked up by the application when they are first accessed.
+        @param Interface i is the interface to generate the subtree for
+        """
+        self.emit_h_s(dedent('''
+        // Serves the objects below a path with a single registration. The
+        // objects are looked up when they are first accessed, and are cached
+        // until they have been idle for the time set with setIdleTimeout()
+        // and have no calls left to reply to.
+        // Everything is dispatched in the thread-default main context of the
+        // thread creating the subtree.
+        class {i.cpp_class_name}Subtree {{
+        public:
+            // Returns the node names of the objects, relative to the path
+            typedef sigc::slot<std::vector<Glib::ustring> > SlotEnumerate;
+            // Returns the object of a node name, or an empty pointer if there
+            // is none. The node name of the path itself is empty.
+            typedef sigc::slot<std::shared_ptr<{i.cpp_class_name}>, const Glib::ustring&> SlotLookup;
+
+            {i.cpp_class_name}Subtree(const SlotEnumerate &enumerate, const SlotLookup &lookup);
+            virtual ~{i.cpp_class_name}Subtree();
+
+            guint register_subtree(const Glib::RefPtr<Gio::DBus::Connection> &connection,
+                                   const Glib::ustring &object_path);
+            void unregister_subtree();
+
+            // Drops cached objects not accessed for the given number of
+            // seconds. 0, the default, keeps them until unregistered.
+            void setIdleTimeout(guint seconds);
+
+        private:
+            struct Entry {{
+                std::shared_ptr<{i.cpp_class_name}> object;
+                gint64 lastUsed;
+                // Invocations not released yet, which may be replied to
+                // from a worker thread or later from the application
+                std::shared_ptr<std::atomic<guint> > calls;
+            }};
+
+            std::vector<Glib::ustring> on_enumerate(const Glib::RefPtr<Gio::DBus::Connection>& connection,
+                                                    const Glib::ustring& sender,
+                                                    const Glib::ustring& object_path);
+
+            std::vector<Glib::RefPtr<Gio::DBus::InterfaceInfo> > on_introspect(
+                   const Glib::RefPtr<Gio::DBus::Connection>& connection,
+                   const Glib::ustring& sender,
+                   const Glib::ustring& object_path,
+                   const Glib::ustring& node);
+
+            const Gio::DBus::InterfaceVTable *on_dispatch(
+                   const Glib::RefPtr<Gio::DBus::Connection>& connection,
+                   const Glib::ustring& sender,
+                   const Glib::ustring& object_path,
+                   const Glib::ustring& interface_name,
+                   const Glib::ustring& node);
+
+            void on_method_call(const Glib::RefPtr<Gio::DBus::Connection>& connection,
+                               const Glib::ustring& sender,
+                               const Glib::ustring& object_path,
+                               const Glib::ustring& interface_name,
+                               const Glib::ustring& method_name,
+                               const Glib::VariantContainerBase& parameters,
+                               const Glib::RefPtr<Gio::DBus::MethodInvocation>& invocation);
+
+            void on_interface_get_property(Glib::VariantBase& property,
+                                           const Glib::RefPtr<Gio::DBus::Connection>& connection,
+                                           const Glib::ustring& sender,
+                                           const Glib::ustring& object_path,
+                                           const Glib::ustring& interface_name,
+                                           const Glib::ustring& property_name);
+
+            bool on_interface_set_property(
+                   const Glib::RefPtr<Gio::DBus::Connection>& connection,
+                   const Glib::ustring& sender,
+                   const Glib::ustring& object_path,
+                   const Glib::ustring& interface_name,
+                   const Glib::ustring& property_name,
+                   const Glib::VariantBase& value);
+
+            std::shared_ptr<{i.cpp_class_name}> getObject(const Glib::ustring &node);
+            Glib::ustring nodeName(const Glib::ustring &object_path);
+            bool evictIdle();
+            static void releaseCall(gpointer data);
+
+            SlotEnumerate m_enumerate;
+            SlotLookup m_lookup;
+            Glib::RefPtr<Glib::MainContext> m_context;
+            Glib::RefPtr<Gio::DBus::InterfaceInfo> m_interfaceInfo;
+            Gio::DBus::InterfaceVTable m_interfaceVTable;
+            Glib::RefPtr<Gio::DBus::Connection> m_connection;
+            Glib::ustring m_objectPath;
+            guint m_registeredId;
+            guint m_idleTimeout;
+            sigc::connection m_evictConnection;
+            std::map<Glib::ustring, Entry> m_objects;
+        }};''').format(**locals()))
+
+    def define_types_subtree_stub(self, i):
+        subtree = "::".join(i.cpp_namespace_name.split("::")[:-1] + [i.cpp_class_name + "Subtree"])
+        self.emit_cpp_s(dedent('''
+        {subtree}::{i.cpp_class_name}Subtree(const SlotEnumerate &enumerate, const SlotLookup &lookup) :
+            m_enumerate(enumerate),
+            m_lookup(lookup),
+            m_context(Glib::wrap(g_main_context_ref_thread_default(), false)),
+            m_interfaceVTable(sigc::mem_fun(this, &{i.cpp_class_name}Subtree::on_method_call),
+                              sigc::mem_fun(this, &{i.cpp_class_name}Subtree::on_interface_get_property),
+                              sigc::mem_fun(this, &{i.cpp_class_name}Subtree::on_interface_set_property)),
+            m_registeredId(0),
+            m_idleTimeout(0)
+        {{
+        }}
+
+        {subtree}::~{i.cpp_class_name}Subtree()
+        {{
+            unregister_subtree();
+        }}
+
+        guint {subtree}::register_subtree(
+            const Glib::RefPtr<Gio::DBus::Connection> &connection,
+            const Glib::ustring &object_path)
+        {{
+            if (m_registeredId != 0) {{
+                g_warning("Cannot register the same subtree twice!");
+
+                return 0;
+            }}
+            try {{
+                    m_interfaceInfo = lookupInterfaceInfo("{i.name}");
+            }} catch(const Glib::Error& ex) {{
+                    g_warning("Unable to create introspection data: ");
+                    g_warning("%s\\n", ex.what().c_str());
+            }}
+            Gio::DBus::SubtreeVTable vtable(
+                sigc::mem_fun(this, &{i.cpp_class_name}Subtree::on_enumerate),
+                sigc::mem_fun(this, &{i.cpp_class_name}Subtree::on_introspect),
+                sigc::mem_fun(this, &{i.cpp_class_name}Subtree::on_dispatch));
+            // GDBus dispatches in the thread-default context of the
+            // registering thread, which has to own the context
+            if (!g_main_context_acquire(m_context->gobj())) {{
+                g_warning("Cannot register the subtree from a thread not running its context");
+
+                return 0;
+            }}
+            // Objects need not be enumerated to be dispatched to, the lookup
+            // decides whether they exist
+            g_main_context_push_thread_default(m_context->gobj());
+            try {{
+                m_registeredId = connection->register_subtree(object_path,
+                    vtable,
+                    Gio::DBus::SUBTREE_FLAGS_DISPATCH_TO_UNENUMERATED_NODES);
+                m_connection = connection;
+                m_objectPath = object_path;
+            }}
+            catch(const Glib::Error &ex) {{
+                g_warning("Registration of subtree failed");
+            }}
+            g_main_context_pop_thread_default(m_context->gobj());
+            g_main_context_release(m_context->gobj());
+            return m_registeredId;
+        }}
+
+        void {subtree}::unregister_subtree()
+        {{
+            if (m_registeredId != 0) {{
+                m_connection->unregister_subtree(m_registeredId);
+                m_registeredId = 0;
+            }}
+            m_evictConnection.disconnect();
+            m_objects.clear();
+        }}
+
+        void {subtree}::setIdleTimeout(guint seconds)
+        {{
+            m_idleTimeout = seconds;
+            m_evictConnection.disconnect();
+            if (seconds > 0) {{
+                m_evictConnection = m_context->signal_timeout().connect_seconds(
+                    sigc::mem_fun(this, &{i.cpp_class_name}Subtree::evictIdle), seconds);
+            }}
+        }}
+
+        std::vector<Glib::ustring> {subtree}::on_enumerate(
+            const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+            const Glib::ustring& /* sender */,
+            const Glib::ustring& /* object_path */)
+        {{
+            return m_enumerate();
+        }}
+
+        std::vector<Glib::RefPtr<Gio::DBus::InterfaceInfo> > {subtree}::on_introspect(
+            const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+            const Glib::ustring& /* sender */,
+            const Glib::ustring& /* object_path */,
+            const Glib::ustring& node)
+        {{
+            std::vector<Glib::RefPtr<Gio::DBus::InterfaceInfo> > interfaces;
+            if (getObject(node)) {{
+                interfaces.push_back(m_interfaceInfo);
+            }}
+            return interfaces;
+        }}
+
+        const Gio::DBus::InterfaceVTable *{subtree}::on_dispatch(
+            const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+            const Glib::ustring& /* sender */,
+            const Glib::ustring& /* object_path */,
+            const Glib::ustring& interface_name,
+            const Glib::ustring& node)
+        {{
+            if (interface_name != "{i.name}" || !getObject(node)) {{
+                return NULL;
+            }}
+            return &m_interfaceVTable;
+        }}
+
+        void {subtree}::on_method_call(const Glib::RefPtr<Gio::DBus::Connection>& connection,
+                           const Glib::ustring& sender,
+                           const Glib::ustring& object_path,
+                           const Glib::ustring& interface_name,
+                           const Glib::ustring& method_name,
+                           const Glib::VariantContainerBase& parameters,
+                           const Glib::RefPtr<Gio::DBus::MethodInvocation>& invocation)
+        {{
+            Glib::ustring node = nodeName(object_path);
+            std::shared_ptr<{i.cpp_class_name}> object = getObject(node);
+            if (!object) {{
+                invocation->return_dbus_error("org.freedesktop.DBus.Error.UnknownObject", "No such object");
+                return;
+            }}
+            // The call is in progress until the invocation is finalized,
+            // after the reply or when the last reference to it is dropped
+            std::shared_ptr<std::atomic<guint> > *calls =
+                new std::shared_ptr<std::atomic<guint> >(m_objects[node].calls);
+            (**calls)++;
+            g_object_set_data_full(G_OBJECT(invocation->gobj()), "{i.cpp_class_name}Subtree-call", calls,
+                                   &{i.cpp_class_name}Subtree::releaseCall);
+            object->on_method_call(connection, sender, object_path, interface_name, method_name, parameters, invocation);
+        }}
+
+        void {subtree}::on_interface_get_property(Glib::VariantBase& property,
+                                               const Glib::RefPtr<Gio::DBus::Connection>& connection,
+                                               const Glib::ustring& sender,
+                                               const Glib::ustring& object_path,
+                                               const Glib::ustring& interface_name,
+                                               const Glib::ustring& property_name)
+        {{
+            std::shared_ptr<{i.cpp_class_name}> object = getObject(nodeName(object_path));
+            if (!object) {{
+                throw Gio::DBus::Error(Gio::DBus::Error::UNKNOWN_OBJECT, "No such object");
+            }}
+            object->on_interface_get_property(property, connection, sender, object_path, interface_name, property_name);
+        }}
+
+        bool {subtree}::on_interface_set_property(
+               const Glib::RefPtr<Gio::DBus::Connection>& connection,
+               const Glib::ustring& sender,
+               const Glib::ustring& object_path,
+               const Glib::ustring& interface_name,
+               const Glib::ustring& property_name,
+               const Glib::VariantBase& value)
+        {{
+            std::shared_ptr<{i.cpp_class_name}> object = getObject(nodeName(object_path));
+            if (!object) {{
+                throw Gio::DBus::Error(Gio::DBus::Error::UNKNOWN_OBJECT, "No such object");
+            }}
+            return object->on_interface_set_property(connection, sender, object_path, interface_name, property_name, value);
+        }}
+
+        std::shared_ptr<{i.cpp_namespace_name}> {subtree}::getObject(const Glib::ustring &node)
+        {{
+            gint64 now = g_get_monotonic_time();
+            std::map<Glib::ustring, Entry>::iterator it = m_objects.find(node);
+            if (it != m_objects.end()) {{
+                it->second.lastUsed = now;
+                return it->second.object;
+            }}
+
+            std::shared_ptr<{i.cpp_class_name}> object = m_lookup(node);
+            if (!object) {{
+                return object;
+            }}
+
+            // The object sends its signals and property changes from its
+            // own path on the connection of the subtree
+            object->m_connection = m_connection;
+            object->m_objectPath = m_objectPath;
+            if (!node.empty()) {{
+                if (m_objectPath != "/") {{
+                    object->m_objectPath += "/";
+                }}
+                object->m_objectPath += node;
+            }}
+
+            Entry entry;
+            entry.object = object;
+            entry.lastUsed = now;
+            entry.calls = std::make_shared<std::atomic<guint> >(0);
+            m_objects[node] = entry;
+            return object;
+        }}
+
+        Glib::ustring {subtree}::nodeName(const Glib::ustring &object_path)
+        {{
+            if (object_path.size() <= m_objectPath.size()) {{
+                return Glib::ustring();
+            }}
+            Glib::ustring::size_type start = m_objectPath.size();
+            if (m_objectPath != "/") {{
+                start++;
+            }}
+            return object_path.substr(start);
+        }}
+
+        bool {subtree}::evictIdle()
+        {{
+            gint64 limit = g_get_monotonic_time() - gint64(m_idleTimeout) * G_USEC_PER_SEC;
+            std::map<Glib::ustring, Entry>::iterator it = m_objects.begin();
+            while (it != m_objects.end()) {{
+                if (it->second.lastUsed < limit && *it->second.calls == 0) {{
+                    m_objects.erase(it++);
+                }} else {{
+                    ++it;
+                }}
+            }}
+            return true;
+        }}
+
+        void {subtree}::releaseCall(gpointer data)
+        {{
+            std::shared_ptr<std::atomic<guint> > *calls = static_cast<std::shared_ptr<std::atomic<guint> >*>(data);
+            (**calls)--;
+            delete calls;
+        }}''').format(**locals()))
+
+    def declare_object_manager_stub(self, i):
+        """ Generate the class exporting objects of interface i below a path,
+        with org.freedesktop.DBus.ObjectManager implemented on the path
+        @param Interface i is the interface to generate the object manager for
+        """
+        self.emit_h_s(dedent('''
+        // Exports objects implementing {i.name} below a path, and
+        // implements org.freedesktop.DBus.ObjectManager on the path itself.
+        // Clients get all objects with their properties in a single
+        // GetManagedObjects call.
+        class {i.cpp_class_name}ObjectManager {{
+        public:
+            {i.cpp_class_name}ObjectManager();
+            virtual ~{i.cpp_class_name}ObjectManager();
+
+            guint register_object(const Glib::RefPtr<Gio::DBus::Connection> &connection,
+                                  const Glib::ustring &object_path);
+
+            // Registers the object at a path below the path of the manager,
+            // and announces it with InterfacesAdded
+            bool export_object(const std::shared_ptr<{i.cpp_class_name}> &object,
+                               const Glib::ustring &object_path);
+
+            // Unregisters the object and announces it with InterfacesRemoved
+            void unexport_object(const Glib::ustring &object_path);
+
+        private:
+            struct Entry {{
+                std::shared_ptr<{i.cpp_class_name}> object;
+                guint registeredId;
+            }};
+
+            void on_method_call(const Glib::RefPtr<Gio::DBus::Connection>& connection,
+                               const Glib::ustring& sender,
+                               const Glib::ustring& object_path,
+                               const Glib::ustring& interface_name,
+                               const Glib::ustring& method_name,
+                               const Glib::VariantContainerBase& parameters,
+                               const Glib::RefPtr<Gio::DBus::MethodInvocation>& invocation);
+
+            GVariant *interfacesAndProperties(const std::shared_ptr<{i.cpp_class_name}> &object);
+            void sendSignal(const gchar *signalName, GVariant *parameters);
+
+            Glib::RefPtr<Gio::DBus::NodeInfo> m_introspectionData;
+            Gio::DBus::InterfaceVTable m_interfaceVTable;
+            Glib::RefPtr<Gio::DBus::Connection> m_connection;
+            Glib::ustring m_objectPath;
+            guint m_registeredId;
+            std::map<Glib::ustring, Entry> m_objects;
+        }};''').format(**locals()))
+
+    def define_types_object_manager_stub(self, i):
+        manager = "::".join(i.cpp_namespace_name.split("::")[:-1] + [i.cpp_class_name + "ObjectManager"])
+
+        # All readable properties of an object, as sent in GetManagedObjects
+        # and InterfacesAdded
+        self.emit_cpp_s(dedent('''
+        GVariant *{i.cpp_namespace_name}::buildProperties()
+        {{
+            GVariantBuilder builder;
+            g_variant_builder_init(&builder, G_VARIANT_TYPE("a{{sv}}"));''').format(**locals()))
+        for p in i.properties:
+            if not p.readable:
+                continue
+            value_new = p.gvariant_new(p.name + "_get()", i.cpp_class_name)
+            if p.stored:
+                self.emit_cpp_s(indent(dedent('''\
+                    if (m_{p.name}Value.gobj()) {{
+                        g_variant_builder_add(&builder, "{{sv}}", "{p.name}", const_cast<GVariant*>(m_{p.name}Value.gobj()));
+                    }}''').format(**locals()), 4))
+            else:
+                self.emit_cpp_s("    g_variant_builder_add(&builder, \"{{sv}}\", \"{p.name}\", {value_new});".format(**locals()))
+        self.emit_cpp_s(dedent('''\
+            return g_variant_builder_end(&builder);
+        }}''').format(**locals()))
+
+        self.emit_cpp_s(dedent('''
+        {manager}::{i.cpp_class_name}ObjectManager() :
+            m_interfaceVTable(sigc::mem_fun(this, &{i.cpp_class_name}ObjectManager::on_method_call)),
+            m_registeredId(0)
+        {{
+        }}
+
+        {manager}::~{i.cpp_class_name}ObjectManager()
+        {{
+            if (!m_connection) {{
+                return;
+            }}
+            for (std::map<Glib::ustring, Entry>::iterator it = m_objects.begin(); it != m_objects.end(); ++it) {{
+                m_connection->unregister_object(it->second.registeredId);
+            }}
+            m_connection->unregister_object(m_registeredId);
+        }}
+
+        guint {manager}::register_object(
+            const Glib::RefPtr<Gio::DBus::Connection> &connection,
+            const Glib::ustring &object_path)
+        {{
+            if (m_registeredId != 0) {{
+                g_warning("Cannot register the same object manager twice!");
+
+                return 0;
+            }}
+            static const char objectManagerXml[] =
+                "<node>"
+                "  <interface name='org.freedesktop.DBus.ObjectManager'>"
+                "    <method name='GetManagedObjects'>"
+                "      <arg type='a{{oa{{sa{{sv}}}}}}' name='objects' direction='out'/>"
+                "    </method>"
+                "    <signal name='InterfacesAdded'>"
+                "      <arg type='o' name='object_path'/>"
+                "      <arg type='a{{sa{{sv}}}}' name='interfaces_and_properties'/>"
+                "    </signal>"
+                "    <signal name='InterfacesRemoved'>"
+                "      <arg type='o' name='object_path'/>"
+                "      <arg type='as' name='interfaces'/>"
+                "    </signal>"
+                "  </interface>"
+                "</node>";
+            try {{
+                m_introspectionData = Gio::DBus::NodeInfo::create_for_xml(objectManagerXml);
+                m_registeredId = connection->register_object(object_path,
+                    m_introspectionData->lookup_interface("org.freedesktop.DBus.ObjectManager"),
+                    m_interfaceVTable);
+                m_connection = connection;
+                m_objectPath = object_path;
+            }}
+            catch(const Glib::Error &ex) {{
+                g_warning("Registration of object manager failed");
+            }}
+            return m_registeredId;
+        }}
+
+        bool {manager}::export_object(const std::shared_ptr<{i.cpp_namespace_name}> &object,
+                                      const Glib::ustring &object_path)
+        {{
+            if (!m_connection || m_objects.count(object_path) > 0) {{
+                g_warning("Cannot export object %s", object_path.c_str());
+
+                return false;
+            }}
+            // Clients only look for the objects below the path of the manager
+            const Glib::ustring prefix = m_objectPath == "/" ? m_objectPath : m_objectPath + "/";
+            if (object_path.compare(0, prefix.size(), prefix) != 0 || object_path.size() == prefix.size()) {{
+                g_warning("Cannot export object %s outside of the object manager path %s",
+                          object_path.c_str(), m_objectPath.c_str());
+
+                return false;
+            }}
+            Entry entry;
+            entry.object = object;
+            entry.registeredId = object->register_object(m_connection, object_path);
+            if (entry.registeredId == 0) {{
+                return false;
+            }}
+            m_objects[object_path] = entry;
+
+            GVariant *params[] = {{
+                g_variant_new_object_path(object_path.c_str()),
+                interfacesAndProperties(object)
+            }};
+            sendSignal("InterfacesAdded", g_variant_new_tuple(params, 2));
+            return true;
+        }}
+
+        void {manager}::unexport_object(const Glib::ustring &object_path)
+        {{
+            std::map<Glib::ustring, Entry>::iterator it = m_objects.find(object_path);
+            if (it == m_objects.end()) {{
+                return;
+            }}
+            m_connection->unregister_object(it->second.registeredId);
+            m_objects.erase(it);
+
+            const gchar *interfaces[] = {{ "{i.name}" }};
+            GVariant *params[] = {{
+                g_variant_new_object_path(object_path.c_str()),
+                g_variant_new_strv(interfaces, 1)
+            }};
+            sendSignal("InterfacesRemoved", g_variant_new_tuple(params, 2));
+        }}
+
+        void {manager}::on_method_call(const Glib::RefPtr<Gio::DBus::Connection>& /* connection */,
+                           const Glib::ustring& /* sender */,
+                           const Glib::ustring& /* object_path */,
+                           const Glib::ustring& /* interface_name */,
+                           const Glib::ustring& method_name,
+                           const Glib::VariantContainerBase& /* parameters */,
+                           const Glib::RefPtr<Gio::DBus::MethodInvocation>& invocation)
+        {{
+            if (method_name.compare("GetManagedObjects") == 0) {{
+                GVariantBuilder builder;
+                g_variant_builder_init(&builder, G_VARIANT_TYPE("a{{oa{{sa{{sv}}}}}}"));
+                for (std::map<Glib::ustring, Entry>::iterator it = m_objects.begin(); it != m_objects.end(); ++it) {{
+                    g_variant_builder_add(&builder, "{{o@a{{sa{{sv}}}}}}", it->first.c_str(),
+                                          interfacesAndProperties(it->second.object));
+                }}
+                GVariant *values[] = {{
+                    g_variant_builder_end(&builder)
+                }};
+                Glib::VariantContainerBase tuple(g_variant_ref_sink(g_variant_new_tuple(values, 1)), false);
+
+                invocation->return_value(tuple);
+            }}
+        }}
+
+        GVariant *{manager}::interfacesAndProperties(const std::shared_ptr<{i.cpp_namespace_name}> &object)
+        {{
+            GVariantBuilder builder;
+            g_variant_builder_init(&builder, G_VARIANT_TYPE("a{{sa{{sv}}}}"));
+            g_variant_builder_add(&builder, "{{s@a{{sv}}}}", "{i.name}", object->buildProperties());
+            return g_variant_builder_end(&builder);
+        }}
+
+        void {manager}::sendSignal(const gchar *signalName, GVariant *parameters)
+        {{
+            // The floating parameters are consumed
+            GError *error = NULL;
+            g_dbus_connection_emit_signal(m_connection->gobj(),
+                                          NULL,
+                                          m_objectPath.c_str(),
+                                          "org.freedesktop.DBus.ObjectManager",
+                                          signalName,
+                                          parameters,
+                                          &error);
+            if (error) {{
+                Glib::Error::throw_exception(error);
+            }}
+        }}''').format(**locals()))
+
+    def define_types_stub_creation(self, i):
+        # Constructor
+        self.emit_cpp_s(dedent('''
+        {i.cpp_namespace_name}::{i.cpp_class_name} () : connectionId(0), registeredId(0), m_interfaceName("{i.name}") {{
+        ''').format(**locals()))
+        for s in i.signals:
+            # Sigc does not allow an infinite number of parameters for signals.
+            # The maximum number of signals is specified in SIGNAL_MAX_PARAM. A
+            # warning is issued if this is exceeded, and no signal handler uis
+            # generated.
+            if (len(s.args) > SIGNAL_MAX_PARAM):
+                print "WARNING: signal %s has too many parameters, skipping" % s.name
+                continue
+            self.emit_cpp_s("    {s.name}_signal.connect(sigc::mem_fun(this, &{i.cpp_class_name}::{s.name}_emitter));".format(**locals()))
+        if i.threaded:
+            # Threaded method calls are queued to a pool of up to one thread
+            # per processor
+            self.emit_cpp_s("    m_threadPool = g_thread_pool_new(&{i.cpp_class_name}::runMethodCall, NULL, g_get_num_processors(), FALSE, NULL);".format(**locals()))
+        for s in self.coalesced_signals_stub(i):
+            self.emit_cpp_s("    m_{s.name}Coalesced.interval = {s.coalesce};".format(**locals()))
+            self.emit_cpp_s("    m_{s.name}Coalesced.dropped = 0;".format(**locals()))
+            self.emit_cpp_s("    m_{s.name}Coalesced.pending = NULL;".format(**locals()))
+            self.emit_cpp_s("    m_{s.name}Coalesced.scheduled = false;".format(**locals()))
+        destructor_body = ""
+        if i.threaded:
+            # The implementation is already destroyed here, threaded calls
+            # still running would use it
+            destructor_body = dedent('''
+                if (m_threadPool) {{
+                    g_critical("{i.cpp_class_name}: stopThreads() was not called by the implementation");
+                    stopThreads();
+                }}''').format(**locals()).replace("\n", "\n    ")
+        for s in self.coalesced_signals_stub(i):
+            destructor_body += dedent('''
+                m_{s.name}Coalesced.timer.disconnect();
+                if (m_{s.name}Coalesced.pending) {{
+                    g_variant_unref(m_{s.name}Coalesced.pending);
+                }}''').format(**locals()).replace("\n", "\n    ")
+        self.emit_cpp_s(dedent('''
         }}
 
         {i.cpp_namespace_name}::~{i.cpp_class_name}()
-        {{
+        {{{destructor_body}
         }}
 
         guint {i.cpp_namespace_name}::register_object(
@@ -606,8 +2725,9 @@ class CodeGenerator:
 
                 return 0;
             }}
+            Glib::RefPtr<Gio::DBus::InterfaceInfo> interfaceInfo;
             try {{
-                    introspection_data = Gio::DBus::NodeInfo::create_for_xml(interfaceXml0);
+                    interfaceInfo = lookupInterfaceInfo("{i.name}");
             }} catch(const Glib::Error& ex) {{
                     g_warning("Unable to create introspection data: ");
                     g_warning("%s\\n", ex.what().c_str());
@@ -618,9 +2738,20 @@ class CodeGenerator:
                     sigc::mem_fun(this, &{i.cpp_class_name}::on_interface_get_property),
                     sigc::mem_fun(this, &{i.cpp_class_name}::on_interface_set_property));
             guint id = 0;
+            // GDBus dispatches the calls in the thread-default context of
+            // the registering thread, which has to own the context
+            if (m_context && !g_main_context_acquire(m_context->gobj())) {{
+                g_warning("Cannot register the object from a thread not running its context");
+                delete interface_vtable;
+
+                return 0;
+            }}
+            if (m_context) {{
+                g_main_context_push_thread_default(m_context->gobj());
+            }}
             try {{
                 id = connection->register_object(object_path,
-                    introspection_data->lookup_interface("{i.name}"),
+                    interfaceInfo,
                     *interface_vtable);
                 m_connection = connection;
                 m_objectPath = object_path;
@@ -628,9 +2759,22 @@ class CodeGenerator:
             catch(const Glib::Error &ex) {{
                 g_warning("Registration of object failed");
             }}
+            if (m_context) {{
+                g_main_context_pop_thread_default(m_context->gobj());
+                g_main_context_release(m_context->gobj());
+            }}
             return id;
         }}
 
+        guint {i.cpp_namespace_name}::register_object(
+            const Glib::RefPtr<Gio::DBus::Connection> &connection,
+            const Glib::ustring &object_path,
+            const Glib::RefPtr<Glib::MainContext> &context)
+        {{
+            m_context = context;
+            return register_object(connection, object_path);
+        }}
+
         void {i.cpp_namespace_name}::connect (
             Gio::DBus::BusType busType,
             std::string name)
@@ -640,7 +2784,72 @@ class CodeGenerator:
                                                sigc::mem_fun(this, &{i.cpp_class_name}::on_bus_acquired),
                                                sigc::mem_fun(this, &{i.cpp_class_name}::on_name_acquired),
                                                sigc::mem_fun(this, &{i.cpp_class_name}::on_name_lost));
-        }}''').format(**locals()))
+        }}
+
+        void {i.cpp_namespace_name}::connect (
+            Gio::DBus::BusType busType,
+            const std::string &name,
+            const Glib::RefPtr<Glib::MainContext> &context)
+        {{
+            // The name callbacks, and the registration done from them, use
+            // the thread-default context at the time the name is owned. If
+            // another thread runs the context, the name is owned from there.
+            m_context = context;
+            if (!g_main_context_acquire(context->gobj())) {{
+                context->invoke([this, busType, name, context]() {{
+                    connect(busType, name, context);
+                    return false;
+                }});
+                return;
+            }}
+            g_main_context_push_thread_default(context->gobj());
+            connect(busType, name);
+            g_main_context_pop_thread_default(context->gobj());
+            g_main_context_release(context->gobj());
+        }}
+
+        void {i.cpp_namespace_name}::setSignalDestination(const Glib::ustring &destination)
+        {{''').format(**locals()))
+        coalesced = self.coalesced_signals_stub(i)
+        if coalesced:
+            self.emit_cpp_s("    // Read by coalesced signals while holding their mutex")
+            for n, s in enumerate(coalesced):
+                self.emit_cpp_s("    std::lock_guard<std::mutex> lock{n}(m_{s.name}Coalesced.mutex);".format(**locals()))
+        self.emit_cpp_s(dedent('''\
+            m_signalDestination = destination;
+        }'''))
+
+        if i.threaded:
+            self.emit_cpp_s(dedent('''
+            void {i.cpp_namespace_name}::setMaxThreads(int maxThreads)
+            {{
+                if (m_threadPool) {{
+                    g_thread_pool_set_max_threads(m_threadPool, maxThreads, NULL);
+                }}
+            }}
+
+            void {i.cpp_namespace_name}::stopThreads()
+            {{
+                if (m_threadPool) {{
+                    g_thread_pool_free(m_threadPool, FALSE, TRUE);
+                    m_threadPool = NULL;
+                }}
+            }}
+
+            void {i.cpp_namespace_name}::runMethodCall(gpointer data, gpointer /* userData */)
+            {{
+                ThreadedCall *call = static_cast<ThreadedCall*>(data);
+                try {{
+                    call->run();
+                }} catch (const Glib::Error &ex) {{
+                    g_warning("Threaded method call failed: %s", ex.what().c_str());
+                    call->invocation->return_error(ex);
+                }} catch (const std::exception &ex) {{
+                    g_warning("Threaded method call failed: %s", ex.what());
+                    call->invocation->return_error(Gio::DBus::Error(Gio::DBus::Error::FAILED, ex.what()));
+                }}
+                delete call;
+            }}''').format(**locals()))
 
 
     def define_types_method_handlers_stub(self, i):
@@ -662,30 +2871,59 @@ class CodeGenerator:
         for m in i.methods:
             #TODO: Make more thorough checks here. Method name is not enough.
             self.emit_cpp_s("    if (method_name.compare(\"%s\") == 0) {" % m.name)
-            for ai in range(len(m.in_args)):
-                a = m.in_args[ai]
-                if a.signature == "v":
-                    # Variants are deconstructed differently than the other types
-                    self.emit_cpp_s("        Glib::VariantContainerBase containerBase = parameters;")
-                    self.emit_cpp_s("        GVariant *output%s;" % (ai))
-                    self.emit_cpp_s('        g_variant_get_child(containerBase.gobj(), %s, "v", &output%s);' % (ai, ai))
-                    self.emit_cpp_s("        Glib::VariantBase p_%s;" % (a.name))
-                    self.emit_cpp_s("        p_%s = Glib::VariantBase(output%s);" % (a.name, ai))
-                    self.emit_cpp_s("")
-                else:
-                    self.emit_cpp_s("        Glib::Variant<%s > base_%s;" % (a.cpptype_get, a.name))
-                    self.emit_cpp_s("        parameters.get_child(base_%s, %d);" % (a.name, ai))
-                    self.emit_cpp_s("        %s p_%s;" % (a.cpptype_get, a.name))
-                    self.emit_cpp_s("        p_%s = base_%s.get();" % (a.name, a.name))
-                    self.emit_cpp_s("")
-            self.emit_cpp_s("        %s(" % m.name)
+            if m.single_flight:
+                # Calls waiting for an identical one are answered with its reply
+                self.emit_cpp_s("        std::string flightKey = %sSingleFlight::key(\"%s\", parameters);" % (i.cpp_class_name, m.name))
+                self.emit_cpp_s("        std::shared_ptr<%sSingleFlight::Flight> flight = m_singleFlight.join(flightKey, invocation);" % i.cpp_class_name)
+                self.emit_cpp_s("        if (!flight) {")
+                self.emit_cpp_s("            return;")
+                self.emit_cpp_s("        }")
+                self.emit_cpp_s("")
             for a in m.in_args:
-                cpptype_cast = a.cpptype_get_cast
-                # Prepend the class name if this is the generic "TypeWrap" class
-                if cpptype_cast.startswith("TypeWrap"):
-                    cpptype_cast = i.cpp_class_name + cpptype_cast
-                self.emit_cpp_s("            %s(p_%s)," % (cpptype_cast, a.name))
-            self.emit_cpp_s("            {i.cpp_class_name}MessageHelper(invocation));".format(**locals()))
+                if a.unix_fd_list:
+                    self.emit_cpp_s("        Glib::RefPtr<Gio::UnixFDList> fdList = invocation->get_message()->get_unix_fd_list();")
+                    break
+            # Decode the in-arguments in a single pass over the tuple. The
+            # values are passed to the handler by reference, without copies.
+            if len(m.in_args) > 0:
+                self.emit_cpp_s("        GVariantIter iter;")
+                self.emit_cpp_s("        g_variant_iter_init(&iter, const_cast<GVariant*>(parameters.gobj()));")
+                self.emit_cpp_s("")
+            for a in m.in_args:
+                self.emit_cpp_s("        GVariant *base_%s = g_variant_iter_next_value(&iter);" % (a.name))
+                self.emit_cpp_s("        %s p_%s = %s;" % (a.cpptype_out, a.name, a.gvariant_get("base_" + a.name, i.cpp_class_name)))
+                self.emit_cpp_s("        g_variant_unref(base_%s);" % (a.name))
+                self.emit_cpp_s("")
+            params = []
+            for a in m.in_args:
+                params.append("p_%s" % (a.name))
+            if m.single_flight:
+                params.append("%sMessageHelper(invocation, flight)" % i.cpp_class_name)
+            elif not m.no_reply:
+                params.append("%sMessageHelper(invocation)" % i.cpp_class_name)
+            call = self.param_lines("%s(" % m.name, params, ";")
+            if m.no_reply:
+                # Nothing is sent if the caller does not expect a reply, this
+                # only releases the invocation
+                call.append("invocation->return_value(Glib::VariantContainerBase());")
+            if m.threaded:
+                # The decoded arguments and the invocation are copied to the
+                # worker thread, which replies directly on the connection. The
+                # invocation is kept to reply with the error the handler throws.
+                captures = ", ".join(["this"] + params[:len(m.in_args)] + ["invocation"] + (["flight"] if m.single_flight else []))
+                self.emit_cpp_s("        if (m_threadPool) {")
+                self.emit_cpp_s("            ThreadedCall *call = new ThreadedCall();")
+                self.emit_cpp_s("            call->invocation = invocation;")
+                self.emit_cpp_s("            call->run = [%s]() {" % captures)
+                for line in call:
+                    self.emit_cpp_s("                " + line)
+                self.emit_cpp_s("            };")
+                self.emit_cpp_s("            g_thread_pool_push(m_threadPool, call, NULL);")
+                self.emit_cpp_s("            return;")
+                self.emit_cpp_s("        }")
+                self.emit_cpp_s("")
+            for line in call:
+                self.emit_cpp_s("        " + line)
             self.emit_cpp_s("    }")
         self.emit_cpp_s("    }")
 
@@ -703,15 +2941,24 @@ class CodeGenerator:
 
         for p in i.properties:
             if p.readable:
-                cpptype_to_dbus = p.cpptype_to_dbus
-                # Prepend the class name if this is the generic "TypeWrap" class
-                if cpptype_to_dbus.startswith("TypeWrap"):
-                    cpptype_to_dbus = i.cpp_class_name + cpptype_to_dbus
-                self.emit_cpp_s(dedent('''
-                    if (property_name.compare("{p.name}") == 0) {{
-                        property = Glib::Variant<{p.cpptype_get} >::create({cpptype_to_dbus}({p.name}_get()));
-                    }}
-                ''').format(**locals()))
+                value_new = self.variant_base(p.gvariant_new(p.name + "_get()", i.cpp_class_name))
+                if p.stored:
+                    # Answered with an error until the implementation sets
+                    # a value, like GetAll() leaves it out
+                    self.emit_cpp_s(dedent('''
+                        if (property_name.compare("{p.name}") == 0) {{
+                            if (!m_{p.name}Value.gobj()) {{
+                                throw Gio::DBus::Error(Gio::DBus::Error::FAILED, "Property {p.name} has not been set");
+                            }}
+                            property = m_{p.name}Value;
+                        }}
+                    ''').format(**locals()))
+                else:
+                    self.emit_cpp_s(dedent('''
+                        if (property_name.compare("{p.name}") == 0) {{
+                            property = {value_new};
+                        }}
+                    ''').format(**locals()))
 
         self.emit_cpp_s("}")
 
@@ -727,22 +2974,17 @@ class CodeGenerator:
                const Glib::VariantBase& value) {{
         ''').format(**locals()))
 
+        if len(i.properties) > 0:
+            self.emit_cpp_s("    GVariant *variant = const_cast<GVariant*>(value.gobj());")
+
         for p in i.properties:
+            value_get = p.gvariant_get("variant", i.cpp_class_name)
             self.emit_cpp_s(dedent('''
                 if (property_name.compare("{p.name}") == 0) {{
-                    try {{
-                        Glib::Variant<{p.cpptype_get} > castValue = Glib::VariantBase::cast_dynamic<Glib::Variant<{p.cpptype_get} > >(value);
-                        {p.cpptype_out} val;''').format(**locals()))
-            cpptype_cast = p.cpptype_get_cast
-            # Prepend the class name if this is the generic "TypeWrap" class
-            if cpptype_cast.startswith("TypeWrap"):
-                cpptype_cast = i.cpp_class_name + cpptype_cast
-            self.emit_cpp_s(dedent('''
-                        val = {cpptype_cast}(castValue.get());''').format(**locals()))
-            self.emit_cpp_s('''        {p.name}_set(val);'''.format(**locals()))
-            self.emit_cpp_s(dedent('''
-                    }} catch (std::bad_cast e) {{
+                    if (!g_variant_is_of_type(variant, G_VARIANT_TYPE("{p.signature}"))) {{
                         g_warning ("Bad cast when casting {p.name}");
+                    }} else {{
+                        {p.name}_set({value_get});
                     }}
                 }}
             ''').format(**locals()))
@@ -752,9 +2994,67 @@ class CodeGenerator:
         }}
         ''').format(**locals()))
 
-    def define_types_signal_emitters_stub(self, i):
-        object_path = "/" + i.name.replace(".", "/")
+    def coalesced_signals_stub(self, i):
+        """ Return the signals of Interface i with coalesced emissions """
+        return [s for s in i.signals if s.coalesce != None and len(s.args) <= SIGNAL_MAX_PARAM]
+
+    def define_types_coalesced_signals_stub(self, i):
+        """ Generate the functions sending coalesced signals of Interface i.
+        The first emission is sent right away, and starts an interval in which
+        only the latest emission is kept. It is sent when the interval ends,
+        starting the next one.
+        @param i Interface to generate the functions for
+        """
+        if not self.coalesced_signals_stub(i):
+            return
+        self.emit_cpp_s(dedent('''
+        void {i.cpp_namespace_name}::emitCoalesced(CoalescedSignal &signal, const gchar *signalName, GVariant *parameters) {{
+            std::lock_guard<std::mutex> lock(signal.mutex);
+            if (signal.scheduled) {{
+                if (signal.pending) {{
+                    g_variant_unref(signal.pending);
+                    signal.dropped++;
+                }}
+                signal.pending = g_variant_ref_sink(parameters);
+                return;
+            }}
+
+            sendSignal(m_signalDestination.empty() ? NULL : m_signalDestination.c_str(),
+                       "{i.name}", signalName, parameters);
+            if (signal.interval > 0) {{
+                Glib::RefPtr<Glib::MainContext> context = m_context ? m_context :
+                    Glib::wrap(g_main_context_ref_thread_default(), false);
+                signal.timer = context->signal_timeout().connect(
+                    sigc::bind(sigc::mem_fun(this, &{i.cpp_class_name}::flushCoalesced), &signal, signalName),
+                    signal.interval);
+                signal.scheduled = true;
+            }}
+        }}
+
+        bool {i.cpp_namespace_name}::flushCoalesced(CoalescedSignal *signal, const gchar *signalName) {{
+            std::lock_guard<std::mutex> lock(signal->mutex);
+            // The interval ends without another emission. The timer is
+            // disconnected under the lock, before another thread can
+            // connect the next one.
+            if (!signal->pending) {{
+                signal->scheduled = false;
+                signal->timer.disconnect();
+                return false;
+            }}
+
+            GVariant *parameters = signal->pending;
+            signal->pending = NULL;
+            try {{
+                sendSignal(m_signalDestination.empty() ? NULL : m_signalDestination.c_str(),
+                           "{i.name}", signalName, parameters);
+            }} catch (const Glib::Error &error) {{
+                g_warning("Unable to send signal %s: %s", signalName, error.what().c_str());
+            }}
+            g_variant_unref(parameters);
+            return true;
+        }}''').format(**locals()))
 
+    def define_types_signal_emitters_stub(self, i):
         for s in i.signals:
             # Sigc does not allow an infinite number of parameters for signals.
             # The maximum number of signals is specified in SIGNAL_MAX_PARAM. A
@@ -764,30 +3064,62 @@ class CodeGenerator:
                 print "WARNING: signal %s has too many parameters, skipping" % s.name
                 continue
             args = []
+            names = []
 
             for a in s.args:
-                args.append(a.cpptype_out + " " + a.name)
+                args.append(a.cpptype_in + " " + a.name)
+                names.append(a.name)
 
             argsStr = ", ".join(args)
-            self.emit_cpp_s(dedent('''void {i.cpp_namespace_name}::{s.name}_emitter({argsStr}) {{
-            std::vector<Glib::VariantBase> paramsList;''').format(**locals()))
+            emitToArgsStr = ", ".join(["const Glib::ustring &destination"] + args)
+            emitToNamesStr = ", ".join(["m_signalDestination"] + names)
 
+            # The body is built in one go and handed over to GDBus as is
+            values = []
             for a in s.args:
-                cpptype_to_dbus = a.cpptype_to_dbus
-                # Prepend the class name if this is the generic "TypeWrap" class
-                if cpptype_to_dbus.startswith("TypeWrap"):
-                    cpptype_to_dbus = i.cpp_class_name + cpptype_to_dbus
+                values.append(a.gvariant_new(a.name, i.cpp_class_name))
+            params_lines = []
+            if len(values) > 0:
+                params_lines = self.tuple_lines("params", values)
+                tuple_new = "g_variant_new_tuple(params, %d)" % len(values)
+            else:
+                tuple_new = "g_variant_new_tuple(NULL, 0)"
+
+            if s.coalesce != None:
+                # Broadcasts are coalesced, signals sent to a destination
+                # with _emit_to are not
+                self.emit_cpp_s("")
+                self.emit_cpp_s("void {i.cpp_namespace_name}::{s.name}_emitter({argsStr}) {{".format(**locals()))
+                for line in params_lines:
+                    self.emit_cpp_s("    " + line)
+                self.emit_cpp_s("    emitCoalesced(m_{s.name}Coalesced, \"{s.name}\", {tuple_new});".format(**locals()))
+                self.emit_cpp_s(dedent('''
+                }}
+
+                void {i.cpp_namespace_name}::{s.name}_setCoalesceInterval(guint msec) {{
+                    std::lock_guard<std::mutex> lock(m_{s.name}Coalesced.mutex);
+                    m_{s.name}Coalesced.interval = msec;
+                }}
+
+                guint {i.cpp_namespace_name}::{s.name}_droppedCount() const {{
+                    std::lock_guard<std::mutex> lock(m_{s.name}Coalesced.mutex);
+                    return m_{s.name}Coalesced.dropped;
+                }}
+                ''').format(**locals()))
+            else:
                 self.emit_cpp_s(dedent('''
-                paramsList.push_back(Glib::Variant<{a.cpptype_get} >::create({cpptype_to_dbus}({a.name})));;
+                void {i.cpp_namespace_name}::{s.name}_emitter({argsStr}) {{
+                    {s.name}_emit_to({emitToNamesStr});
+                }}
                 ''').format(**locals()))
 
-            self.emit_cpp_s(dedent('''      m_connection->emit_signal(
-                    "{object_path}",
-                    "{s.iface_name}",
-                    "{s.name}",
-                    Glib::ustring(),
-                    Glib::Variant<std::vector<Glib::VariantBase> >::create_tuple(paramsList));
-            }}''').format(**locals()))
+            self.emit_cpp_s("void {i.cpp_namespace_name}::{s.name}_emit_to({emitToArgsStr}) {{".format(**locals()))
+            for line in params_lines:
+                self.emit_cpp_s("    " + line)
+
+            self.emit_cpp_s("    sendSignal(destination.empty() ? NULL : destination.c_str(),")
+            self.emit_cpp_s("               \"{s.iface_name}\", \"{s.name}\", {tuple_new});".format(**locals()))
+            self.emit_cpp_s("}")
 
     def define_types_dbus_callbacks_stub(self, i):
         object_path = "/" + i.name.replace(".", "/")
@@ -809,21 +3141,47 @@ class CodeGenerator:
 
     def define_types_property_setters_stub(self, i):
         for p in i.properties:
-            cpptype_to_dbus = p.cpptype_to_dbus
-            # Prepend the class name if this is the generic "TypeWrap" class
-            if cpptype_to_dbus.startswith("TypeWrap"):
-                cpptype_to_dbus = i.cpp_class_name + cpptype_to_dbus
             self.emit_cpp_s(dedent('''
             bool {i.cpp_namespace_name}::{p.name}_set({p.cpptype_in} value) {{
-                if ({p.name}_setHandler(value)) {{
-                    Glib::Variant<{p.cpptype_get} > value_get = Glib::Variant<{p.cpptype_get} >::create({cpptype_to_dbus}({p.name}_get()));
-                    emitSignal("{p.name}", value_get);
+                if ({p.name}_setHandler(value)) {{''').format(**locals()))
+            if p.stored:
+                # The value is converted once here instead of on every Get
+                value_new = self.variant_base(p.gvariant_new("value", i.cpp_class_name))
+                self.emit_cpp_s("        Glib::VariantBase value_get = {value_new};".format(**locals()))
+                self.emit_cpp_s("        m_{p.name}Value = value_get;".format(**locals()))
+                if p.emits_changed_signal == 'true':
+                    self.emit_cpp_s("        emitSignal(\"{p.name}\", value_get);".format(**locals()))
+                elif p.emits_changed_signal == 'invalidates':
+                    self.emit_cpp_s("        emitInvalidatedSignal(\"{p.name}\");".format(**locals()))
+            elif p.emits_changed_signal == 'true':
+                value_new = self.variant_base(p.gvariant_new(p.name + "_get()", i.cpp_class_name))
+                self.emit_cpp_s("        Glib::VariantBase value_get = {value_new};".format(**locals()))
+                self.emit_cpp_s("        emitSignal(\"{p.name}\", value_get);".format(**locals()))
+            elif p.emits_changed_signal == 'invalidates':
+                self.emit_cpp_s("        emitInvalidatedSignal(\"{p.name}\");".format(**locals()))
+            # Nothing is emitted for 'const' and 'false' properties
+            self.emit_cpp_s(dedent('''\
                     return true;
                 }}
 
                 return false;
             }}''').format(**locals()))
 
+            if p.stored:
+                value_get = p.gvariant_get("m_" + p.name + "Value.gobj()", i.cpp_class_name)
+                self.emit_cpp_s(dedent('''
+                {p.cpptype_out} {i.cpp_namespace_name}::{p.name}_get() {{
+                    if (!m_{p.name}Value.gobj()) {{
+                        return {p.cpptype_out}();
+                    }}
+
+                    return {value_get};
+                }}
+
+                bool {i.cpp_namespace_name}::{p.name}_setHandler({p.cpptype_in} value) {{
+                    return true;
+                }}''').format(**locals()))
+
     def define_types_emit_stub(self, i):
             self.emit_cpp_s(dedent('''
             bool {i.cpp_namespace_name}::emitSignal(const std::string& propName, Glib::VariantBase& value) {{
@@ -832,20 +3190,68 @@ class CodeGenerator:
 
                 changedProps[propName] = value;
 
-                Glib::Variant<std::map<Glib::ustring,  Glib::VariantBase> > changedPropsVar = Glib::Variant<std::map <Glib::ustring, Glib::VariantBase> >::create (changedProps);
-                Glib::Variant<std::vector<Glib::ustring> > changedPropsNoValueVar = Glib::Variant<std::vector<Glib::ustring> >::create(changedPropsNoValue);
-                std::vector<Glib::VariantBase> ps;
-                ps.push_back(Glib::Variant<Glib::ustring>::create(m_interfaceName));
-                ps.push_back(changedPropsVar);
-                ps.push_back(changedPropsNoValueVar);
-                Glib::VariantContainerBase propertiesChangedVariant = Glib::Variant<std::vector<Glib::VariantBase> >::create_tuple(ps);
-
-                m_connection->emit_signal(
-                    m_objectPath,
-                    "org.freedesktop.DBus.Properties",
-                    "PropertiesChanged",
-                    Glib::ustring(),
-                    propertiesChangedVariant);
+                return emitPropertiesChanged(changedProps, changedPropsNoValue);
+            }}
+
+            bool {i.cpp_namespace_name}::emitInvalidatedSignal(const std::string& propName) {{
+                std::map<Glib::ustring, Glib::VariantBase> changedProps;
+                std::vector<Glib::ustring> changedPropsNoValue;
+
+                changedPropsNoValue.push_back(propName);
+
+                return emitPropertiesChanged(changedProps, changedPropsNoValue);
+            }}
+
+            bool {i.cpp_namespace_name}::emitPropertiesChanged(const std::map<Glib::ustring, Glib::VariantBase>& changedProps,
+                                                              const std::vector<Glib::ustring>& changedPropsNoValue) {{
+                // Properties may be set before the object is registered
+                if (!m_connection) {{
+                    return false;
+                }}
+
+                GVariantBuilder changedPropsBuilder;
+                g_variant_builder_init(&changedPropsBuilder, G_VARIANT_TYPE("a{{sv}}"));
+                for (std::map<Glib::ustring, Glib::VariantBase>::const_iterator it = changedProps.begin();
+                     it != changedProps.end(); ++it) {{
+                    g_variant_builder_add(&changedPropsBuilder, "{{sv}}", it->first.c_str(), const_cast<GVariant*>(it->second.gobj()));
+                }}
+
+                GVariantBuilder changedPropsNoValueBuilder;
+                g_variant_builder_init(&changedPropsNoValueBuilder, G_VARIANT_TYPE_STRING_ARRAY);
+                for (std::vector<Glib::ustring>::const_iterator it = changedPropsNoValue.begin();
+                     it != changedPropsNoValue.end(); ++it) {{
+                    g_variant_builder_add(&changedPropsNoValueBuilder, "s", it->c_str());
+                }}
+
+                GVariant *params[] = {{
+                    g_variant_new_string(m_interfaceName.c_str()),
+                    g_variant_builder_end(&changedPropsBuilder),
+                    g_variant_builder_end(&changedPropsNoValueBuilder)
+                }};
+
+                // Property changes are always broadcast, all proxies cache them
+                return sendSignal(NULL, "org.freedesktop.DBus.Properties", "PropertiesChanged", g_variant_new_tuple(params, 3));
+            }}
+
+            bool {i.cpp_namespace_name}::sendSignal(const gchar *destination, const gchar *interfaceName, const gchar *signalName, GVariant *parameters) {{
+                // Signals may be emitted before the object is registered
+                if (!m_connection) {{
+                    g_variant_unref(g_variant_ref_sink(parameters));
+                    return false;
+                }}
+
+                // The floating parameters are consumed
+                GError *error = NULL;
+                g_dbus_connection_emit_signal(m_connection->gobj(),
+                                              destination,
+                                              m_objectPath.c_str(),
+                                              interfaceName,
+                                              signalName,
+                                              parameters,
+                                              &error);
+                if (error) {{
+                    Glib::Error::throw_exception(error);
+                }}
 
                 return true;
             }}''').format(**locals()))
@@ -854,39 +3260,715 @@ class CodeGenerator:
         self.emit_h_common(dedent("""
         #pragma once
         #include <iostream>
+        #include <memory>
         #include "glibmm.h"
         #include "giomm.h"
         """))
 
+        for i in self.ifaces:
+            if i.unix_fds:
+                self.emit_h_common(dedent("""\
+                #include <unistd.h>
+                #include <giomm/unixfdlist.h>
+                """))
+                break
+
+        if self.coroutines:
+            self.emit_h_common(dedent("""\
+            #include <coroutine>
+            #include <functional>
+            #include <tuple>
+            #include <utility>
+            """))
+
+        for i in self.ifaces:
+            if i.cacheable or i.single_flight:
+                self.emit_h_common(dedent("""\
+                #include <list>
+                #include <map>
+                #include <mutex>
+                """))
+                break
+
+        for i in self.ifaces:
+            if i.single_flight:
+                self.emit_h_common("#include <atomic>")
+                self.emit_h_common("#include <chrono>")
+                self.emit_h_common("#include <condition_variable>")
+                break
+
+        for i in self.ifaces:
+            if i.shared_memory:
+                self.emit_h_common(dedent("""\
+                #include <cerrno>
+                #include <cstring>
+                #include <fcntl.h>
+                #include <sys/mman.h>
+                #include <sys/stat.h>
+                """))
+                break
+
+    def generate_common_unix_fd(self, i):
+        """ Generate the owning file descriptor wrapper used for 'h'
+            arguments, and the TypeWrap helpers moving them in and out of
+            the Gio::UnixFDList of a message
+        """
+        self.emit_h_common(dedent("""
+        class {i.cpp_class_name}UnixFD {{
+            public:
+                {i.cpp_class_name}UnixFD() {{}}
+
+                // Takes ownership of fd, which is closed with the last copy
+                explicit {i.cpp_class_name}UnixFD(int fd) {{
+                    if (fd >= 0) {{
+                        m_fd = std::shared_ptr<int>(new int(fd), closeFd);
+                    }}
+                }}
+
+                int get() const {{ return m_fd ? *m_fd : -1; }}
+                bool valid() const {{ return m_fd != NULL; }}
+
+            private:
+                static void closeFd(int *fd) {{
+                    ::close(*fd);
+                    delete fd;
+                }}
+
+                std::shared_ptr<int> m_fd;
+        }};
+        """).format(**locals()))
+
+    def generate_common_pending_call(self, i):
+        """ Generate the pending call returned by the _async() variants of
+            the proxy methods
+        """
+        self.emit_h_common(dedent("""
+        class {i.cpp_class_name}PendingCall {{
+            public:
+                // Replies are dispatched in the thread-default main context
+                // of the thread making the call
+                {i.cpp_class_name}PendingCall() :
+                    m_context(Glib::wrap(g_main_context_ref_thread_default(), false)) {{}}
+
+                bool ready() const {{ return bool(m_result); }}
+
+                // Runs the main context until the reply has arrived. The
+                // result is passed to the _finish() function of the method.
+                const Glib::RefPtr<Gio::AsyncResult> &wait() {{
+                    while (!m_result) {{
+                        m_context->iteration(true);
+                    }}
+
+                    return m_result;
+                }}
+
+                static void complete(const Glib::RefPtr<Gio::AsyncResult> &result,
+                                     std::shared_ptr<{i.cpp_class_name}PendingCall> pending) {{
+                    pending->m_result = result;
+                }}
+
+            private:
+                Glib::RefPtr<Glib::MainContext> m_context;
+                Glib::RefPtr<Gio::AsyncResult> m_result;
+        }};
+        """).format(**locals()))
+
+    def generate_common_reply_cache(self, i):
+        """ Generate the cache of the replies of cacheable proxy methods """
+        self.emit_h_common(dedent("""
+        // Replies of the cacheable methods of a proxy, keyed on the method and
+        // its arguments. Replies expire after the time to live of their
+        // method, and the least recently used one is dropped when the cache
+        // is full.
+        class {i.cpp_class_name}ReplyCache {{
+            public:
+                {i.cpp_class_name}ReplyCache() : m_maxSize(256) {{}}
+
+                static std::string key(const char *method, const Glib::VariantContainerBase &parameters) {{
+                    std::string key(method);
+                    key.push_back('\\0');
+                    // Calls of methods without in-arguments have no parameters
+                    if (parameters.gobj()) {{
+                        key.append(static_cast<const char*>(g_variant_get_data(parameters.gobj())),
+                                   g_variant_get_size(parameters.gobj()));
+                    }}
+                    return key;
+                }}
+
+                bool lookup(const std::string &key, Glib::VariantContainerBase &reply) {{
+                    std::lock_guard<std::mutex> lock(m_mutex);
+                    std::map<std::string, Entry>::iterator it = m_entries.find(key);
+                    if (it == m_entries.end()) {{
+                        return false;
+                    }}
+                    if (it->second.expires <= g_get_monotonic_time()) {{
+                        m_lru.erase(it->second.lru);
+                        m_entries.erase(it);
+                        return false;
+                    }}
+
+                    m_lru.splice(m_lru.begin(), m_lru, it->second.lru);
+                    reply = it->second.reply;
+                    return true;
+                }}
+
+                void insert(const std::string &key, const Glib::VariantContainerBase &reply, guint ttlMsec) {{
+                    std::lock_guard<std::mutex> lock(m_mutex);
+                    std::map<std::string, Entry>::iterator it = m_entries.find(key);
+                    if (it != m_entries.end()) {{
+                        m_lru.erase(it->second.lru);
+                        m_entries.erase(it);
+                    }}
+                    if (m_maxSize == 0) {{
+                        return;
+                    }}
+                    evict(m_maxSize - 1);
+
+                    m_lru.push_front(key);
+                    Entry &entry = m_entries[key];
+                    entry.reply = reply;
+                    entry.expires = g_get_monotonic_time() + gint64(ttlMsec) * 1000;
+                    entry.lru = m_lru.begin();
+                }}
+
+                void setMaxSize(gsize size) {{
+                    std::lock_guard<std::mutex> lock(m_mutex);
+                    m_maxSize = size;
+                    evict(size);
+                }}
+
+                void clear() {{
+                    std::lock_guard<std::mutex> lock(m_mutex);
+                    m_entries.clear();
+                    m_lru.clear();
+                }}
+
+            private:
+                struct Entry {{
+                    Glib::VariantContainerBase reply;
+                    gint64 expires;
+                    std::list<std::string>::iterator lru;
+                }};
+
+                void evict(gsize size) {{
+                    while (m_entries.size() > size) {{
+                        m_entries.erase(m_lru.back());
+                        m_lru.pop_back();
+                    }}
+                }}
+
+                std::map<std::string, Entry> m_entries;
+                // Most recently used first
+                std::list<std::string> m_lru;
+                gsize m_maxSize;
+                std::mutex m_mutex;
+        }};
+        """).format(**locals()))
+
+    def generate_common_single_flight(self, i):
+        """ Generate the bookkeeping of method calls shared by identical
+        calls, used by the stub for incoming calls and by the proxy for
+        its calls
+        """
+        self.emit_h_common(dedent("""
+        // Method calls with the same arguments in progress at the same time,
+        // which are all answered with the reply to the first one. Calls from
+        // all senders are shared, so the reply must not depend on the caller.
+        class {i.cpp_class_name}SingleFlight {{
+            public:
+                static std::string key(const char *method, const Glib::VariantContainerBase &parameters) {{
+                    std::string key(method);
+                    key.push_back('\\0');
+                    // Calls of methods without in-arguments have no parameters
+                    if (parameters.gobj()) {{
+                        key.append(static_cast<const char*>(g_variant_get_data(parameters.gobj())),
+                                   g_variant_get_size(parameters.gobj()));
+                    }}
+                    return key;
+                }}
+
+                // Handling of the first invocation with a key, shared by the
+                // copies of its MessageHelper. If the last copy is dropped
+                // before a reply is sent through it, because the handler
+                // threw, replied on the invocation directly or never replied,
+                // the waiting invocations are answered with an error.
+                class Flight {{
+                    public:
+                        Flight({i.cpp_class_name}SingleFlight *flights, const std::string &key) :
+                            m_flights(flights), m_key(key), m_answered(false) {{}}
+
+                        ~Flight() {{
+                            std::vector<Glib::RefPtr<Gio::DBus::MethodInvocation> > waiting = answer();
+                            for (size_t n = 0; n < waiting.size(); n++) {{
+                                waiting[n]->return_dbus_error("org.freedesktop.DBus.Error.NoReply",
+                                                              "The identical call in progress was not replied to");
+                            }}
+                        }}
+
+                        // Returns the invocations waiting for the reply, the first
+                        // time only. Later ones with the key are handled again.
+                        std::vector<Glib::RefPtr<Gio::DBus::MethodInvocation> > answer() {{
+                            if (m_answered.exchange(true)) {{
+                                return std::vector<Glib::RefPtr<Gio::DBus::MethodInvocation> >();
+                            }}
+                            return m_flights->leave(m_key);
+                        }}
+
+                    private:
+                        {i.cpp_class_name}SingleFlight *m_flights;
+                        std::string m_key;
+                        std::atomic<bool> m_answered;
+                }};
+
+                // Returns the flight of the invocation if it is the first one
+                // with the key, which is handled. The others wait for its
+                // reply, and get an empty pointer.
+                std::shared_ptr<Flight> join(const std::string &key, const Glib::RefPtr<Gio::DBus::MethodInvocation> &invocation) {{
+                    std::lock_guard<std::mutex> lock(m_mutex);
+                    std::map<std::string, Invocations>::iterator it = m_invocations.find(key);
+                    if (it == m_invocations.end()) {{
+                        m_invocations[key];
+                        return std::make_shared<Flight>(this, key);
+                    }}
+
+                    it->second.push_back(invocation);
+                    return std::shared_ptr<Flight>();
+                }}
+
+                // Call made by the proxy, which other calls can wait for
+                class Call {{
+                    public:
+                        Call() : m_done(false) {{}}
+
+                        // Throws the error of the call, or a timeout error if it is
+                        // not completed within timeoutMsec. -1 is the default
+                        // timeout of GDBus, G_MAXINT waits without a limit.
+                        Glib::VariantContainerBase wait(int timeoutMsec) {{
+                            if (timeoutMsec < 0) {{
+                                timeoutMsec = 25000;
+                            }}
+                            std::unique_lock<std::mutex> lock(m_mutex);
+                            if (timeoutMsec == G_MAXINT) {{
+                                while (!m_done) {{
+                                    m_cond.wait(lock);
+                                }}
+                            }} else if (!m_cond.wait_for(lock, std::chrono::milliseconds(timeoutMsec), [this]() {{ return m_done; }})) {{
+                                throw Gio::DBus::Error(Gio::DBus::Error::TIMED_OUT,
+                                                       "Timed out waiting for the identical call in progress");
+                            }}
+                            if (m_error) {{
+                                throw *m_error;
+                            }}
+                            return m_reply;
+                        }}
+
+                        // Completes the task of an asynchronous call with the
+                        // reply or error of the call, and drops it
+                        void wait(GTask *task) {{
+                            {{
+                                std::lock_guard<std::mutex> lock(m_mutex);
+                                if (!m_done) {{
+                                    m_tasks.push_back(task);
+                                    return;
+                                }}
+                            }}
+                            returnTask(task);
+                        }}
+
+                        void complete(const Glib::VariantContainerBase &reply, const Glib::Error *error) {{
+                            std::vector<GTask*> tasks;
+                            {{
+                                std::lock_guard<std::mutex> lock(m_mutex);
+                                m_reply = reply;
+                                if (error) {{
+                                    m_error.reset(new Glib::Error(*error));
+                                }}
+                                m_done = true;
+                                m_cond.notify_all();
+                                tasks.swap(m_tasks);
+                            }}
+                            for (size_t n = 0; n < tasks.size(); n++) {{
+                                returnTask(tasks[n]);
+                            }}
+                        }}
+
+                    private:
+                        // The reply and error do not change once done
+                        void returnTask(GTask *task) {{
+                            if (m_error) {{
+                                g_task_return_error(task, g_error_copy(m_error->gobj()));
+                            }} else {{
+                                g_task_return_pointer(task, g_variant_ref(m_reply.gobj()), (GDestroyNotify) g_variant_unref);
+                            }}
+                            g_object_unref(task);
+                        }}
+
+                        Glib::VariantContainerBase m_reply;
+                        std::shared_ptr<Glib::Error> m_error;
+                        bool m_done;
+                        std::vector<GTask*> m_tasks;
+                        std::mutex m_mutex;
+                        std::condition_variable m_cond;
+                }};
+
+                // Returns true if the caller makes the call, and completes
+                // it with leaveCall(). Otherwise, call is the call to wait
+                // for.
+                bool joinCall(const std::string &key, std::shared_ptr<Call> &call) {{
+                    std::lock_guard<std::mutex> lock(m_mutex);
+                    std::map<std::string, std::shared_ptr<Call> >::iterator it = m_calls.find(key);
+                    if (it != m_calls.end()) {{
+                        call = it->second;
+                        return false;
+                    }}
+
+                    call.reset(new Call());
+                    m_calls[key] = call;
+                    return true;
+                }}
+
+                void leaveCall(const std::string &key, const Glib::VariantContainerBase &reply, const Glib::Error *error) {{
+                    std::shared_ptr<Call> call;
+                    {{
+                        std::lock_guard<std::mutex> lock(m_mutex);
+                        std::map<std::string, std::shared_ptr<Call> >::iterator it = m_calls.find(key);
+                        if (it == m_calls.end()) {{
+                            return;
+                        }}
+                        call = it->second;
+                        m_calls.erase(it);
+                    }}
+                    call->complete(reply, error);
+                }}
+
+            private:
+                typedef std::vector<Glib::RefPtr<Gio::DBus::MethodInvocation> > Invocations;
+
+                Invocations leave(const std::string &key) {{
+                    std::lock_guard<std::mutex> lock(m_mutex);
+                    Invocations invocations;
+                    std::map<std::string, Invocations>::iterator it = m_invocations.find(key);
+                    if (it != m_invocations.end()) {{
+                        invocations.swap(it->second);
+                        m_invocations.erase(it);
+                    }}
+                    return invocations;
+                }}
+
+                std::map<std::string, Invocations> m_invocations;
+                std::map<std::string, std::shared_ptr<Call> > m_calls;
+                std::mutex m_mutex;
+        }};
+        """).format(**locals()))
+
+    def generate_common_awaitable(self, i):
+        """ Generate the awaitable returned by the coroutine variants of the
+            proxy methods
+        """
+        fd_param = ""
+        fd_init = ""
+        fd_call = ""
+        fd_member = ""
+        if i.unix_fds:
+            fd_param = "\n                const Glib::RefPtr<Gio::UnixFDList> &fdList,"
+            fd_init = " m_fdList(fdList),"
+            fd_call = ("\n            if (m_fdList) {"
+                       "\n                m_proxy->call(m_method, m_parameters, slot, Glib::RefPtr<Gio::Cancellable>(), m_fdList, m_timeoutMsec, m_flags);"
+                       "\n                return;"
+                       "\n            }")
+            fd_member = "\n        Glib::RefPtr<Gio::UnixFDList> m_fdList;"
+
+        self.emit_h_common(dedent("""
+        template<typename R>
+        class [[nodiscard]] {i.cpp_class_name}Awaitable {{
+            public:
+                typedef R (*Finish)(const Glib::RefPtr<Gio::DBus::Proxy> &proxy,
+                                    const Glib::RefPtr<Gio::AsyncResult> &result);
+
+                {i.cpp_class_name}Awaitable(const Glib::RefPtr<Gio::DBus::Proxy> &proxy,
+                        const char *method,
+                        const Glib::VariantContainerBase &parameters,{fd_param}
+                        Finish finish,
+                        int timeoutMsec,
+                        Gio::DBus::CallFlags flags) :
+                    m_proxy(proxy), m_method(method), m_parameters(parameters),{fd_init}
+                    m_finish(finish), m_timeoutMsec(timeoutMsec), m_flags(flags) {{}}
+
+                // Started by calling start with the slot for the reply
+                {i.cpp_class_name}Awaitable(const Glib::RefPtr<Gio::DBus::Proxy> &proxy,
+                        const std::function<void(const Gio::SlotAsyncReady &)> &start,
+                        Finish finish) :
+                    m_proxy(proxy), m_method(NULL), m_start(start),
+                    m_finish(finish), m_timeoutMsec(-1), m_flags(Gio::DBus::CALL_FLAGS_NONE) {{}}
+
+                bool await_ready() const noexcept {{ return false; }}
+
+                // The call is started when the coroutine is suspended. The
+                // awaitable stays in the coroutine frame until the reply
+                // resumes the coroutine from the main context.
+                void await_suspend(std::coroutine_handle<> handle) {{
+                    m_handle = handle;
+                    Gio::SlotAsyncReady slot = sigc::mem_fun(*this, &{i.cpp_class_name}Awaitable::onReply);
+                    if (m_start) {{
+                        m_start(slot);
+                        return;
+                    }}{fd_call}
+                    m_proxy->call(m_method, slot, m_parameters, m_timeoutMsec, m_flags);
+                }}
+
+                // Throws the error of the call, if any
+                R await_resume() {{
+                    return m_finish(m_proxy, m_result);
+                }}
+
+            private:
+                void onReply(const Glib::RefPtr<Gio::AsyncResult> &result) {{
+                    m_result = result;
+                    m_handle.resume();
+                }}
+
+                Glib::RefPtr<Gio::DBus::Proxy> m_proxy;
+                const char *m_method;
+                Glib::VariantContainerBase m_parameters;{fd_member}
+                std::function<void(const Gio::SlotAsyncReady &)> m_start;
+                Finish m_finish;
+                int m_timeoutMsec;
+                Gio::DBus::CallFlags m_flags;
+                std::coroutine_handle<> m_handle;
+                Glib::RefPtr<Gio::AsyncResult> m_result;
+        }};
+        """).format(**locals()))
+
     def generate_common_classes(self, i):
+        if i.unix_fds:
+            self.generate_common_unix_fd(i)
+        self.generate_common_pending_call(i)
+        if i.cacheable:
+            self.generate_common_reply_cache(i)
+        if i.single_flight:
+            self.generate_common_single_flight(i)
+        if self.coroutines:
+            self.generate_common_awaitable(i)
+
         self.emit_h_common(dedent("""
         class {i.cpp_class_name}TypeWrap {{
             public:
-                template<typename T>
-                static void unwrapList(std::vector<T> &list, const Glib::VariantContainerBase &wrapped) {{
-                    for (uint i = 0; i < wrapped.get_n_children (); i++) {{
-                        Glib::Variant<T> item;
-                        wrapped.get_child(item, i);
-                        list.push_back(item.get());
-                    }}
+                static GVariant *newByteString(const std::string &value) {{
+                    // Include the terminating nul, like g_variant_new_bytestring()
+                    return g_variant_new_fixed_array(G_VARIANT_TYPE_BYTE, value.c_str(), value.size() + 1, 1);
                 }}
 
-                static std::vector<Glib::ustring> stdStringVecToGlibStringVec(const std::vector<std::string> &strv) {{
-                    std::vector<Glib::ustring> newStrv;
-                    for (uint i = 0; i < strv.size(); i++) {{
-                        newStrv.push_back(strv[i]);
+                static std::string getByteString(GVariant *value) {{
+                    gsize size = 0;
+                    const gchar *data = static_cast<const gchar*>(g_variant_get_fixed_array(value, &size, 1));
+                    if (size > 0 && data[size - 1] == '\\0') {{
+                        size--;
                     }}
 
-                    return newStrv;
+                    return size > 0 ? std::string(data, size) : std::string();
+                }}
+
+                template<typename S>
+                static GVariant *newStringArray(const std::vector<S> &strv) {{
+                    std::vector<const gchar*> ptrs = stringPointers(strv);
+                    return g_variant_new_strv(ptrs.data(), ptrs.size());
+                }}
+
+                template<typename S>
+                static std::vector<S> getStringArray(GVariant *value) {{
+                    gsize length = 0;
+                    return takeStringArray<S>(g_variant_get_strv(value, &length), length);
+                }}
+
+                template<typename S>
+                static GVariant *newObjectPathArray(const std::vector<S> &strv) {{
+                    std::vector<const gchar*> ptrs = stringPointers(strv);
+                    return g_variant_new_objv(ptrs.data(), ptrs.size());
+                }}
+
+                template<typename S>
+                static std::vector<S> getObjectPathArray(GVariant *value) {{
+                    gsize length = 0;
+                    return takeStringArray<S>(g_variant_get_objv(value, &length), length);
+                }}
+
+                static GVariant *newByteStringArray(const std::vector<std::string> &strv) {{
+                    std::vector<const gchar*> ptrs = stringPointers(strv);
+                    return g_variant_new_bytestring_array(ptrs.data(), ptrs.size());
+                }}
+
+                static std::vector<std::string> getByteStringArray(GVariant *value) {{
+                    gsize length = 0;
+                    return takeStringArray<std::string>(g_variant_get_bytestring_array(value, &length), length);
                 }}
 
-                static std::vector<std::string> glibStringVecToStdStringVec(const std::vector<Glib::ustring> &strv) {{
-                    std::vector<std::string> newStrv;
+                template<typename T>
+                static GVariant *newFixedArray(const std::vector<T> &array, const GVariantType *elementType) {{
+                    return g_variant_new_fixed_array(elementType, array.data(), array.size(), sizeof(T));
+                }}
+
+                template<typename T>
+                static std::vector<T> getFixedArray(GVariant *value) {{
+                    gsize length = 0;
+                    const T *data = static_cast<const T*>(g_variant_get_fixed_array(value, &length, sizeof(T)));
+                    return std::vector<T>(data, data + length);
+                }}
+
+                // Read-only view of an array of fixed-size elements. The
+                // elements are not copied, the view holds a reference to the
+                // variant owning them instead.
+                template<typename T>
+                class FixedArrayView {{
+                    public:
+                        FixedArrayView() : m_data(NULL), m_size(0) {{}}
+
+                        explicit FixedArrayView(const Glib::VariantBase &value) :
+                            m_value(value), m_data(NULL), m_size(0) {{
+                            if (m_value.gobj()) {{
+                                m_data = static_cast<const T*>(g_variant_get_fixed_array(m_value.gobj(), &m_size, sizeof(T)));
+                            }}
+                        }}
+
+                        const T *data() const {{ return m_data; }}
+                        gsize size() const {{ return m_size; }}
+                        bool empty() const {{ return m_size == 0; }}
+                        const T *begin() const {{ return m_data; }}
+                        const T *end() const {{ return m_data + m_size; }}
+                        const T &operator[](gsize i) const {{ return m_data[i]; }}
+
+                        std::vector<T> toVector() const {{
+                            return std::vector<T>(begin(), end());
+                        }}
+
+                    private:
+                        Glib::VariantBase m_value;
+                        const T *m_data;
+                        gsize m_size;
+                }};""").format(**locals()))
+
+        if i.unix_fds:
+            self.emit_h_common(indent(dedent("""
+                    // The file descriptor is duplicated into the list
+                    static GVariant *newUnixFD(const {i.cpp_class_name}UnixFD &fd, const Glib::RefPtr<Gio::UnixFDList> &fdList) {{
+                        gint32 index = -1;
+                        if (fd.valid()) {{
+                            index = fdList->append(fd.get());
+                        }}
+
+                        return g_variant_new_handle(index);
+                    }}
+
+                    static {i.cpp_class_name}UnixFD getUnixFD(GVariant *value, const Glib::RefPtr<Gio::UnixFDList> &fdList) {{
+                        gint32 index = g_variant_get_handle(value);
+                        if (!fdList || index < 0 || index >= fdList->get_length()) {{
+                            return {i.cpp_class_name}UnixFD();
+                        }}
+
+                        return {i.cpp_class_name}UnixFD(fdList->get(index));
+                    }}""").format(**locals()), 8))
+
+        if i.shared_memory:
+            self.emit_h_common(indent(dedent("""
+                    // Byte strings of at least threshold bytes are written to
+                    // a sealed memfd, which is sent in the fdList. The argument
+                    // is a variant holding either the bytes, or the index of
+                    // the memfd as a handle.
+                    static GVariant *newSharedByteString(const std::string &value, const Glib::RefPtr<Gio::UnixFDList> &fdList, gsize threshold) {{
+                        if (value.size() < threshold) {{
+                            return g_variant_new_variant(newByteString(value));
+                        }}
+
+                        int fd = memfd_create("gdbus-codegen-glibmm", MFD_CLOEXEC | MFD_ALLOW_SEALING);
+                        if (fd < 0) {{
+                            return g_variant_new_variant(newByteString(value));
+                        }}
+
+                        const char *data = value.data();
+                        gsize remaining = value.size();
+                        while (remaining > 0) {{
+                            ssize_t written = ::write(fd, data, remaining);
+                            if (written < 0 && errno == EINTR) {{
+                                continue;
+                            }}
+                            if (written <= 0) {{
+                                ::close(fd);
+                                return g_variant_new_variant(newByteString(value));
+                            }}
+                            data += written;
+                            remaining -= written;
+                        }}
+
+                        if (fcntl(fd, F_ADD_SEALS, F_SEAL_SHRINK | F_SEAL_GROW | F_SEAL_WRITE | F_SEAL_SEAL) < 0) {{
+                            ::close(fd);
+                            return g_variant_new_variant(newByteString(value));
+                        }}
+
+                        // The file descriptor is duplicated into the list
+                        gint32 index = fdList->append(fd);
+                        ::close(fd);
+                        return g_variant_new_variant(g_variant_new_handle(index));
+                    }}
+
+                    // The sender can not modify the sealed memfd, so it is
+                    // mapped read-only. The string is a copy of its contents.
+                    static std::string getSharedByteString(GVariant *value, const Glib::RefPtr<Gio::UnixFDList> &fdList) {{
+                        GVariant *contents = g_variant_get_variant(value);
+                        std::string result;
+                        if (g_variant_is_of_type(contents, G_VARIANT_TYPE_BYTESTRING)) {{
+                            result = getByteString(contents);
+                        }} else if (g_variant_is_of_type(contents, G_VARIANT_TYPE_HANDLE)) {{
+                            result = mapSharedMemory(g_variant_get_handle(contents), fdList);
+                        }} else {{
+                            g_warning("Ignoring shared memory argument of type %s", g_variant_get_type_string(contents));
+                        }}
+
+                        g_variant_unref(contents);
+                        return result;
+                    }}
+
+                    static std::string mapSharedMemory(gint32 index, const Glib::RefPtr<Gio::UnixFDList> &fdList) {{
+                        if (!fdList || index < 0 || index >= fdList->get_length()) {{
+                            return std::string();
+                        }}
+
+                        std::string result;
+                        int fd = fdList->get(index);
+                        const int required = F_SEAL_SHRINK | F_SEAL_WRITE;
+                        int seals = fcntl(fd, F_GET_SEALS);
+                        struct stat st;
+                        if (seals < 0 || (seals & required) != required || fstat(fd, &st) < 0) {{
+                            g_warning("Ignoring shared memory which is not sealed");
+                        }} else if (st.st_size > 0) {{
+                            void *data = mmap(NULL, st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+                            if (data != MAP_FAILED) {{
+                                result.assign(static_cast<const char*>(data), st.st_size);
+                                munmap(data, st.st_size);
+                            }}
+                        }}
+
+                        ::close(fd);
+                        return result;
+                    }}""").format(**locals()), 8))
+
+        self.emit_h_common(dedent("""
+            private:
+                template<typename S>
+                static std::vector<const gchar*> stringPointers(const std::vector<S> &strv) {{
+                    std::vector<const gchar*> ptrs;
+                    ptrs.reserve(strv.size());
                     for (uint i = 0; i < strv.size(); i++) {{
-                        newStrv.push_back(strv[i]);
+                        ptrs.push_back(strv[i].c_str());
                     }}
 
-                    return newStrv;
+                    return ptrs;
+                }}
+
+                // The strings are owned by the variant, only the array is freed
+                template<typename S>
+                static std::vector<S> takeStringArray(const gchar **strv, gsize length) {{
+                    std::vector<S> result(strv, strv + length);
+                    g_free(strv);
+                    return result;
                 }}
         }};
 
@@ -894,70 +3976,144 @@ class CodeGenerator:
         public:
             {i.cpp_class_name}MessageHelper (const Glib::RefPtr<Gio::DBus::MethodInvocation> msg) :
                 m_message(msg) {{}}
+        """).format(**locals()))
 
+        if i.single_flight:
+            self.emit_h_common(indent(dedent("""
+                // Also answers the invocations waiting for the reply to msg
+                {i.cpp_class_name}MessageHelper (const Glib::RefPtr<Gio::DBus::MethodInvocation> msg,
+                                   const std::shared_ptr<{i.cpp_class_name}SingleFlight::Flight> &flight) :
+                    m_message(msg), m_flight(flight) {{}}
+            """).format(**locals()), 4))
+            reply_error = dedent("""
+                std::vector<Glib::RefPtr<Gio::DBus::MethodInvocation> > waiting = followers();
+                for (size_t n = 0; n < waiting.size(); n++) {{
+                    waiting[n]->return_error({args});
+                }}""")
+            error_followers = reply_error.format(args="error").replace("\n", "\n    ")
+            domain_followers = reply_error.format(args="domain, code, message").replace("\n", "\n    ")
+        else:
+            error_followers = ""
+            domain_followers = ""
+
+        self.emit_h_common(indent(dedent("""\
             const Glib::RefPtr<Gio::DBus::MethodInvocation> getMessage() {{
                 return m_message;
             }}
 
+            // The replies are sent on the connection directly, so they may
+            // be sent from any thread
             void ret(Glib::Error error) {{
-                m_message->return_error(error);
+                m_message->return_error(error);{error_followers}
             }}
 
             void returnError(const Glib::ustring &domain, int code, const Glib::ustring &message) {{
-                m_message->return_error(domain, code, message);
+                m_message->return_error(domain, code, message);{domain_followers}
             }}
-        """).format(**locals()))
+        """).format(**locals()), 4))
 
         args = {}
+        shared_memory = {}
         for m in i.methods:
+            if m.no_reply:
+                continue
             argstring = ""
             argvals = []
             for a in m.out_args:
                 argstring += a.cpptype_out
                 argvals.append(a)
+            thresholds = [a.shared_memory for a in argvals]
+            if argstring in args and shared_memory[argstring] != thresholds:
+                # The overload is shared by all methods with these types, so
+                # shared memory is only used if they all agree on it. It is
+                # always safe to send inline.
+                print "WARNING: ret() of method %s is shared with methods not using the same shared memory arguments, passing them inline" % m.name
+                thresholds = [t if t == o else None for (t, o) in zip(thresholds, shared_memory[argstring])]
             args[argstring] = argvals
+            shared_memory[argstring] = thresholds
 
 
-        for a in args:
-            a = args[a]
+        for argstring in args:
+            a = args[argstring]
+            thresholds = shared_memory[argstring]
             params = []
             for index in range(len(a)):
-                params.append(a[index].cpptype_out + " p%s" % index)
+                params.append(a[index].cpptype_in + " p%s" % index)
             self.emit_h_common("void ret(" + ', '.join(params) +")")
             self.emit_h_common("{")
-            self.emit_h_common("    std::vector<Glib::VariantBase> vlist;")
+            unix_fds = False
+            for index in range(len(a)):
+                if a[index].signature == 'h' or thresholds[index] != None:
+                    unix_fds = True
+            if unix_fds:
+                self.emit_h_common("    Glib::RefPtr<Gio::UnixFDList> fdList = Gio::UnixFDList::create();")
 
+            values = []
             for index in range(len(a)):
-                cpptype_to_dbus = a[index].cpptype_to_dbus
-                # Prepend the class name if this is the generic "TypeWrap" class
-                if cpptype_to_dbus.startswith("TypeWrap"):
-                    cpptype_to_dbus = i.cpp_class_name + cpptype_to_dbus
                 if a[index].signature == "v":
-                    self.emit_h_common("    vlist.push_back(p{index});".format(**locals()))
+                    values.append("const_cast<GVariant*>(p%d.gobj())" % index)
+                elif a[index].shared_memory != thresholds[index]:
+                    values.append("%sTypeWrap::newByteString(p%d)" % (i.cpp_class_name, index))
                 else:
-                    self.emit_h_common("    vlist.push_back(Glib::Variant<"+a[index].cpptype_get+" >::create(" + cpptype_to_dbus + "(p{index})));".format(**locals()))
+                    values.append(a[index].gvariant_new("p%d" % index, i.cpp_class_name))
+
+            if len(values) > 0:
+                for line in self.tuple_lines("values", values):
+                    self.emit_h_common("    " + line)
+                tuple_new = "g_variant_new_tuple(values, %d)" % len(values)
+            else:
+                tuple_new = "g_variant_new_tuple(NULL, 0)"
+            self.emit_h_common("    Glib::VariantContainerBase tuple(g_variant_ref_sink(%s), false);" % tuple_new)
+
+            self.emit_h_common("")
+            if unix_fds:
+                self.emit_h_common("    m_message->return_value(tuple, fdList);")
+            elif i.single_flight:
+                self.emit_h_common("    returnValue(tuple);")
+            else:
+                self.emit_h_common("    m_message->return_value(tuple);")
+            self.emit_h_common("}")
+            self.emit_h_common("")
+
+        self.emit_h_common("")
+        self.emit_h_common("private:")
+        if i.single_flight:
+            self.emit_h_common(indent(dedent("""\
+                std::vector<Glib::RefPtr<Gio::DBus::MethodInvocation> > followers() {{
+                    if (!m_flight) {{
+                        return std::vector<Glib::RefPtr<Gio::DBus::MethodInvocation> >();
+                    }}
+                    return m_flight->answer();
+                }}
 
-            self.emit_h_common(dedent("""
-                m_message->return_value(Glib::Variant<Glib::VariantBase>::create_tuple(vlist));
-            }
-            """))
+                void returnValue(const Glib::VariantContainerBase &tuple) {{
+                    m_message->return_value(tuple);
+                    std::vector<Glib::RefPtr<Gio::DBus::MethodInvocation> > waiting = followers();
+                    for (size_t n = 0; n < waiting.size(); n++) {{
+                        waiting[n]->return_value(tuple);
+                    }}
+                }}
 
-        self.emit_h_common(dedent("""
-        private:
-            Glib::RefPtr<Gio::DBus::MethodInvocation> m_message;
-        };
-        """))
+                Glib::RefPtr<Gio::DBus::MethodInvocation> m_message;
+                std::shared_ptr<{i.cpp_class_name}SingleFlight::Flight> m_flight;""").format(**locals()), 4))
+        else:
+            self.emit_h_common("    Glib::RefPtr<Gio::DBus::MethodInvocation> m_message;")
+        self.emit_h_common("};")
+        self.emit_h_common("")
 
 
     def generate(self):
         # Proxy
         self.generate_intro_proxy()
+        self.generate_proxy_introspection()
         self.declare_types_proxy()
         for i in self.ifaces:
             self.generate_method_calls_proxy(i)
             self.generate_property_handlers_proxy(i)
             self.generate_signal_handler_proxy(i)
+            self.generate_signal_subscriptions_proxy(i)
             self.generate_proxy_creation(i)
+            self.define_object_manager_client_proxy(i)
 
         # Stub
         self.generate_stub_introspection()
@@ -969,9 +4125,12 @@ class CodeGenerator:
             self.define_types_property_get_handlers_stub(i)
             self.define_types_property_set_handlers_stub(i)
             self.define_types_signal_emitters_stub(i)
+            self.define_types_coalesced_signals_stub(i)
             self.define_types_dbus_callbacks_stub(i)
             self.define_types_property_setters_stub(i)
             self.define_types_emit_stub(i)
+            self.define_types_subtree_stub(i)
+            self.define_types_object_manager_stub(i)
 
         # Common
         self.generate_common_intro()
@@ -59,6 +59,11 @@ def codegen_main():
                             help='String to strip from D-Bus interface names for code and docs')
     arg_parser.add_option('', '--cpp-namespace', metavar='NAMESPACE', default='',
                             help='The namespace to use for generated C++ code')
+    arg_parser.add_option('', '--cpp-string-type', metavar='TYPE', default='std::string',
+                          type='choice', choices=['std::string', 'Glib::ustring'],
+                          help='The C++ type used for D-Bus strings, object paths and signatures (std::string or Glib::ustring)')
+    arg_parser.add_option('', '--cpp-coroutines', action='store_true', default=False,
+                          help='Also generate C++20 awaitable proxy methods')
     arg_parser.add_option('', '--generate-cpp-code', metavar='OUTFILES',
                           help='Generate C++ code in OUTFILES.[cpp|h]')
     (opts, args) = arg_parser.parse_args()
@@ -82,7 +87,7 @@ def codegen_main():
     interface_prefix_list = opts.interface_prefix.split(",")
 
     for i in all_ifaces:
-        i.post_process(interface_prefix_list, opts.cpp_namespace)
+        i.post_process(interface_prefix_list, opts.cpp_namespace, opts.cpp_string_type)
 
     cpp_code = opts.generate_cpp_code
 
@@ -99,7 +104,8 @@ def codegen_main():
                                     node_xmls,
                                     proxy_h, proxy_cpp,
                                     stub_cpp, stub_h,
-                                    common_cpp, common_h);
+                                    common_cpp, common_h,
+                                    opts.cpp_coroutines);
         ret = gen.generate()
         proxy_h.close()
         proxy_cpp.close()
@@ -23,52 +23,106 @@
 from . import utils
 
 class TypeWrap:
+    # Arrays of fixed-size basic types, copied with a single memcpy. Booleans
+    # are left out as a gboolean is not the same size as a bool and bytes are
+    # mapped to std::string.
+    fixedArrayTypes = {
+        'an': ('gint16', 'G_VARIANT_TYPE_INT16'),
+        'aq': ('guint16', 'G_VARIANT_TYPE_UINT16'),
+        'ai': ('gint32', 'G_VARIANT_TYPE_INT32'),
+        'au': ('guint32', 'G_VARIANT_TYPE_UINT32'),
+        'ax': ('gint64', 'G_VARIANT_TYPE_INT64'),
+        'at': ('guint64', 'G_VARIANT_TYPE_UINT64'),
+        'ad': ('double', 'G_VARIANT_TYPE_DOUBLE'),
+    }
+
     @staticmethod
-    def cppSignatureForDbusSignature(sig):
+    def cppSignatureForDbusSignature(sig, string_type='std::string', unix_fd_type=None, shared_memory=None):
         """
         The returned tuple has the following values, in order:
-            - Type for "in"-parameter to generated function
+            - Type for "in"-parameter to generated function. Types which are
+              expensive to copy are passed by const reference
             - Type for "out" parameter to generated function
-            - Type for use with D-Bus function
-            - function for casting D-Bus type to out-type
-            - function for casting out-type to D-Bus type
+            - Expression creating a floating GVariant from {value}
+            - Expression converting the GVariant pointer {variant} to the
+              "out" type
+
+        The expressions read and write GVariant data directly, so no
+        intermediate glibmm containers are created. {cpp_class_name} is
+        replaced by the class name of the interface, for the helpers in the
+        generated TypeWrap class.
+
+        File descriptors are only mapped to unix_fd_type where the message
+        carries a Gio::UnixFDList, the expressions then expect it in a
+        variable named fdList. Elsewhere the handle index is exposed as is.
+        Byte arrays of at least shared_memory bytes are passed in a sealed
+        memfd in that list as well, if given.
         """
+        string_in = 'const ' + string_type + ' &'
+        string_vec = 'std::vector<' + string_type + '>'
+        string_get = string_type + '(g_variant_get_string({variant}, NULL))'
         if sig == 'b':
-            return ('bool', 'bool', 'bool', "", "")
+            return ('bool', 'bool', 'g_variant_new_boolean({value})', '(g_variant_get_boolean({variant}) != FALSE)')
         elif sig == 'y':
-            return ('guchar', 'guchar', 'guchar', "", "")
+            return ('guchar', 'guchar', 'g_variant_new_byte({value})', 'g_variant_get_byte({variant})')
         elif sig == 'n':
-            return ('gint16', 'gint16', 'gint16', "", "")
+            return ('gint16', 'gint16', 'g_variant_new_int16({value})', 'g_variant_get_int16({variant})')
         elif sig == 'q':
-            return ('guint16', 'guint16', 'guint16', "", "")
+            return ('guint16', 'guint16', 'g_variant_new_uint16({value})', 'g_variant_get_uint16({variant})')
         elif sig == 'i':
-            return ('gint32', 'gint32', 'gint32', "", "")
+            return ('gint32', 'gint32', 'g_variant_new_int32({value})', 'g_variant_get_int32({variant})')
         elif sig == 'u':
-            return ('guint32', 'guint32', 'guint32', "", "")
+            return ('guint32', 'guint32', 'g_variant_new_uint32({value})', 'g_variant_get_uint32({variant})')
         elif sig == 'x':
-            return ('gint64', 'gint64', 'gint64', "", "")
+            return ('gint64', 'gint64', 'g_variant_new_int64({value})', 'g_variant_get_int64({variant})')
         elif sig == 't':
-            return ('guint64', 'guint64', 'guint64', "", "")
+            return ('guint64', 'guint64', 'g_variant_new_uint64({value})', 'g_variant_get_uint64({variant})')
         elif sig == 'd':
-            return ('double', 'double', 'double', "", "")
+            return ('double', 'double', 'g_variant_new_double({value})', 'g_variant_get_double({variant})')
         elif sig == 's':
-            return ('std::string', 'std::string', 'Glib::ustring', "Glib::ustring", "")
+            return (string_in, string_type, 'g_variant_new_string({value}.c_str())', string_get)
         elif sig == 'o':
-            return ('std::string', 'std::string', 'Glib::ustring', "", "")
+            return (string_in, string_type, 'g_variant_new_object_path({value}.c_str())', string_get)
         elif sig == 'g':
-            return ('std::string', 'std::string', 'Glib::ustring', "", "")
+            return (string_in, string_type, 'g_variant_new_signature({value}.c_str())', string_get)
         elif sig == 'ay':
-            return ('std::string', 'std::string', 'std::string', "", "")
+            # Byte arrays are binary data, never UTF-8 strings
+            if shared_memory != None:
+                return ('const std::string &', 'std::string',
+                        '{cpp_class_name}TypeWrap::newSharedByteString({value}, fdList, ' + str(shared_memory) + ')',
+                        '{cpp_class_name}TypeWrap::getSharedByteString({variant}, fdList)')
+            return ('const std::string &', 'std::string',
+                    '{cpp_class_name}TypeWrap::newByteString({value})',
+                    '{cpp_class_name}TypeWrap::getByteString({variant})')
         elif sig == 'as':
-            return ('std::vector<std::string> ', 'std::vector<std::string>', 'std::vector<Glib::ustring>', "TypeWrap::glibStringVecToStdStringVec", "TypeWrap::stdStringVecToGlibStringVec")
+            return ('const ' + string_vec + ' &', string_vec,
+                    '{cpp_class_name}TypeWrap::newStringArray({value})',
+                    '{cpp_class_name}TypeWrap::getStringArray<' + string_type + '>({variant})')
         elif sig == 'ao':
-            return ('std::vector<std::string> ', 'std::vector<std::string>', 'std::vector<std::string>', "", "")
+            return ('const ' + string_vec + ' &', string_vec,
+                    '{cpp_class_name}TypeWrap::newObjectPathArray({value})',
+                    '{cpp_class_name}TypeWrap::getObjectPathArray<' + string_type + '>({variant})')
         elif sig == 'aay':
-            return ('std::vector<std::string> ', 'std::vector<std::string>', 'std::vector<std::string>', "", "")
+            return ('const std::vector<std::string> &', 'std::vector<std::string>',
+                    '{cpp_class_name}TypeWrap::newByteStringArray({value})',
+                    '{cpp_class_name}TypeWrap::getByteStringArray({variant})')
+        elif sig in TypeWrap.fixedArrayTypes:
+            (element, element_type) = TypeWrap.fixedArrayTypes[sig]
+            return ('const std::vector<' + element + '> &', 'std::vector<' + element + '>',
+                    '{cpp_class_name}TypeWrap::newFixedArray({value}, ' + element_type + ')',
+                    '{cpp_class_name}TypeWrap::getFixedArray<' + element + '>({variant})')
+        elif sig == 'h':
+            if unix_fd_type:
+                return ('const ' + unix_fd_type + ' &', unix_fd_type,
+                        '{cpp_class_name}TypeWrap::newUnixFD({value}, fdList)',
+                        '{cpp_class_name}TypeWrap::getUnixFD({variant}, fdList)')
+            return ('gint32', 'gint32', 'g_variant_new_handle({value})', 'g_variant_get_handle({variant})')
         elif sig == 'v':
-            return ('Glib::VariantBase', 'Glib::VariantBase', '', '', '')
+            return ('const Glib::VariantBase &', 'Glib::VariantBase',
+                    'g_variant_new_variant(const_cast<GVariant*>({value}.gobj()))',
+                    'Glib::VariantBase(g_variant_get_variant({variant}), false)')
         else:
-            return (None, None, None, None, None)
+            return (None, None, None, None)
 
 class Annotation:
     def __init__(self, key, value):
@@ -82,48 +136,50 @@ class Arg:
         self.signature = signature
         self.annotations = []
 
-    def post_process(self, arg_number):
+    def post_process(self, arg_number, containing_iface, unix_fds=False):
         if self.name == None:
             self.name = 'unnamed_arg%d'%arg_number
 
+        unix_fd_type = None
+        if unix_fds:
+            unix_fd_type = containing_iface.cpp_class_name + 'UnixFD'
+
+        # Large byte arrays can be passed in shared memory instead of the
+        # message body, the annotation value is the size threshold in bytes
+        self.shared_memory = None
+        shared_memory = utils.lookup_annotation(self.annotations, 'org.gdbus.codegen.glibmm.Arg.SharedMemory')
+        if shared_memory != None:
+            if self.signature != 'ay':
+                raise RuntimeError('SharedMemory annotation on argument %s of type %s, only ay is supported'%(self.name, self.signature))
+            if not shared_memory.isdigit():
+                raise RuntimeError('Invalid SharedMemory threshold %s for argument %s'%(shared_memory, self.name))
+            if unix_fds:
+                self.shared_memory = int(shared_memory)
+            else:
+                print "WARNING: shared memory can only be used for method arguments, passing %s inline" % self.name
+
+        (self.cpptype_in, self.cpptype_out, new_format, get_format) = TypeWrap.cppSignatureForDbusSignature(self.signature, containing_iface.string_type, unix_fd_type, self.shared_memory)
 
-        (self.cpptype_in, self.cpptype_out, self.cpptype_get, self.cpptype_get_cast, self.cpptype_to_dbus) = TypeWrap.cppSignatureForDbusSignature(self.signature)
-
-        self.cpptype_send = lambda name, param, cpp_class_name: "Glib::Variant<"+self.cpptype_get+"> "+name+" = Glib::Variant<"+self.cpptype_get+">::create(arg_"+param+");"
-        self.cppvalue_get = lambda varname, outvar, idx, cpp_class_name: "Glib::Variant<"+self.cpptype_in+"> "+varname+";\n    wrapped.get_child("+varname+","+idx+");\n    "+outvar+" = "+varname+".get();"
-
-        if self.signature == 'as':
-            self.cpptype_send = lambda name, param, cpp_class_name: "Glib::Variant<std::vector<Glib::ustring> > "+name+" = Glib::Variant<std::vector<Glib::ustring> >::create(" + cpp_class_name + "TypeWrap::stdStringVecToGlibStringVec(arg_" + param + "));"
-            self.cppvalue_get = lambda varname, outvar, idx, cpp_class_name: "Glib::VariantContainerBase "+varname+";\n" +\
-                                 "    wrapped.get_child("+varname+", "+idx+");\n" +\
-                                 "    " + cpp_class_name + "TypeWrap::unwrapList(".format(**locals())+outvar+", "+varname+");"
-        elif self.signature == 'ao':
-            self.cpptype_send = lambda name, param, cpp_class_name: "Glib::Variant<std::vector<std::string> > "+name+" = Glib::Variant<std::vector< std::string > >::create_from_object_paths(arg_"+param+");"
-            self.cppvalue_get = lambda varname, outvar, idx, cpp_class_name: "Glib::VariantContainerBase "+varname+";\n" +\
-                                 "    wrapped.get_child("+varname+", "+idx+");\n" +\
-                                 "    " + cpp_class_name + "TypeWrap::unwrapList(".format(**locals())+outvar+", "+varname+");"
-        elif self.signature == 'aay':
-            self.cpptype_send = lambda name, param, cpp_class_name: "Glib::Variant<std::vector<std::string> > "+name+" = Glib::Variant<std::vector<std::string> >::create(arg_"+param+");"
-            self.cppvalue_get = lambda varname, outvar, idx, cpp_class_name: "Glib::VariantContainerBase "+varname+";\n" +\
-                                 "    wrapped.get_child("+varname+", "+idx+");\n" +\
-                                 "    " + cpp_class_name + "TypeWrap::unwrapList("+outvar+", "+varname+");"
-        elif self.signature == 'g':
-            self.cpptype_send = lambda name, param, cpp_class_name: "Glib::VariantStringBase "+name+";\n Glib::VariantStringBase::create_signature("+name+", arg_"+param+".c_str());"
-        elif self.signature == 'o':
-            self.cpptype_send = lambda name, param, cpp_class_name: "Glib::VariantStringBase "+name+";\n Glib::VariantStringBase::create_object_path("+name+", arg_"+param+".c_str());"
-        elif self.signature == 'v':
-            self.cpptype_send = lambda name, param, cpp_class_name: "Glib::VariantBase params = arg_" + param + ";"
-            self.cppvalue_get = lambda varname, outvar, idx, cpp_class_name: 'GVariant *output;\n' +\
-                                '    g_variant_get_child(wrapped.gobj(), 0, "v", &output);\n\n' + "    " + outvar + ' = Glib::VariantBase(output);'
+        # The expressions refer to the fdList of the message
+        self.unix_fd_list = (unix_fds and self.signature == 'h') or self.shared_memory != None
 
         if (self.cpptype_in, self.cpptype_out) == (None, None):
             print "Unknown signature: " + self.signature
 
-            # default to GVariant
-            self.cpptype_in  = 'Glib::VariantBase'
+            # default to GVariant, passed through unchanged. The created
+            # variant is borrowed, consumers take their own reference.
+            self.cpptype_in  = 'const Glib::VariantBase &'
             self.cpptype_out  = 'Glib::VariantBase'
-            self.cpptype_send = lambda name, param: "Glib::VariantBase "+name+" = arg_"+param+";"
-            self.cppvalue_get = lambda varname, outvar, idx: "Glib::VariantBase "+varname+";\n  wrapped.get_child("+varname+","+idx+");\n  "+outvar+" = "+varname+";"
+            new_format = 'const_cast<GVariant*>({value}.gobj())'
+            get_format = 'Glib::VariantBase({variant}, true)'
+
+        self.gvariant_new = lambda value, cpp_class_name: new_format.format(value=value, cpp_class_name=cpp_class_name)
+        self.gvariant_get = lambda variant, cpp_class_name: get_format.format(variant=variant, cpp_class_name=cpp_class_name)
+
+        # Element type for arrays that can also be viewed without copying
+        self.fixed_array_element = None
+        if self.signature in TypeWrap.fixedArrayTypes:
+            self.fixed_array_element = TypeWrap.fixedArrayTypes[self.signature][0]
 
 class Method:
     def __init__(self, name):
@@ -132,7 +188,7 @@ class Method:
         self.out_args = []
         self.annotations = []
 
-    def post_process(self, interface_prefix, cns, cns_upper, cns_lower):
+    def post_process(self, interface_prefix, cns, cns_upper, cns_lower, containing_iface):
         name = self.name
         self.camel_name = name
 
@@ -141,13 +197,56 @@ class Method:
 
         arg_count = 0
         for a in self.in_args:
-            a.post_process(arg_count)
+            a.post_process(arg_count, containing_iface, True)
             arg_count += 1
 
         for a in self.out_args:
-            a.post_process(arg_count)
+            a.post_process(arg_count, containing_iface, True)
             arg_count += 1
 
+        # One-way methods are called without waiting for a reply
+        self.no_reply = (utils.lookup_annotation(self.annotations, 'org.freedesktop.DBus.Method.NoReply') == 'true')
+        if self.no_reply and len(self.out_args) > 0:
+            print "WARNING: method %s has out-arguments, ignoring the NoReply annotation" % self.name
+            self.no_reply = False
+
+        # Threaded methods are handled on a worker thread of the stub. The
+        # annotation on the method takes precedence over the one on the
+        # containing interface.
+        threaded = utils.lookup_annotation(self.annotations, 'org.gdbus.codegen.glibmm.Method.Threaded')
+        if threaded == None:
+            threaded = utils.lookup_annotation(containing_iface.annotations, 'org.gdbus.codegen.glibmm.Method.Threaded')
+        self.threaded = (threaded == 'true')
+
+        # File descriptors are passed in a Gio::UnixFDList next to the
+        # message body, which is only accessible for method calls
+        self.unix_fds = False
+        self.shared_memory = False
+        for a in self.in_args + self.out_args:
+            if a.unix_fd_list:
+                self.unix_fds = True
+            if a.shared_memory != None:
+                self.shared_memory = True
+
+        # Replies of methods without side effects can be cached by the proxy,
+        # the annotation value is the time to live in milliseconds
+        self.cacheable = None
+        cacheable = utils.lookup_annotation(self.annotations, 'org.gdbus.codegen.glibmm.Method.Cacheable')
+        if cacheable != None:
+            if not cacheable.isdigit():
+                raise RuntimeError('Invalid Cacheable time to live %s for method %s'%(cacheable, self.name))
+            if self.no_reply or self.unix_fds:
+                print "WARNING: replies of method %s can not be cached" % self.name
+            else:
+                self.cacheable = int(cacheable)
+
+        # Calls with the same arguments in progress at the same time are
+        # answered with the reply to the first one
+        self.single_flight = (utils.lookup_annotation(self.annotations, 'org.gdbus.codegen.glibmm.Method.SingleFlight') == 'true')
+        if self.single_flight and (self.no_reply or self.unix_fds):
+            print "WARNING: calls of method %s can not be shared" % self.name
+            self.single_flight = False
+
 class Signal:
     def __init__(self, name):
         self.name = name
@@ -160,9 +259,20 @@ class Signal:
         self.name_hyphen = self.name_lower.replace('_', '-')
         self.iface_name = containing_iface.name
 
+        # Emissions of the signal can be coalesced by the stub, the annotation
+        # value is the interval in milliseconds to send the latest one at most
+        self.coalesce = None
+        coalesce = utils.lookup_annotation(self.annotations, 'org.gdbus.codegen.glibmm.Signal.Coalesce')
+        if coalesce != None:
+            if not coalesce.isdigit():
+                raise RuntimeError('Invalid Coalesce interval %s for signal %s'%(coalesce, self.name))
+            self.coalesce = int(coalesce)
+
         arg_count = 0
         for a in self.args:
-            a.post_process(arg_count)
+            if a.signature == 'h':
+                print "WARNING: file descriptors can not be received from signal %s, passing the handle index" % self.name
+            a.post_process(arg_count, containing_iface)
             arg_count += 1
 
 class Property:
@@ -184,16 +294,7 @@ class Property:
         else:
             raise RuntimeError('Invalid access type %s'%self.access)
 
-        (self.cpptype_in, self.cpptype_out, self.cpptype_get, self.cpptype_get_cast, self.cpptype_to_dbus) = TypeWrap.cppSignatureForDbusSignature(signature)
-
-        if (self.cpptype_in, self.cpptype_out) == (None, None):
-            print "Unknown signature: " + self.signature
-
-            # default to GVariant
-            self.cpptype_in  = 'const Glib::VariantBase &'
-            self.cpptype_out  = 'Glib::VariantBase'
-
-    def post_process(self, interface_prefix, cns, cns_upper, cns_lower):
+    def post_process(self, interface_prefix, cns, cns_upper, cns_lower, containing_iface):
         name = self.name
         self.name_lower = utils.camel_case_to_uscore(name).lower().replace('-', '_')
         self.name_hyphen = self.name_lower.replace('_', '-')
@@ -201,9 +302,33 @@ class Property:
         if self.name_lower == 'type':
             self.name_lower = 'type_'
 
+        # The annotation on the property takes precedence over the one on the
+        # containing interface. If neither is present the default is 'true'.
+        self.emits_changed_signal = utils.lookup_annotation(self.annotations, 'org.freedesktop.DBus.Property.EmitsChangedSignal')
+        if self.emits_changed_signal == None:
+            self.emits_changed_signal = utils.lookup_annotation(containing_iface.annotations, 'org.freedesktop.DBus.Property.EmitsChangedSignal')
+        if self.emits_changed_signal == None:
+            self.emits_changed_signal = 'true'
+        if self.emits_changed_signal not in ('true', 'invalidates', 'const', 'false'):
+            raise RuntimeError('Invalid EmitsChangedSignal value %s for property %s'%(self.emits_changed_signal, self.name))
+
+        # Stored properties keep their current value as a GVariant in the
+        # stub, which answers Get/GetAll without calling into user code.
+        stored = utils.lookup_annotation(self.annotations, 'org.gdbus.codegen.glibmm.Property.Stored')
+        if stored == None:
+            stored = utils.lookup_annotation(containing_iface.annotations, 'org.gdbus.codegen.glibmm.Property.Stored')
+        self.stored = (stored == 'true')
+
         # recalculate arg
         self.arg.annotations = self.annotations
-        self.arg.post_process(0)
+        if self.signature == 'h':
+            print "WARNING: file descriptors can not be passed in property %s, passing the handle index" % self.name
+        self.arg.post_process(0, containing_iface)
+        self.cpptype_in = self.arg.cpptype_in
+        self.cpptype_out = self.arg.cpptype_out
+        self.gvariant_new = self.arg.gvariant_new
+        self.gvariant_get = self.arg.gvariant_get
+        self.fixed_array_element = self.arg.fixed_array_element
 
 class Interface:
     def __init__(self, name):
@@ -213,7 +338,8 @@ class Interface:
         self.properties = []
         self.annotations = []
 
-    def post_process(self, interface_prefix, c_namespace):
+    def post_process(self, interface_prefix, c_namespace, string_type='std::string'):
+        self.string_type = string_type
         if len(c_namespace) > 0:
             if utils.is_ugly_case(c_namespace):
                 cns = c_namespace.replace('_', '')
@@ -246,11 +372,26 @@ class Interface:
 
         self.name_hyphen = self.name_upper.lower().replace('_', '-')
 
+        self.unix_fds = False
+        self.shared_memory = False
+        self.threaded = False
+        self.cacheable = False
+        self.single_flight = False
         for m in self.methods:
-            m.post_process(interface_prefix, cns, cns_upper, cns_lower)
+            m.post_process(interface_prefix, cns, cns_upper, cns_lower, self)
+            if m.cacheable != None:
+                self.cacheable = True
+            if m.single_flight:
+                self.single_flight = True
+            if m.unix_fds:
+                self.unix_fds = True
+            if m.shared_memory:
+                self.shared_memory = True
+            if m.threaded:
+                self.threaded = True
 
         for s in self.signals:
             s.post_process(interface_prefix, cns, cns_upper, cns_lower, self)
 
         for p in self.properties:
-            p.post_process(interface_prefix, cns, cns_upper, cns_lower)
+            p.post_process(interface_prefix, cns, cns_upper, cns_lower, self)
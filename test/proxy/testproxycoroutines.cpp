@@ -0,0 +1,71 @@
+/* Built from code generated with --cpp-string-type=Glib::ustring and
+ * --cpp-coroutines, see CMakeLists.txt */
+#include "generated-coroutines/many-types_proxy.h"
+#include <coroutine>
+#include <exception>
+#include <iostream>
+#include <iomanip>
+
+void printStatus (std::string message, bool isOK) {
+    if (isOK) {
+        std::cout << std::setw(60) << std::left << message << std::right << "\033[32m[  OK  ]\033[0m" << std::endl;
+    } else {
+        std::cout << std::setw(60) << std::left << message << std::right << "\033[31m[ FAIL ]\033[0m" << std::endl;
+    }
+}
+
+/* Coroutine started eagerly and never awaited itself */
+struct Task {
+    struct promise_type {
+        Task get_return_object() { return Task(); }
+        std::suspend_never initial_suspend() noexcept { return {}; }
+        std::suspend_never final_suspend() noexcept { return {}; }
+        void return_void() {}
+        void unhandled_exception() { std::terminate(); }
+    };
+};
+
+Task run_tests(Glib::RefPtr<org::gdbus::codegen::glibmm::Test> proxy, Glib::RefPtr<Glib::MainLoop> ml) {
+    /* String */
+    Glib::ustring stringValue = "Hello world";
+    Glib::ustring stringRes = co_await proxy->TestString(stringValue);
+    printStatus ("Awaited string", stringRes == stringValue);
+
+    /* String array */
+    std::vector<Glib::ustring> stringVec = {"/org/gdbus/codegen/glibmm/Test/1", "/org/gdbus/codegen/glibmm/Test/2"};
+    std::vector<Glib::ustring> stringVecRes = co_await proxy->TestStringArray(stringVec);
+    printStatus ("Awaited string array", stringVecRes == stringVec);
+
+    /* Int */
+    gint32 intRes = co_await proxy->TestInt(1364);
+    printStatus ("Awaited int", intRes == 1364);
+
+    /* Cached replies are awaited too */
+    guint32 counter = 0;
+    proxy->TestCacheableCounter_sync(counter, 1000);
+    guint32 counterRes = co_await proxy->TestCacheableCounter();
+    printStatus ("Awaited cached reply", counterRes == counter);
+
+    /* Byte strings stay std::string */
+    std::string byteStringRes = co_await proxy->TestByteString("Byte string");
+    printStatus ("Awaited byte string", byteStringRes == "Byte string");
+
+    ml->quit();
+}
+
+void proxy_created(const Glib::RefPtr<Gio::AsyncResult> result, Glib::RefPtr<Glib::MainLoop> ml) {
+    run_tests(org::gdbus::codegen::glibmm::Test::createForBusFinish(result), ml);
+}
+
+int main() {
+    Glib::init();
+    Gio::init();
+
+    Glib::RefPtr<Glib::MainLoop> ml = Glib::MainLoop::create();
+    org::gdbus::codegen::glibmm::Test::createForBus(Gio::DBus::BUS_TYPE_SESSION,
+                                Gio::DBus::PROXY_FLAGS_NONE,
+                                "org.gdbus.codegen.glibmm.Test",
+                                "/org/gdbus/codegen/glibmm/Test",
+                                sigc::bind(sigc::ptr_fun(&proxy_created), ml));
+    ml->run();
+}
@@ -1,10 +1,15 @@
 #include "many-types_proxy.h"
 #include "another-service_proxy.h"
 #include "tools.h"
+#include <atomic>
 #include <iostream>
 #include <iomanip>
+#include <unistd.h>
 
 Glib::RefPtr<org::gdbus::codegen::glibmm::Test> proxy;
+Glib::RefPtr<org::gdbus::codegen::glibmm::Test> deviceProxy;
+org::gdbus::codegen::glibmm::TestObjectManagerClient *managerClient;
+Glib::RefPtr<org::gdbus::codegen::glibmm::Test> connectionProxy;
 
 void printStatus (std::string message, bool isOK) {
     if (isOK) {
@@ -50,6 +55,69 @@ void on_test_string_array_finished (const Glib::RefPtr<Gio::AsyncResult> result,
     printStatus ("String array", res == expected);
 }
 
+void on_test_double_array_finished (const Glib::RefPtr<Gio::AsyncResult> result, std::vector<double> expected) {
+    TestTypeWrap::FixedArrayView<double> res;
+    proxy->TestDoubleArray_finish(res, result);
+    printStatus ("Double array", res.toVector() == expected);
+}
+
+void on_test_file_descriptor_finished (const Glib::RefPtr<Gio::AsyncResult> result, std::string expected) {
+    TestUnixFD res;
+    proxy->TestFileDescriptor_finish(res, result);
+
+    char buffer[64];
+    ssize_t length = read(res.get(), buffer, sizeof(buffer));
+    printStatus ("File descriptor", length > 0 && std::string(buffer, length) == expected);
+}
+
+void on_test_shared_memory_finished (const Glib::RefPtr<Gio::AsyncResult> result, std::string expected) {
+    std::string res;
+    guint32 size = 0;
+    proxy->TestSharedMemory_finish(res, size, result);
+    printStatus ("Shared memory", res == expected && size == expected.size());
+}
+
+void on_test_threaded_finished (const Glib::RefPtr<Gio::AsyncResult> result, guint32 expected) {
+    guint32 res = 0;
+    proxy->TestThreaded_finish(res, result);
+    printStatus ("Threaded", res == expected * expected);
+}
+
+void on_test_cacheable_counter_finished (const Glib::RefPtr<Gio::AsyncResult> result, guint32 expected) {
+    guint32 res = 0;
+    proxy->TestCacheableCounter_finish(res, result);
+    printStatus ("Cached reply of a callback call", res == expected);
+}
+
+/* Calls of TestDeduplicated(7) sent by this process */
+std::atomic<int> deduplicatedCallsSent(0);
+
+Glib::RefPtr<Gio::DBus::Message> count_deduplicated_calls (const Glib::RefPtr<Gio::DBus::Connection>&,
+                                                          const Glib::RefPtr<Gio::DBus::Message> &message,
+                                                          bool incoming) {
+    if (!incoming && message->get_member() == "TestDeduplicated") {
+        guint32 param = 0;
+        g_variant_get(message->get_body().gobj(), "(u)", &param);
+        if (param == 7) {
+            deduplicatedCallsSent++;
+        }
+    }
+    return message;
+}
+
+void on_test_deduplicated_finished (const Glib::RefPtr<Gio::AsyncResult> result) {
+    static std::vector<guint32> results;
+    guint32 res = 0;
+    proxy->TestDeduplicated_finish(res, result);
+    results.push_back(res);
+    if (results.size() == 3) {
+        /* Answered by a single call of the handler */
+        printStatus ("Single flight", results[0] == results[1] && results[1] == results[2]);
+        /* Sent only once by the proxy */
+        printStatus ("Single flight in the proxy", deduplicatedCallsSent == 1);
+    }
+}
+
 void on_test_byte_string_finished (const Glib::RefPtr<Gio::AsyncResult> result, std::string expected) {
     std::string res;
     proxy->TestByteString_finish(res, result);
@@ -104,6 +172,55 @@ void on_test_int_finished (const Glib::RefPtr<Gio::AsyncResult> result, gint exp
     printStatus ("Int", res == expected);
 }
 
+void on_test_subtree_finished (const Glib::RefPtr<Gio::AsyncResult> result, gint expected) {
+    gint res;
+    deviceProxy->TestInt_finish(res, result);
+    printStatus ("Subtree object", res == expected);
+}
+
+void device_proxy_created(const Glib::RefPtr<Gio::AsyncResult> result) {
+    deviceProxy = org::gdbus::codegen::glibmm::Test::createForBusFinish(result);
+    deviceProxy->TestInt(1362, sigc::bind(sigc::ptr_fun(&on_test_subtree_finished), 1362));
+}
+
+void on_test_connection_finished (const Glib::RefPtr<Gio::AsyncResult> result, gint expected) {
+    gint res;
+    connectionProxy->TestInt_finish(res, result);
+    printStatus ("Proxy for connection", res == expected);
+}
+
+void connection_proxy_created(const Glib::RefPtr<Gio::AsyncResult> result) {
+    connectionProxy = org::gdbus::codegen::glibmm::Test::createForConnectionFinish(result);
+    connectionProxy->TestInt(1363, sigc::bind(sigc::ptr_fun(&on_test_connection_finished), 1363));
+}
+
+void on_managed_objects_loaded(const Glib::RefPtr<Gio::AsyncResult> result) {
+    managerClient->load_finish(result);
+    Glib::RefPtr<org::gdbus::codegen::glibmm::Test> object =
+        managerClient->getObject("/org/gdbus/codegen/glibmm/Test/Managed/1");
+    /* The properties come with GetManagedObjects */
+    printStatus ("Object manager", managerClient->getObjectPaths().size() == 2 &&
+                                   object && object->TestPropReadString_get() == "Value10");
+}
+
+void on_shared_properties_loaded(const Glib::RefPtr<Gio::AsyncResult> result,
+                                 std::shared_ptr<org::gdbus::codegen::glibmm::Test> proxy) {
+    proxy->loadProperties_finish(result);
+    /* Read from the cache filled by GetAll */
+    printStatus ("Properties of a lazy proxy loaded", proxy->TestPropReadString_get() == "Value10");
+}
+
+void on_test_cancelled_finished (const Glib::RefPtr<Gio::AsyncResult> result) {
+    gint res;
+    bool cancelled = false;
+    try {
+        proxy->TestInt_finish(res, result);
+    } catch (const Gio::Error &error) {
+        cancelled = error.code() == Gio::Error::CANCELLED;
+    }
+    printStatus ("Cancelled call", cancelled);
+}
+
 void on_test_uint16_finished (const Glib::RefPtr<Gio::AsyncResult> result, guint16 expected) {
     guint16 res;
     proxy->TestUInt16_finish(res, result);
@@ -280,6 +397,27 @@ void on_test_prop_read_write_boolean(const Glib::RefPtr<Gio::AsyncResult> result
     printStatus("Property (write/read): TestPropReadWriteBoolean", actual == expected);
 }
 
+void on_test_prop_invalidates_string_array(const Glib::RefPtr<Gio::AsyncResult> result,
+                                           const std::vector<std::string> &expected) {
+    proxy->TestPropInvalidatesStringArray_set_finish(result);
+    std::vector<std::string> actual = proxy->TestPropInvalidatesStringArray_get();
+    printStatus("Property (invalidates): TestPropInvalidatesStringArray", actual == expected);
+}
+
+void on_test_prop_no_emit_int(const Glib::RefPtr<Gio::AsyncResult> result,
+                              const gint &expected) {
+    proxy->TestPropNoEmitInt_set_finish(result);
+    gint actual = proxy->TestPropNoEmitInt_get();
+    printStatus("Property (no emit): TestPropNoEmitInt", actual == expected);
+}
+
+void on_test_prop_stored_string(const Glib::RefPtr<Gio::AsyncResult> result,
+                                const std::string &expected) {
+    proxy->TestPropStoredString_set_finish(result);
+    std::string actual = proxy->TestPropStoredString_get();
+    printStatus("Property (stored): TestPropStoredString", actual == expected);
+}
+
 void on_test_signal_byte_string_array_cb(const std::vector<std::string> s) {
     printStatus("Signal TestSignalByteStringArray", true);
 }
@@ -308,6 +446,18 @@ void on_test_signal_string_cb(const std::string s) {
     printStatus("Signal TestSignalString", true);
 }
 
+void on_test_signal_coalesced_cb(const guint32 n) {
+    static guint received = 0;
+    received++;
+    if (n == 10) {
+        printStatus("Signal TestSignalCoalesced", received == 2);
+    }
+}
+
+void on_test_signal_string_subscribed_cb(const std::string s) {
+    printStatus("Signal subscription with arg0", s == "No reply");
+}
+
 void on_test_signal_double_cb(const double s) {
     printStatus("Signal TestSignalDouble", true);
 }
@@ -355,6 +505,11 @@ void proxy_created(const Glib::RefPtr<Gio::AsyncResult> result) {
     inputObjPathVec.push_back("/org/gdbus/codegen/glibmm/Test");
     inputObjPathVec.push_back("/org/gdbus/codegen/glibmm/Test");
 
+    std::vector<double> doubleVec;
+    for (int i = 0; i < 1000; i++) {
+        doubleVec.push_back(i * 0.5);
+    }
+
     std::string bytestring = "Hello world!";
     std::string signatureValue = "b";
     std::string objectPath = "/foo";
@@ -384,6 +539,60 @@ void proxy_created(const Glib::RefPtr<Gio::AsyncResult> result) {
     /* String array */
     proxy->TestStringArray(inputObjPathVec, sigc::bind(sigc::ptr_fun(&on_test_string_array_finished), inputObjPathVec));
 
+    /* Double array */
+    proxy->TestDoubleArray(doubleVec, sigc::bind(sigc::ptr_fun(&on_test_double_array_finished), doubleVec));
+
+    /* File descriptor */
+    int pipeFds[2];
+    if (pipe(pipeFds) == 0) {
+        std::string pipeData = "Data through a pipe";
+        if (write(pipeFds[1], pipeData.c_str(), pipeData.size()) == (ssize_t)pipeData.size()) {
+            proxy->TestFileDescriptor(TestUnixFD(pipeFds[0]), sigc::bind(sigc::ptr_fun(&on_test_file_descriptor_finished), pipeData));
+        }
+        close(pipeFds[1]);
+    }
+
+    /* Shared memory, inline below the threshold */
+    std::string smallBlob("Small blob");
+    proxy->TestSharedMemory(smallBlob, sigc::bind(sigc::ptr_fun(&on_test_shared_memory_finished), smallBlob));
+
+    std::string largeBlob(1024 * 1024, '\0');
+    for (uint i = 0; i < largeBlob.size(); i++) {
+        largeBlob[i] = i % 251;
+    }
+    proxy->TestSharedMemory(largeBlob, sigc::bind(sigc::ptr_fun(&on_test_shared_memory_finished), largeBlob));
+
+    /* One-way call, answered with TestSignalString */
+    proxy->TestSignalString_subscribe(sigc::ptr_fun(&on_test_signal_string_subscribed_cb), "No reply");
+    proxy->TestNoReply("No reply");
+
+    /* Handled on a worker thread of the stub */
+    for (guint32 n = 0; n < 4; n++) {
+        proxy->TestThreaded(n, sigc::bind(sigc::ptr_fun(&on_test_threaded_finished), n));
+    }
+
+    /* Identical calls in progress at the same time */
+    Gio::DBus::Connection::get_sync(Gio::DBus::BUS_TYPE_SESSION)->add_filter(sigc::ptr_fun(&count_deduplicated_calls));
+    for (guint32 n = 0; n < 3; n++) {
+        proxy->TestDeduplicated(7, sigc::ptr_fun(&on_test_deduplicated_finished));
+    }
+
+    /* A blocking call waiting for an identical one gives up after its own timeout */
+    Glib::Threads::Thread *firstCall = Glib::Threads::Thread::create([]() {
+        guint32 res;
+        proxy->TestDeduplicated_sync(8, res);
+    });
+    g_usleep(10000);
+    bool timedOut = false;
+    try {
+        guint32 res;
+        proxy->TestDeduplicated_sync(8, res, 20);
+    } catch (const Gio::DBus::Error &error) {
+        timedOut = error.code() == Gio::DBus::Error::TIMED_OUT;
+    }
+    firstCall->join();
+    printStatus ("Single flight timeout", timedOut);
+
     /* Byte string */
     proxy->TestByteString(bytestring, sigc::bind(sigc::ptr_fun(&on_test_byte_string_finished), bytestring));
 
@@ -411,6 +620,45 @@ void proxy_created(const Glib::RefPtr<Gio::AsyncResult> result) {
     /* Int */
     proxy->TestInt(intValue, sigc::bind(sigc::ptr_fun(&on_test_int_finished), intValue));
 
+    /* Blocking call */
+    std::string syncResult;
+    proxy->TestString_sync(stringValue, syncResult, 1000);
+    printStatus("Blocking call", syncResult == stringValue);
+
+    /* Cached replies, until the cache is invalidated */
+    guint32 cached[3];
+    proxy->TestCacheable_sync(1, cached[0], 1000);
+    proxy->TestCacheable_sync(1, cached[1], 1000);
+    proxy->invalidateCache();
+    proxy->TestCacheable_sync(1, cached[2], 1000);
+    printStatus("Cached reply", cached[0] == cached[1] && cached[2] != cached[0]);
+
+    /* Cached replies of a method without in-arguments, for all calls */
+    guint32 counter[2];
+    proxy->TestCacheableCounter_sync(counter[0], 1000);
+    proxy->TestCacheableCounter_sync(counter[1], 1000);
+    printStatus("Cached reply without arguments", counter[0] == counter[1]);
+    proxy->TestCacheableCounter(sigc::bind(sigc::ptr_fun(&on_test_cacheable_counter_finished), counter[0]));
+
+    /* Pending calls, waited for together */
+    std::vector<std::shared_ptr<TestPendingCall> > pendingCalls;
+    for (gint n = 0; n < 10; n++) {
+        pendingCalls.push_back(proxy->TestInt_async(n));
+    }
+    bool pendingOk = true;
+    for (gint n = 0; n < 10; n++) {
+        gint res = -1;
+        proxy->TestInt_finish(res, pendingCalls[n]->wait());
+        pendingOk = pendingOk && res == n;
+    }
+    printStatus("Pending calls", pendingOk);
+
+    /* Cancelled call, with a timeout and flags */
+    Glib::RefPtr<Gio::Cancellable> cancellable = Gio::Cancellable::create();
+    proxy->TestInt(intValue, sigc::ptr_fun(&on_test_cancelled_finished), cancellable,
+                   1000, Gio::DBus::CALL_FLAGS_NO_AUTO_START);
+    cancellable->cancel();
+
     /* UInt16 */
     proxy->TestUInt16(uint16Value, sigc::bind(sigc::ptr_fun(&on_test_uint16_finished), uint16Value));
 
@@ -542,6 +790,26 @@ void proxy_created(const Glib::RefPtr<Gio::AsyncResult> result) {
     proxy->TestPropReadWriteChar_set('X', sigc::bind(sigc::ptr_fun(&on_test_prop_read_write_char), 'X'));
     proxy->TestPropReadWriteBoolean_set(true, sigc::bind(sigc::ptr_fun(&on_test_prop_read_write_boolean), true));
 
+    printStatus("Property (const): TestPropConstInt", proxy->TestPropConstInt_get() == 1358);
+
+    std::vector<std::string> PropInvalidatesStringArrayValue;
+    PropInvalidatesStringArrayValue.push_back("Invalidated");
+    proxy->TestPropInvalidatesStringArray_set(
+        PropInvalidatesStringArrayValue,
+        sigc::bind(sigc::ptr_fun(&on_test_prop_invalidates_string_array),
+                   PropInvalidatesStringArrayValue));
+
+    proxy->TestPropNoEmitInt_set(7338, sigc::bind(sigc::ptr_fun(&on_test_prop_no_emit_int), 7338));
+
+    printStatus("Property (read): TestPropStoredString", proxy->TestPropStoredString_get() == "Value30");
+
+    std::vector<gint32> PropReadIntArrayValue;
+    PropReadIntArrayValue.push_back(1360);
+    PropReadIntArrayValue.push_back(-1361);
+    printStatus("Property (read): TestPropReadIntArray", proxy->TestPropReadIntArray_get() == PropReadIntArrayValue);
+    printStatus("Property (view): TestPropReadIntArray", proxy->TestPropReadIntArray_get_view().toVector() == PropReadIntArrayValue);
+    proxy->TestPropStoredString_set("Stored", sigc::bind(sigc::ptr_fun(&on_test_prop_stored_string), "Stored"));
+
     proxy->TestSignalByteStringArray_signal.connect(sigc::ptr_fun(&on_test_signal_byte_string_array_cb));
     proxy->TestSignalObjectPathArray_signal.connect(sigc::ptr_fun(&on_test_signal_object_path_array_cb));
     proxy->TestSignalStringArray_signal.connect(sigc::ptr_fun(&on_test_signal_string_array_cb));
@@ -558,18 +826,59 @@ void proxy_created(const Glib::RefPtr<Gio::AsyncResult> result) {
     proxy->TestSignalInt16_signal.connect(sigc::ptr_fun(&on_test_signal_int16_cb));
     proxy->TestSignalChar_signal.connect(sigc::ptr_fun(&on_test_signal_char_cb));
     proxy->TestSignalBoolean_signal.connect(sigc::ptr_fun(&on_test_signal_boolean_cb));
+    proxy->TestSignalCoalesced_signal.connect(sigc::ptr_fun(&on_test_signal_coalesced_cb));
 }
 
 int main() {
     Glib::init();
     Gio::init();
 
+    /* The proxy is served from the context run by the main loop below. It
+     * is also the thread-default context, which receives the replies. */
+    Glib::RefPtr<Glib::MainContext> context = Glib::MainContext::create();
+    g_main_context_push_thread_default(context->gobj());
+    org::gdbus::codegen::glibmm::Test::createForBus(Gio::DBus::BUS_TYPE_SESSION,
+                                Gio::DBus::PROXY_FLAGS_NONE,
+                                "org.gdbus.codegen.glibmm.Test",
+                                "/org/gdbus/codegen/glibmm/Test",
+                                sigc::ptr_fun(&proxy_created),
+                                context);
+
+    /* Object of the subtree served by the stub */
     org::gdbus::codegen::glibmm::Test::createForBus(Gio::DBus::BUS_TYPE_SESSION,
+                                Gio::DBus::PROXY_FLAGS_NONE,
+                                "org.gdbus.codegen.glibmm.Test",
+                                "/org/gdbus/codegen/glibmm/Test/Devices/1",
+                                sigc::ptr_fun(&device_proxy_created));
+
+    /* Objects of an object manager, fetched with a single call */
+    managerClient = new org::gdbus::codegen::glibmm::TestObjectManagerClient(
+                                Gio::DBus::Connection::get_sync(Gio::DBus::BUS_TYPE_SESSION),
+                                "org.gdbus.codegen.glibmm.Test",
+                                "/org/gdbus/codegen/glibmm/Test/Managed");
+    managerClient->load(sigc::ptr_fun(&on_managed_objects_loaded));
+
+    /* Shared proxies, the lazy one is subscribed to signals by the second user */
+    std::shared_ptr<org::gdbus::codegen::glibmm::Test> sharedProxy =
+        org::gdbus::codegen::glibmm::Test::getShared(Gio::DBus::BUS_TYPE_SESSION,
+                                                     "org.gdbus.codegen.glibmm.Test",
+                                                     "/org/gdbus/codegen/glibmm/Test",
+                                                     true);
+    printStatus ("Lazy shared proxy", sharedProxy->TestPropReadString_get() == "Value10");
+    sharedProxy->loadProperties(sigc::bind(sigc::ptr_fun(&on_shared_properties_loaded), sharedProxy));
+    printStatus ("Shared proxy", sharedProxy ==
+        org::gdbus::codegen::glibmm::Test::getShared(Gio::DBus::BUS_TYPE_SESSION,
+                                                     "org.gdbus.codegen.glibmm.Test",
+                                                     "/org/gdbus/codegen/glibmm/Test"));
+
+    /* Proxy on an existing connection, checked against the introspection data */
+    org::gdbus::codegen::glibmm::Test::createForConnection(
+                                Gio::DBus::Connection::get_sync(Gio::DBus::BUS_TYPE_SESSION),
                                 Gio::DBus::PROXY_FLAGS_NONE,
                                 "org.gdbus.codegen.glibmm.Test",
                                 "/org/gdbus/codegen/glibmm/Test",
-                                sigc::ptr_fun(&proxy_created));
+                                sigc::ptr_fun(&connection_proxy_created));
 
-    Glib::RefPtr<Glib::MainLoop> ml = Glib::MainLoop::create();
+    Glib::RefPtr<Glib::MainLoop> ml = Glib::MainLoop::create(context);
     ml->run();
 }
@@ -18,8 +18,11 @@ cd .. ; rm -rf build ; mkdir build; cd build; cmake .. -DCODEGEN="$DIR/../gdbus-
 make
 ./proxytest&
 PROXY_PID=$!
+./proxytest-coroutines&
+COROUTINES_PID=$!
 
 sleep 1
 
 kill $STUB_PID
 kill $PROXY_PID
+kill $COROUTINES_PID
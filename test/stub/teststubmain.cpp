@@ -59,9 +59,20 @@ TestImpl::TestImpl() {
     m_PropReadWriteInt16Value = 1357;
     m_PropReadWriteCharValue = 'C';
     m_PropReadWriteBooleanValue= true;
+    m_PropInvalidatesStringArrayValue.push_back("Value29");
+    m_PropConstIntValue = 1358;
+    m_PropNoEmitIntValue = 1359;
+    m_PropReadIntArrayValue.push_back(1360);
+    m_PropReadIntArrayValue.push_back(-1361);
+    TestPropStoredString_set("Value30");
 }
 
-void TestImpl::TestVariant(Glib::VariantBase Param1, TestMessageHelper invocation)
+TestImpl::~TestImpl() {
+    // TestThreaded may still be running on a worker thread
+    stopThreads();
+}
+
+void TestImpl::TestVariant(const Glib::VariantBase &Param1, TestMessageHelper invocation)
 {
     std::string value;
     try {
@@ -78,13 +89,13 @@ void TestImpl::TestVariant(Glib::VariantBase Param1, TestMessageHelper invocatio
 }
 
 void TestImpl::TestByteStringArray (
-        std::vector<std::string>  Param1,
+        const std::vector<std::string> &Param1,
         TestMessageHelper invocation) {
     invocation.ret(Param1);
 }
 
 void TestImpl::TestObjectPathArray (
-        std::vector<std::string>  Param1,
+        const std::vector<std::string> &Param1,
         TestMessageHelper invocation) {
 
     std::vector<Glib::VariantBase> list;
@@ -99,32 +110,95 @@ void TestImpl::TestObjectPathArray (
 }
 
 void TestImpl::TestStringArray (
-        std::vector<std::string>  Param1,
+        const std::vector<std::string> &Param1,
+        TestMessageHelper invocation) {
+    invocation.ret(Param1);
+}
+
+void TestImpl::TestDoubleArray (
+        const std::vector<double> &Param1,
         TestMessageHelper invocation) {
     invocation.ret(Param1);
 }
 
+void TestImpl::TestFileDescriptor (
+        const TestUnixFD &Param1,
+        TestMessageHelper invocation) {
+    invocation.ret(Param1);
+}
+
+void TestImpl::TestSharedMemory (
+        const std::string &Param1,
+        TestMessageHelper invocation) {
+    invocation.ret(Param1, Param1.size());
+}
+
+void TestImpl::TestNoReply (
+        const std::string &Param1) {
+    TestSignalString_signal.emit(Param1);
+
+    /* Only the first and the last one are sent */
+    for (guint32 n = 1; n <= 10; n++) {
+        TestSignalCoalesced_signal.emit(n);
+    }
+}
+
+void TestImpl::TestThreaded (
+        guint32 Param1,
+        TestMessageHelper invocation) {
+    // Runs on a worker thread, the reply is sent from there
+    invocation.ret(Param1 * Param1);
+}
+
+void TestImpl::TestCacheable (
+        guint32 Param1,
+        TestMessageHelper invocation) {
+    // Counts the calls, so that cached replies can be told apart
+    static guint32 calls = 0;
+    invocation.ret(Param1 + calls++);
+}
+
+void TestImpl::TestCacheableCounter (
+        TestMessageHelper invocation) {
+    // Changes with every call, so that cached replies can be told apart
+    static guint32 calls = 0;
+    invocation.ret(calls++);
+}
+
+void TestImpl::TestDeduplicated (
+        guint32 Param1,
+        TestMessageHelper invocation) {
+    // Replies later, so that identical calls arrive in the meantime
+    static guint32 calls = 0;
+    guint32 result = Param1 + calls++;
+    Glib::signal_timeout().connect_once([invocation, result]() mutable {
+        invocation.ret(result);
+    }, 100);
+}
+
 void TestImpl::TestByteString (
-        std::string Param1,
+        const std::string &Param1,
         TestMessageHelper invocation) {
     invocation.ret(Param1);
 }
 
 void TestImpl::TestSignature (
-        std::string Param1,
+        const std::string &Param1,
         TestMessageHelper invocation) {
     invocation.ret(Glib::wrap(g_variant_new_signature(Param1.c_str())));
 }
 
 void TestImpl::TestObjectPath (
-        std::string Param1,
+        const std::string &Param1,
         TestMessageHelper invocation) {
     invocation.ret(Glib::wrap(g_variant_new_object_path(Param1.c_str())));
 }
 
 void TestImpl::TestString (
-        std::string Param1,
+        const std::string &Param1,
         TestMessageHelper invocation) {
+    // Only the caller receives this one
+    TestSignalString_emit_to(invocation.getMessage()->get_sender(), Param1);
     invocation.ret(Param1);
 }
 
@@ -183,13 +257,13 @@ void TestImpl::TestBoolean (
 }
 
 void TestImpl::TestAll (
-        std::vector<std::string>  in_Param1,
-        std::vector<std::string>  in_Param2,
-        std::vector<std::string>  in_Param3,
-        std::string in_Param4,
-        std::string in_Param5,
-        std::string in_Param6,
-        std::string in_Param7,
+        const std::vector<std::string> &in_Param1,
+        const std::vector<std::string> &in_Param2,
+        const std::vector<std::string> &in_Param3,
+        const std::string &in_Param4,
+        const std::string &in_Param5,
+        const std::string &in_Param6,
+        const std::string &in_Param7,
         double in_Param8,
         guint64 in_Param9,
         gint64 in_Param10,
@@ -258,27 +332,31 @@ guchar TestImpl::TestPropReadWriteChar_get() {return m_PropReadWriteCharValue;}
 bool TestImpl::TestPropReadWriteBoolean_get() {return m_PropReadWriteBooleanValue;}
 gint32 TestImpl::TestPropInternalReadPropertyChange_get() {return m_TestPropInternalReadPropertyChangeValue;}
 gint32 TestImpl::TestPropInternalReadWritePropertyChange_get() {return m_TestPropInternalReadWritePropertyChangeValue;}
+std::vector<std::string> TestImpl::TestPropInvalidatesStringArray_get() {return m_PropInvalidatesStringArrayValue;}
+gint32 TestImpl::TestPropConstInt_get() {return m_PropConstIntValue;}
+gint32 TestImpl::TestPropNoEmitInt_get() {return m_PropNoEmitIntValue;}
+std::vector<gint32> TestImpl::TestPropReadIntArray_get() {return m_PropReadIntArrayValue;}
 
 /* These are not used, so we just return a dummy value here */
-bool TestImpl::TestPropWriteByteStringArray_setHandler(std::vector<std::string>  value) {
+bool TestImpl::TestPropWriteByteStringArray_setHandler(const std::vector<std::string> &value) {
     return false;
 }
-bool TestImpl::TestPropWriteObjectPathArray_setHandler(std::vector<std::string>  value) {
+bool TestImpl::TestPropWriteObjectPathArray_setHandler(const std::vector<std::string> &value) {
     return false;
 }
-bool TestImpl::TestPropWriteStringArray_setHandler(std::vector<std::string>  value) {
+bool TestImpl::TestPropWriteStringArray_setHandler(const std::vector<std::string> &value) {
     return false;
 }
-bool TestImpl::TestPropWriteByteString_setHandler(std::string value) {
+bool TestImpl::TestPropWriteByteString_setHandler(const std::string &value) {
     return false;
 }
-bool TestImpl::TestPropWriteSignature_setHandler(std::string value) {
+bool TestImpl::TestPropWriteSignature_setHandler(const std::string &value) {
     return false;
 }
-bool TestImpl::TestPropWriteObjectPath_setHandler(std::string value) {
+bool TestImpl::TestPropWriteObjectPath_setHandler(const std::string &value) {
     return false;
 }
-bool TestImpl::TestPropWriteString_setHandler(std::string value) {
+bool TestImpl::TestPropWriteString_setHandler(const std::string &value) {
     return false;
 }
 bool TestImpl::TestPropWriteDouble_setHandler(double value) {
@@ -310,37 +388,37 @@ bool TestImpl::TestPropWriteBoolean_setHandler(bool value) {
 }
 /* End return dummy value warning */
 
-bool TestImpl::TestPropReadWriteByteStringArray_setHandler(std::vector<std::string>  value) {
+bool TestImpl::TestPropReadWriteByteStringArray_setHandler(const std::vector<std::string> &value) {
     m_PropReadWriteByteStringArrayValue = value;
     TestSignalByteStringArray_signal.emit(value);
     return true;
 }
-bool TestImpl::TestPropReadWriteObjectPathArray_setHandler(std::vector<std::string>  value) {
+bool TestImpl::TestPropReadWriteObjectPathArray_setHandler(const std::vector<std::string> &value) {
     m_PropReadWriteObjectPathArrayValue = value;
     TestSignalObjectPathArray_signal.emit(value);
     return true;
 }
-bool TestImpl::TestPropReadWriteStringArray_setHandler(std::vector<std::string>  value) {
+bool TestImpl::TestPropReadWriteStringArray_setHandler(const std::vector<std::string> &value) {
     m_PropReadWriteStringArrayValue = value;
     TestSignalStringArray_signal.emit(value);
     return true;
 }
-bool TestImpl::TestPropReadWriteByteString_setHandler(std::string value) {
+bool TestImpl::TestPropReadWriteByteString_setHandler(const std::string &value) {
     m_PropReadWriteByteStringValue = value;
     TestSignalByteString_signal.emit(value);
     return true;
 }
-bool TestImpl::TestPropReadWriteSignature_setHandler(std::string value) {
+bool TestImpl::TestPropReadWriteSignature_setHandler(const std::string &value) {
     m_PropReadWriteSignatureValue = value;
     TestSignalSignature_signal.emit(value);
     return true;
 }
-bool TestImpl::TestPropReadWriteObjectPath_setHandler(std::string value) {
+bool TestImpl::TestPropReadWriteObjectPath_setHandler(const std::string &value) {
     m_PropReadWriteObjectPathValue = value;
     TestSignalObjectPath_signal.emit(value);
     return true;
 }
-bool TestImpl::TestPropReadWriteString_setHandler(std::string value) {
+bool TestImpl::TestPropReadWriteString_setHandler(const std::string &value) {
     m_PropReadWriteStringValue = value;
     TestSignalString_signal.emit(value);
     return true;
@@ -401,6 +479,30 @@ bool TestImpl::TestPropInternalReadWritePropertyChange_setHandler(gint32 value)
     return true;
 }
 
+bool TestImpl::TestPropInvalidatesStringArray_setHandler(const std::vector<std::string> &value) {
+    m_PropInvalidatesStringArrayValue = value;
+    return true;
+}
+
+bool TestImpl::TestPropNoEmitInt_setHandler(gint32 value) {
+    m_PropNoEmitIntValue = value;
+    return true;
+}
+
+std::vector<Glib::ustring> enumerateDevices() {
+    std::vector<Glib::ustring> nodes;
+    nodes.push_back("0");
+    nodes.push_back("1");
+    return nodes;
+}
+
+std::shared_ptr<org::gdbus::codegen::glibmm::Test> lookupDevice(const Glib::ustring &node) {
+    if (node == "0" || node == "1") {
+        return std::shared_ptr<org::gdbus::codegen::glibmm::Test>(new TestImpl());
+    }
+    return std::shared_ptr<org::gdbus::codegen::glibmm::Test>();
+}
+
 int main() {
     Glib::init();
     Gio::init();
@@ -409,6 +511,22 @@ int main() {
     impl.connect(Gio::DBus::BUS_TYPE_SESSION,
                      "org.gdbus.codegen.glibmm.Test");
 
+    /* Objects below Devices are only created when accessed */
+    org::gdbus::codegen::glibmm::TestSubtree devices(sigc::ptr_fun(&enumerateDevices),
+                                                     sigc::ptr_fun(&lookupDevice));
+    devices.setIdleTimeout(10);
+    devices.register_subtree(Gio::DBus::Connection::get_sync(Gio::DBus::BUS_TYPE_SESSION),
+                             "/org/gdbus/codegen/glibmm/Test/Devices");
+
+    /* Objects listed by an object manager */
+    org::gdbus::codegen::glibmm::TestObjectManager manager;
+    manager.register_object(Gio::DBus::Connection::get_sync(Gio::DBus::BUS_TYPE_SESSION),
+                            "/org/gdbus/codegen/glibmm/Test/Managed");
+    manager.export_object(std::shared_ptr<org::gdbus::codegen::glibmm::Test>(new TestImpl()),
+                          "/org/gdbus/codegen/glibmm/Test/Managed/0");
+    manager.export_object(std::shared_ptr<org::gdbus::codegen::glibmm::Test>(new TestImpl()),
+                          "/org/gdbus/codegen/glibmm/Test/Managed/1");
+
     Glib::RefPtr<Glib::MainLoop> ml = Glib::MainLoop::create();
     ml->run();
 }
@@ -3,30 +3,53 @@
 class TestImpl : public org::gdbus::codegen::glibmm::Test {
 public:
     TestImpl();
+    ~TestImpl();
 
     void TestVariant (
-            Glib::VariantBase Param1,
+            const Glib::VariantBase &Param1,
             TestMessageHelper invocation);
     void TestByteStringArray (
-            std::vector<std::string>  Param1,
+            const std::vector<std::string> &Param1,
             TestMessageHelper invocation);
     void TestObjectPathArray (
-            std::vector<std::string>  Param1,
+            const std::vector<std::string> &Param1,
             TestMessageHelper invocation);
     void TestStringArray (
-            std::vector<std::string>  Param1,
+            const std::vector<std::string> &Param1,
+            TestMessageHelper invocation);
+    void TestDoubleArray (
+            const std::vector<double> &Param1,
+            TestMessageHelper invocation);
+    void TestFileDescriptor (
+            const TestUnixFD &Param1,
+            TestMessageHelper invocation);
+    void TestSharedMemory (
+            const std::string &Param1,
+            TestMessageHelper invocation);
+    void TestNoReply (
+            const std::string &Param1);
+    void TestThreaded (
+            guint32 Param1,
+            TestMessageHelper invocation);
+    void TestCacheable (
+            guint32 Param1,
+            TestMessageHelper invocation);
+    void TestCacheableCounter (
+            TestMessageHelper invocation);
+    void TestDeduplicated (
+            guint32 Param1,
             TestMessageHelper invocation);
     void TestByteString (
-            std::string Param1,
+            const std::string &Param1,
             TestMessageHelper invocation);
     void TestSignature (
-            std::string Param1,
+            const std::string &Param1,
             TestMessageHelper invocation);
     void TestObjectPath (
-            std::string Param1,
+            const std::string &Param1,
             TestMessageHelper invocation);
     void TestString (
-            std::string Param1,
+            const std::string &Param1,
             TestMessageHelper invocation);
     void TestDouble (
             double Param1,
@@ -56,13 +79,13 @@ public:
             bool Param1,
             TestMessageHelper invocation);
     void TestAll (
-            std::vector<std::string>  in_Param1,
-            std::vector<std::string>  in_Param2,
-            std::vector<std::string>  in_Param3,
-            std::string in_Param4,
-            std::string in_Param5,
-            std::string in_Param6,
-            std::string in_Param7,
+            const std::vector<std::string> &in_Param1,
+            const std::vector<std::string> &in_Param2,
+            const std::vector<std::string> &in_Param3,
+            const std::string &in_Param4,
+            const std::string &in_Param5,
+            const std::string &in_Param6,
+            const std::string &in_Param7,
             double in_Param8,
             guint64 in_Param9,
             gint64 in_Param10,
@@ -127,15 +150,19 @@ public:
     bool TestPropReadWriteBoolean_get();
     gint32 TestPropInternalReadPropertyChange_get();
     gint32 TestPropInternalReadWritePropertyChange_get();
+    std::vector<std::string> TestPropInvalidatesStringArray_get();
+    gint32 TestPropConstInt_get();
+    gint32 TestPropNoEmitInt_get();
+    std::vector<gint32> TestPropReadIntArray_get();
 
 
-bool TestPropWriteByteStringArray_setHandler(std::vector<std::string>  value);
-bool TestPropWriteObjectPathArray_setHandler(std::vector<std::string>  value);
-bool TestPropWriteStringArray_setHandler(std::vector<std::string>  value);
-bool TestPropWriteByteString_setHandler(std::string value);
-bool TestPropWriteSignature_setHandler(std::string value);
-bool TestPropWriteObjectPath_setHandler(std::string value);
-bool TestPropWriteString_setHandler(std::string value);
+bool TestPropWriteByteStringArray_setHandler(const std::vector<std::string> &value);
+bool TestPropWriteObjectPathArray_setHandler(const std::vector<std::string> &value);
+bool TestPropWriteStringArray_setHandler(const std::vector<std::string> &value);
+bool TestPropWriteByteString_setHandler(const std::string &value);
+bool TestPropWriteSignature_setHandler(const std::string &value);
+bool TestPropWriteObjectPath_setHandler(const std::string &value);
+bool TestPropWriteString_setHandler(const std::string &value);
 bool TestPropWriteDouble_setHandler(double value);
 bool TestPropWriteUInt64_setHandler(guint64 value);
 bool TestPropWriteInt64_setHandler(gint64 value);
@@ -145,13 +172,13 @@ bool TestPropWriteUInt16_setHandler(guint16 value);
 bool TestPropWriteInt16_setHandler(gint16 value);
 bool TestPropWriteChar_setHandler(guchar value);
 bool TestPropWriteBoolean_setHandler(bool value);
-bool TestPropReadWriteByteStringArray_setHandler(std::vector<std::string>  value);
-bool TestPropReadWriteObjectPathArray_setHandler(std::vector<std::string>  value);
-bool TestPropReadWriteStringArray_setHandler(std::vector<std::string>  value);
-bool TestPropReadWriteByteString_setHandler(std::string value);
-bool TestPropReadWriteSignature_setHandler(std::string value);
-bool TestPropReadWriteObjectPath_setHandler(std::string value);
-bool TestPropReadWriteString_setHandler(std::string value);
+bool TestPropReadWriteByteStringArray_setHandler(const std::vector<std::string> &value);
+bool TestPropReadWriteObjectPathArray_setHandler(const std::vector<std::string> &value);
+bool TestPropReadWriteStringArray_setHandler(const std::vector<std::string> &value);
+bool TestPropReadWriteByteString_setHandler(const std::string &value);
+bool TestPropReadWriteSignature_setHandler(const std::string &value);
+bool TestPropReadWriteObjectPath_setHandler(const std::string &value);
+bool TestPropReadWriteString_setHandler(const std::string &value);
 bool TestPropReadWriteDouble_setHandler(double value);
 bool TestPropReadWriteUInt64_setHandler(guint64 value);
 bool TestPropReadWriteInt64_setHandler(gint64 value);
@@ -161,13 +188,13 @@ bool TestPropReadWriteUInt16_setHandler(guint16 value);
 bool TestPropReadWriteInt16_setHandler(gint16 value);
 bool TestPropReadWriteChar_setHandler(guchar value);
 bool TestPropReadWriteBoolean_setHandler(bool value);
-bool TestPropReadByteStringArray_setHandler(std::vector<std::string>  value) {return true;}
-bool TestPropReadObjectPath_setHandler(std::string value) {return true;}
-bool TestPropReadByteString_setHandler(std::string) {return true;}
-bool TestPropReadSignature_setHandler(std::string) {return true;}
-bool TestPropReadString_setHandler(std::string) {return true;}
-bool TestPropReadObjectPathArray_setHandler(std::vector<std::string>  value) {return true;}
-bool TestPropReadStringArray_setHandler(std::vector<std::string>  value) {return true;}
+bool TestPropReadByteStringArray_setHandler(const std::vector<std::string> &value) {return true;}
+bool TestPropReadObjectPath_setHandler(const std::string &value) {return true;}
+bool TestPropReadByteString_setHandler(const std::string &) {return true;}
+bool TestPropReadSignature_setHandler(const std::string &) {return true;}
+bool TestPropReadString_setHandler(const std::string &) {return true;}
+bool TestPropReadObjectPathArray_setHandler(const std::vector<std::string> &value) {return true;}
+bool TestPropReadStringArray_setHandler(const std::vector<std::string> &value) {return true;}
 bool TestPropReadDouble_setHandler(double value) {return true;}
 bool TestPropReadUInt64_setHandler(guint64 value) {return true;}
 bool TestPropReadInt64_setHandler(gint64 value) {return true;}
@@ -179,6 +206,10 @@ bool TestPropReadInt16_setHandler(gint16 value) {return true;}
 bool TestPropReadBoolean_setHandler(bool value) {return true;}
 bool TestPropInternalReadPropertyChange_setHandler(gint32 value);
 bool TestPropInternalReadWritePropertyChange_setHandler(gint32 value);
+bool TestPropInvalidatesStringArray_setHandler(const std::vector<std::string> &value);
+bool TestPropConstInt_setHandler(gint32 value) {return true;}
+bool TestPropNoEmitInt_setHandler(gint32 value);
+bool TestPropReadIntArray_setHandler(const std::vector<gint32> &value) {return true;}
 
 private:
 std::vector<std::string> m_PropReadByteStringArrayValue;
@@ -231,4 +262,8 @@ guchar m_PropReadWriteCharValue;
 bool m_PropReadWriteBooleanValue;
 gint32 m_TestPropInternalReadPropertyChangeValue;
 gint32 m_TestPropInternalReadWritePropertyChangeValue;
+std::vector<std::string> m_PropInvalidatesStringArrayValue;
+gint32 m_PropConstIntValue;
+gint32 m_PropNoEmitIntValue;
+std::vector<gint32> m_PropReadIntArrayValue;
 };